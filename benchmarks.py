@@ -0,0 +1,365 @@
+"""Timing benchmarks for natcap.ui widgets.
+
+Run with ``python benchmarks.py``.  Qt's offscreen platform is used unless
+``QT_QPA_PLATFORM`` is already set.  Every timing is in seconds, so lower is
+better.
+
+To catch regressions, save the results as JSON and compare them with a
+stored baseline::
+
+    python benchmarks.py --output results.json --baseline benchmark_baseline.json
+
+The exit status is 1 if any benchmark is more than ``--threshold`` slower than
+its baseline.  Baselines depend on the machine, so regenerate
+``benchmark_baseline.json`` with ``--output`` when moving to another one.
+"""
+import os
+import sys
+import json
+import timeit
+import logging
+import argparse
+import functools
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from qtpy import QtWidgets
+from qtpy import QtGui
+
+try:
+    QApplication = QtGui.QApplication
+except AttributeError:
+    QApplication = QtWidgets.QApplication
+
+QT_APP = QApplication.instance()
+if QT_APP is None:
+    QT_APP = QApplication(sys.argv)
+
+
+def _blocks(n_items, block_size):
+    return range(0, n_items, block_size)
+
+
+def bench_multi_add_remove(n_items=1000, block_size=100):
+    """Time adding and then removing items of a Multi, block by block.
+
+    The time per block should stay flat as the Multi grows and shrinks.
+
+    Returns:
+        A dict with ``add`` and ``remove`` lists of per-block times, in
+        seconds.
+    """
+    from natcap.ui import inputs
+
+    form = inputs.Form()
+    multi = inputs.Multi(label='benchmark',
+                         callable_=functools.partial(inputs.Text, label='x'))
+    form.add_input(multi)
+    form.show()
+
+    add_times = []
+    for _ in _blocks(n_items, block_size):
+        start = timeit.default_timer()
+        for _ in range(block_size):
+            multi.add_item()
+        QT_APP.processEvents()
+        add_times.append(timeit.default_timer() - start)
+
+    remove_times = []
+    for _ in _blocks(n_items, block_size):
+        start = timeit.default_timer()
+        for _ in range(block_size):
+            # Remove from the middle, the worst case for a full re-layout.
+            multi.remove(len(multi.items) // 2)
+        QT_APP.processEvents()
+        remove_times.append(timeit.default_timer() - start)
+
+    form.close()
+    form.deleteLater()
+    return {'add': add_times, 'remove': remove_times}
+
+
+def bench_dropdown_options(n_options=50000, n_lookups=1000):
+    """Time setting many options on a Dropdown and looking values up.
+
+    Returns:
+        A dict of ``set_options``, ``set_value`` and ``search`` times, in
+        seconds.
+    """
+    from natcap.ui import inputs
+
+    dropdown = inputs.Dropdown(label='benchmark')
+    options = ['option %s' % index for index in range(n_options)]
+
+    start = timeit.default_timer()
+    dropdown.set_options(options)
+    set_options_time = timeit.default_timer() - start
+
+    step = max(1, n_options // n_lookups)
+    start = timeit.default_timer()
+    for index in range(0, n_options, step):
+        dropdown.set_value(options[index])
+    set_value_time = timeit.default_timer() - start
+
+    start = timeit.default_timer()
+    for query in ('o', 'op', 'opt', 'option 4', 'option 49'):
+        dropdown._model.search(query, limit=20)
+    search_time = timeit.default_timer() - start
+
+    dropdown.deleteLater()
+    return {'set_options': set_options_time,
+            'set_value': set_value_time,
+            'search': search_time}
+
+
+def bench_container_toggle(n_containers=50, n_inputs=10, n_toggles=10):
+    """Time collapsing and expanding nested Containers.
+
+    The form has an outer expandable Container holding ``n_containers``
+    expandable Containers of ``n_inputs`` Text inputs each.  Toggling one of
+    the inner Containers should cost much less than toggling the outer one,
+    since only its own inputs change.
+
+    Returns:
+        A dict of ``outer`` and ``inner`` times per collapse and expand, in
+        seconds.
+    """
+    from natcap.ui import inputs
+
+    form = inputs.Form()
+    outer = inputs.Container(label='outer', expandable=True, expanded=True)
+    form.add_input(outer)
+    inner_containers = []
+    for container_index in range(n_containers):
+        inner = inputs.Container(label='inner %s' % container_index,
+                                 expandable=True, expanded=True)
+        outer.add_input(inner)
+        for input_index in range(n_inputs):
+            inner.add_input(inputs.Text(label='text %s' % input_index))
+        inner_containers.append(inner)
+    form.show()
+    QT_APP.processEvents()
+
+    def _toggle(container):
+        start = timeit.default_timer()
+        for _ in range(n_toggles):
+            container.expanded = False
+            QT_APP.processEvents()
+            container.expanded = True
+            QT_APP.processEvents()
+        return (timeit.default_timer() - start) / (n_toggles * 2)
+
+    results = {'outer': _toggle(outer),
+               'inner': _toggle(inner_containers[n_containers // 2])}
+    form.close()
+    form.deleteLater()
+    return results
+
+
+def _build_form(n_inputs):
+    from natcap.ui import inputs
+
+    form = inputs.Form()
+    for index in range(n_inputs):
+        form.add_input(inputs.Text(label='text %s' % index,
+                                   args_key='text_%s' % index))
+    form.show()
+    QT_APP.processEvents()
+    return form
+
+
+def bench_form_build(sizes=(10, 100, 1000)):
+    """Time building and showing forms of Text inputs.
+
+    Returns:
+        A dict mapping each number of inputs to the time to build and show
+        the form, in seconds.
+    """
+    results = {}
+    for n_inputs in sizes:
+        start = timeit.default_timer()
+        form = _build_form(n_inputs)
+        results[n_inputs] = timeit.default_timer() - start
+        form.close()
+        form.deleteLater()
+    return results
+
+
+def bench_set_args(n_inputs=1000):
+    """Time setting the value of every input in a form at once.
+
+    Returns:
+        A dict of ``set_args``, the time to set every value and lay out the
+        form, and ``assemble_args``, the time to read every value back, in
+        seconds.
+    """
+    form = _build_form(n_inputs)
+    args = dict(('text_%s' % index, 'value %s' % index)
+                for index in range(n_inputs))
+
+    start = timeit.default_timer()
+    form.set_args(args)
+    QT_APP.processEvents()
+    set_args_time = timeit.default_timer() - start
+
+    start = timeit.default_timer()
+    form.assemble_args()
+    assemble_args_time = timeit.default_timer() - start
+
+    form.close()
+    form.deleteLater()
+    return {'set_args': set_args_time, 'assemble_args': assemble_args_time}
+
+
+def bench_validation(n_validations=100):
+    """Time a validation round trip, from a value change to its result.
+
+    Returns:
+        The mean time per validation, in seconds.
+    """
+    from natcap.ui import inputs
+
+    def _validate(args, limit_to=None):
+        return []
+
+    form = inputs.Form()
+    text = inputs.Text(label='text', args_key='text', validator=_validate)
+    form.add_input(text)
+    form.show()
+    QT_APP.processEvents()
+
+    finished = []
+    text._validator.finished.connect(finished.append)
+    start = timeit.default_timer()
+    for index in range(n_validations):
+        text.set_value('value %s' % index)
+        while len(finished) <= index:
+            QT_APP.processEvents()
+    mean_time = (timeit.default_timer() - start) / n_validations
+
+    form.close()
+    form.deleteLater()
+    return mean_time
+
+
+def bench_log_pane(n_messages=10000):
+    """Time logging many messages to a LogMessagePane.
+
+    Returns:
+        The time to log and display every message, in seconds.
+    """
+    from natcap.ui import inputs
+
+    log_pane = inputs.LogMessagePane()
+    log_pane.show()
+    handler = inputs.QLogHandler(log_pane)
+    logger = logging.getLogger('natcap.ui.benchmarks.log_pane')
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    logger.addHandler(handler)
+
+    start = timeit.default_timer()
+    for index in range(n_messages):
+        logger.info('Benchmark message %s', index)
+    QT_APP.processEvents()
+    elapsed = timeit.default_timer() - start
+
+    logger.removeHandler(handler)
+    log_pane.close()
+    log_pane.deleteLater()
+    return elapsed
+
+
+def run_benchmarks():
+    """Run every benchmark.
+
+    Returns:
+        A dict mapping benchmark names to times, in seconds.
+    """
+    results = {}
+    # The log pane is timed first, before any Form adds its run dialog's log
+    # handler to the root logger.
+    results['log_pane.10000_messages'] = bench_log_pane()
+
+    for n_inputs, elapsed in bench_form_build().items():
+        results['form_build.%s_inputs' % n_inputs] = elapsed
+
+    set_args = bench_set_args()
+    results['set_args.1000_inputs'] = set_args['set_args']
+    results['assemble_args.1000_inputs'] = set_args['assemble_args']
+
+    toggle = bench_container_toggle()
+    results['container_toggle.outer'] = toggle['outer']
+    results['container_toggle.inner'] = toggle['inner']
+
+    multi = bench_multi_add_remove()
+    results['multi.add_1000'] = sum(multi['add'])
+    results['multi.add_slowest_block'] = max(multi['add'])
+    results['multi.remove_1000'] = sum(multi['remove'])
+
+    dropdown = bench_dropdown_options()
+    for operation in ('set_options', 'set_value', 'search'):
+        results['dropdown.%s' % operation] = dropdown[operation]
+
+    results['validation.round_trip'] = bench_validation()
+    return results
+
+
+def compare(results, baseline, threshold, min_difference=0.001):
+    """Find benchmarks that are slower than their baseline.
+
+    Parameters:
+        results (dict): Benchmark times, in seconds.
+        baseline (dict): Baseline times, in seconds.
+        threshold (float): The fraction by which a time may exceed its
+            baseline, such as 0.5 for 50%.
+        min_difference=0.001 (float): Differences smaller than this many
+            seconds are treated as noise.
+
+    Returns:
+        A sorted list of (name, baseline time, time) tuples for each
+        regression.
+    """
+    regressions = []
+    for name, elapsed in sorted(results.items()):
+        if name not in baseline:
+            continue
+        baseline_elapsed = baseline[name]
+        if (elapsed > baseline_elapsed * (1 + threshold) and
+                elapsed - baseline_elapsed > min_difference):
+            regressions.append((name, baseline_elapsed, elapsed))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--output', help='Write results to this JSON file.')
+    parser.add_argument('--baseline',
+                        help='Compare results with this JSON file.')
+    parser.add_argument('--threshold', type=float, default=0.5,
+                        help=('Fraction by which a benchmark may be slower '
+                              'than its baseline. Default: %(default)s'))
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks()
+    for name, elapsed in sorted(results.items()):
+        print('%-32s %10.4f' % (name, elapsed))
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=4, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare(results, baseline, args.threshold)
+        for name, baseline_elapsed, elapsed in regressions:
+            print('REGRESSION %s: %.4f -> %.4f seconds' % (
+                name, baseline_elapsed, elapsed))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
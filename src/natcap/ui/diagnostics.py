@@ -0,0 +1,293 @@
+"""Tools for finding out why the UI is slow.
+
+These are opt-in and meant for reporting problems from the field.  For
+example, to log a warning with the Python stack whenever the event loop is
+blocked for more than half a second::
+
+    from natcap.ui import diagnostics
+    detector = diagnostics.StallDetector(threshold=0.5)
+    detector.start()
+
+To see how a change fans out through signals and slots, trace it and open
+the result in Perfetto::
+
+    tracer = diagnostics.start_tracing()
+    tracer.watch(some_input)
+    some_input.set_value('foo')
+    diagnostics.stop_tracing().export('trace.json')
+"""
+import os
+import sys
+import json
+import timeit
+import logging
+import functools
+import threading
+import traceback
+import contextlib
+import collections
+
+from qtpy import QtCore
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+def _handler_name(frame):
+    # The innermost natcap.ui function on the stack, outside this module.
+    while frame is not None:
+        module_name = frame.f_globals.get('__name__', '')
+        if module_name.startswith('natcap.ui') and module_name != __name__:
+            code = frame.f_code
+            return '%s.%s' % (module_name,
+                              getattr(code, 'co_qualname', code.co_name))
+        frame = frame.f_back
+    return None
+
+
+class StallDetector(QtCore.QObject):
+    """Detect stalls of the Qt event loop and log what was running.
+
+    A timer on the thread that creates the detector (normally the main
+    thread) fires every ``interval`` seconds.  How late it fires is recorded
+    in ``latencies``.  A background thread checks that the timer keeps
+    firing.  While it hasn't for more than ``threshold`` seconds, the
+    background thread samples the main thread's Python stack every
+    ``interval`` seconds, logging the first sample in case the event loop
+    never recovers.  When the stall ends, a warning is logged with the
+    natcap.ui function that was running in most samples, the last stack
+    sampled, and how long the stall lasted, and ``stalled`` is emitted with
+    the duration and the last stack.
+    """
+
+    stalled = QtCore.Signal(float, list)
+
+    def __init__(self, threshold=0.5, interval=0.05, parent=None):
+        QtCore.QObject.__init__(self, parent)
+        self.threshold = threshold
+        self.interval = interval
+        self.latencies = collections.deque(maxlen=1000)
+
+        self._main_thread_id = threading.current_thread().ident
+        self._lock = threading.Lock()
+        self._last_heartbeat = None
+        # Samples taken during the current stall: how often each handler
+        # was seen, and only the latest stack, however long the stall.
+        self._handlers = collections.Counter()
+        self._last_stack = None
+        self._stopped = threading.Event()
+        self._watcher = None
+
+        self._timer = QtCore.QTimer(self)
+        self._timer.setInterval(int(interval * 1000))
+        self._timer.timeout.connect(self._heartbeat)
+
+    def start(self):
+        """Start watching the event loop."""
+        with self._lock:
+            self._last_heartbeat = timeit.default_timer()
+            self._handlers = collections.Counter()
+            self._last_stack = None
+        self._stopped.clear()
+        self._timer.start()
+        self._watcher = threading.Thread(target=self._watch)
+        self._watcher.daemon = True
+        self._watcher.start()
+
+    def stop(self):
+        """Stop watching the event loop."""
+        self._timer.stop()
+        self._stopped.set()
+        if self._watcher is not None:
+            self._watcher.join()
+            self._watcher = None
+
+    def _heartbeat(self):
+        now = timeit.default_timer()
+        with self._lock:
+            latency = max(now - self._last_heartbeat - self.interval, 0.0)
+            self._last_heartbeat = now
+            handlers = self._handlers
+            stack = self._last_stack
+            self._handlers = collections.Counter()
+            self._last_stack = None
+        self.latencies.append(latency)
+
+        if latency < self.threshold or stack is None:
+            return
+        if handlers:
+            handler = handlers.most_common(1)[0][0]
+        else:
+            handler = 'unknown'
+        LOGGER.warning('Event loop stalled for %.2fs in %s.  Stack:\n%s',
+                       latency, handler, ''.join(stack))
+        self.stalled.emit(latency, stack)
+
+    def _watch(self):
+        while not self._stopped.wait(self.interval):
+            with self._lock:
+                stalled_for = timeit.default_timer() - self._last_heartbeat
+            if stalled_for < self.threshold:
+                continue
+            frame = sys._current_frames().get(self._main_thread_id)
+            if frame is None:
+                continue
+            handler = _handler_name(frame)
+            stack = traceback.format_stack(frame)
+            del frame  # Don't keep the main thread's frames alive.
+            with self._lock:
+                first_sample = self._last_stack is None
+                if handler:
+                    self._handlers[handler] += 1
+                self._last_stack = stack
+            if first_sample:
+                # Logged now in case the event loop never recovers.
+                LOGGER.warning('Event loop stalled for over %.2fs in %s',
+                               stalled_for, handler or 'unknown')
+
+
+class Tracer(object):
+    """Record timestamped spans, exportable as Chrome trace events.
+
+    Spans are recorded with ``span`` (or by functions decorated with
+    ``traced``) and signal emissions of watched objects with ``watch``.
+    ``export`` writes a JSON file that can be opened in Perfetto
+    (https://ui.perfetto.dev) or chrome://tracing.  Recording is thread-safe;
+    each thread gets its own track.
+    """
+
+    def __init__(self):
+        self._events = []
+        self._lock = threading.Lock()
+        self._thread_names = {}
+        self._start = timeit.default_timer()
+        self._pid = os.getpid()
+
+    def _timestamp(self):
+        # Microseconds since the tracer was created.
+        return (timeit.default_timer() - self._start) * 1e6
+
+    def _record(self, event):
+        thread = threading.current_thread()
+        event['pid'] = self._pid
+        event['tid'] = thread.ident
+        with self._lock:
+            self._thread_names[thread.ident] = thread.name
+            self._events.append(event)
+
+    @contextlib.contextmanager
+    def span(self, name, category='slot', args=None):
+        """Record the time spent in a ``with`` block as a span."""
+        start = self._timestamp()
+        try:
+            yield
+        finally:
+            event = {'name': name, 'cat': category, 'ph': 'X', 'ts': start,
+                     'dur': self._timestamp() - start}
+            if args:
+                event['args'] = args
+            self._record(event)
+
+    def instant(self, name, category='signal', args=None):
+        """Record a moment, such as a signal emission."""
+        event = {'name': name, 'cat': category, 'ph': 'i', 's': 't',
+                 'ts': self._timestamp()}
+        if args:
+            event['args'] = args
+        self._record(event)
+
+    def watch(self, qobject, label=None):
+        """Record an instant event whenever ``qobject`` emits a signal.
+
+        The event is recorded when Qt calls the tracer's connection, which
+        is after any slots connected before ``watch`` was called.
+
+        Parameters:
+            qobject (QObject): The object to watch.
+            label=None (string): Used in event names instead of the class
+                name.
+        """
+        if label is None:
+            label = qobject.__class__.__name__
+        meta_object = qobject.metaObject()
+        for index in range(meta_object.methodCount()):
+            method = meta_object.method(index)
+            if method.methodType() != QtCore.QMetaMethod.Signal:
+                continue
+            signal_name = bytes(method.name()).decode('utf-8')
+            signal = getattr(qobject, signal_name, None)
+            if signal is None or not hasattr(signal, 'connect'):
+                continue
+            try:
+                signal.connect(functools.partial(
+                    self._signal_emitted, '%s.%s' % (label, signal_name)))
+            except TypeError:
+                # Private or overloaded signals can't always be connected
+                # from python.
+                LOGGER.debug('Could not watch %s.%s', label, signal_name)
+
+    def _signal_emitted(self, name, *args):
+        self.instant(name, args={'args': repr(args)[:200]})
+
+    def events(self):
+        """Get the recorded events, in Chrome trace event format."""
+        with self._lock:
+            events = list(self._events)
+            thread_names = dict(self._thread_names)
+        for thread_id, thread_name in thread_names.items():
+            events.append({'name': 'thread_name', 'ph': 'M',
+                           'pid': self._pid, 'tid': thread_id,
+                           'args': {'name': thread_name}})
+        return events
+
+    def export(self, trace_path):
+        """Write the recorded events as a Chrome trace JSON file."""
+        with open(trace_path, 'w') as trace_file:
+            json.dump({'traceEvents': self.events(),
+                       'displayTimeUnit': 'ms'}, trace_file)
+
+
+# The tracer used by functions decorated with traced(), if tracing.
+_TRACER = None
+
+
+def start_tracing():
+    """Start recording spans from natcap.ui.
+
+    Returns:
+        The new ``Tracer``.
+    """
+    global _TRACER
+    _TRACER = Tracer()
+    return _TRACER
+
+
+def stop_tracing():
+    """Stop recording spans.
+
+    Returns:
+        The ``Tracer`` that was recording, or ``None``.
+    """
+    global _TRACER
+    tracer = _TRACER
+    _TRACER = None
+    return tracer
+
+
+def traced(category='slot'):
+    """Decorate a function to be recorded as a span while tracing.
+
+    When not tracing, the only cost is a global lookup per call.
+    """
+    def _decorator(func):
+        name = getattr(func, '__qualname__', func.__name__)
+
+        @functools.wraps(func)
+        def _traced(*args, **kwargs):
+            tracer = _TRACER
+            if tracer is None:
+                return func(*args, **kwargs)
+            with tracer.span(name, category):
+                return func(*args, **kwargs)
+        return _traced
+    return _decorator
@@ -1,15 +1,776 @@
 import threading
 import os
+import re
+import time
+import errno
+import shutil
+import hashlib
 import logging
+import contextlib
+import collections
 import pprint
 import traceback
 import tempfile
+import getpass
+import itertools
 
+import six
 from qtpy import QtCore
 
+from . import diagnostics
+from . import filesystem
+
 
 LOGGER = logging.getLogger(__name__)
 
+# Where staged inputs are kept, in the user's scratch directory under an
+# Executor's tempdir.
+STAGING_DIRNAME = 'staged_inputs'
+# The most bytes of staged inputs to keep between runs.
+STAGING_QUOTA = 10 * 2**30
+# Partial copies older than this many seconds were left by a crashed run.
+_PARTIAL_COPY_AGE = 3600
+
+# Where per-run scratch directories are made, under an Executor's tempdir,
+# followed by the user's name, since temporary directories may be shared.
+SCRATCH_DIRNAME = 'natcap_ui_runs'
+# Numbers default logfiles apart within a process.
+_LOGFILE_NUMBERS = itertools.count()
+# A RAM-backed filesystem for scratch space, where there is one.
+RAM_SCRATCH_ROOT = '/dev/shm'
+# Environment variables that tell a process where to put temporary files.
+_TEMPDIR_VARIABLES = ('TMPDIR', 'TEMP', 'TMP')
+
+# Limits of the write throughput probe.
+PROBE_BYTES = 64 * 2**20
+PROBE_SECONDS = 0.5
+_PROBE_BLOCKSIZE = 2**20
+
+# Where process statistics are read from, on linux.
+PROC_ROOT = '/proc'
+
+
+# Extensions of the sidecar files that are copied with a file, after its
+# name without its extension (aoi.shx for aoi.shp) ...
+_SIDECAR_EXTENSIONS = ('.shx', '.dbf', '.prj', '.cpg', '.qix', '.sbn',
+                       '.sbx', '.qpj', '.aux', '.aux.xml', '.ovr', '.rrd',
+                       '.tfw', '.tifw', '.wld', '.hdr', '.xml')
+# ... or after its whole name (dem.tif.aux.xml for dem.tif).
+_SIDECAR_SUFFIXES = ('.aux.xml', '.ovr', '.msk', '.xml')
+
+
+def _referenced_files(value):
+    # Every string in value, or nested in its dicts, lists and tuples, that
+    # names an existing file.
+    if isinstance(value, dict):
+        for item in value.values():
+            for path in _referenced_files(item):
+                yield path
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            for path in _referenced_files(item):
+                yield path
+    elif isinstance(value, six.string_types) and os.path.isfile(value):
+        yield value
+
+
+def _keyed_values(args, kwargs, keys):
+    # The values of keys in kwargs and in the dicts among args.
+    for mapping in [kwargs] + [arg for arg in args if isinstance(arg, dict)]:
+        for key in keys:
+            if key in mapping:
+                yield mapping[key]
+
+
+def _replace_paths(value, staged_paths):
+    if isinstance(value, dict):
+        return dict((key, _replace_paths(item, staged_paths))
+                    for (key, item) in value.items())
+    if isinstance(value, (list, tuple)):
+        return type(value)(_replace_paths(item, staged_paths)
+                           for item in value)
+    if isinstance(value, six.string_types) and value in staged_paths:
+        return staged_paths[value]
+    return value
+
+
+def _replace_keyed_paths(mapping, keys, staged_paths):
+    return dict((key, _replace_paths(item, staged_paths)
+                 if key in keys else item)
+                for (key, item) in mapping.items())
+
+
+def _file_group(path):
+    # A file and its sidecar files, such as a shapefile's .shx and .dbf or
+    # a raster's .aux.xml, which must be copied with it.
+    dirname, basename = os.path.split(os.path.abspath(path))
+    root = os.path.splitext(basename)[0]
+    sidecars = set((root + extension).lower()
+                   for extension in _SIDECAR_EXTENSIONS)
+    sidecars.update((basename + suffix).lower()
+                    for suffix in _SIDECAR_SUFFIXES)
+    names = [name for name in os.listdir(dirname)
+             if name == basename or name.lower() in sidecars]
+    return dirname, basename, sorted(names)
+
+
+def _owned_by_user(path):
+    # Whether path, and not just what it links to, belongs to this user.
+    # Windows has no uids; its temporary directories are per-user.
+    if not hasattr(os, 'getuid'):
+        return True
+    return os.lstat(path).st_uid == os.getuid()
+
+
+def _copy_matches(dirname, names, staged_dir):
+    # Whether the copies in staged_dir still have the sizes and
+    # modification times of the files they were copied from, which copy2
+    # preserves.
+    try:
+        for name in names:
+            source = os.stat(os.path.join(dirname, name))
+            copy = os.stat(os.path.join(staged_dir, name))
+            if (source.st_size != copy.st_size or
+                    int(source.st_mtime) != int(copy.st_mtime)):
+                return False
+    except OSError:
+        return False
+    return True
+
+
+def _directory_size(dirpath):
+    size = 0
+    for root, _, filenames in os.walk(dirpath):
+        for filename in filenames:
+            try:
+                size += os.path.getsize(os.path.join(root, filename))
+            except OSError:
+                pass
+    return size
+
+
+class InputStager(object):
+    """Copy input files to fast local storage before a run.
+
+    Each file is copied with its sidecar files into a directory of
+    ``staging_dir`` named for a fingerprint of their paths, sizes and
+    modification times.  A later run with the same, unchanged files reuses
+    the copies.  Copies are made by ``n_workers`` threads at once.  Files
+    that would take the copies past ``quota`` bytes, or past the space free
+    in ``staging_dir`` (which may be RAM), are used in place.  After
+    staging, the least recently used copies are removed until at most
+    ``quota`` bytes are left, never removing those the run uses.
+
+    A copy is only reused if this user owns it and it still matches the
+    files it was copied from, since a run may have written to it.
+    """
+
+    def __init__(self, staging_dir, quota=STAGING_QUOTA, n_workers=4):
+        self.staging_dir = staging_dir
+        self.quota = quota
+        self.n_workers = n_workers
+
+    def stage(self, args, kwargs, keys):
+        """Stage the input files named by some of a target's arguments.
+
+        Only files named by the values of ``keys``, in ``kwargs`` or in
+        the dicts among ``args``, are staged; other files, such as outputs
+        the target will overwrite, are left alone.  Files that can't be
+        copied are left where they are.
+
+        Returns:
+            A tuple of args and kwargs, with the paths of staged files
+            replaced by the paths of their copies.
+        """
+        if not os.path.isdir(self.staging_dir):
+            os.makedirs(self.staging_dir, 0o700)
+        keys = set(keys)
+        paths = sorted(set(_referenced_files(
+            list(_keyed_values(args, kwargs, keys)))))
+
+        # Check the copies will fit before making any.
+        budget = min(self.quota, free_space(self.staging_dir))
+        to_stage = []
+        for path in paths:
+            try:
+                location = self._locate(path)
+            except OSError:
+                LOGGER.warning('Could not stage %s, using it in place',
+                               path, exc_info=True)
+                continue
+            _, _, _, staged_path, size = location
+            if not os.path.exists(staged_path):
+                if size > budget:
+                    LOGGER.warning('Not staging %s, its %s would not fit in '
+                                   '%s', path, _format_bytes(size),
+                                   self.staging_dir)
+                    continue
+                budget -= size
+            to_stage.append((path, location))
+
+        staged_paths = {}
+        lock = threading.Lock()
+        remaining = iter(to_stage)
+
+        def _worker():
+            while True:
+                with lock:
+                    path, location = next(remaining, (None, None))
+                if path is None:
+                    return
+                try:
+                    staged_path = self._stage_file(path, location)
+                except (IOError, OSError):
+                    LOGGER.warning('Could not stage %s, using it in place',
+                                   path, exc_info=True)
+                    continue
+                with lock:
+                    staged_paths[path] = staged_path
+
+        workers = [threading.Thread(target=_worker)
+                   for _ in range(min(self.n_workers, len(to_stage)))]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        in_use = set(os.path.basename(os.path.dirname(staged_path))
+                     for staged_path in staged_paths.values())
+        self.clean(keep=in_use)
+        return (type(args)(_replace_keyed_paths(arg, keys, staged_paths)
+                           if isinstance(arg, dict) else arg
+                           for arg in args),
+                _replace_keyed_paths(kwargs, keys, staged_paths))
+
+    def _locate(self, path):
+        # Where a file and its sidecars are, where their copy goes, and
+        # their size.
+        dirname, basename, names = _file_group(path)
+        fingerprint = [dirname]
+        size = 0
+        for name in names:
+            stat_result = os.stat(os.path.join(dirname, name))
+            fingerprint.append((name, stat_result.st_size,
+                                stat_result.st_mtime))
+            size += stat_result.st_size
+        key = hashlib.sha1(repr(fingerprint).encode('utf-8')).hexdigest()
+        staged_dir = os.path.join(self.staging_dir, key)
+        staged_path = os.path.join(staged_dir, basename)
+        return dirname, names, staged_dir, staged_path, size
+
+    def _stage_file(self, path, location):
+        dirname, names, staged_dir, staged_path, _ = location
+        key = os.path.basename(staged_dir)
+
+        if os.path.exists(staged_path):
+            if not _owned_by_user(staged_dir):
+                raise OSError('%s is owned by another user' % staged_dir)
+            if _copy_matches(dirname, names, staged_dir):
+                LOGGER.info('Using staged copy of %s', path)
+                os.utime(staged_dir, None)  # Mark it as recently used.
+                return staged_path
+            LOGGER.info('Staged copy of %s has changed, staging it again',
+                        path)
+            shutil.rmtree(staged_dir)
+
+        start_time = time.time()
+        # Copy to a temporary directory and rename it, so that a copy is
+        # never half-made.
+        partial_dir = tempfile.mkdtemp(prefix=key + '.', suffix='.partial',
+                                       dir=self.staging_dir)
+        try:
+            for name in names:
+                shutil.copy2(os.path.join(dirname, name),
+                             os.path.join(partial_dir, name))
+            os.rename(partial_dir, staged_dir)
+        except OSError:
+            shutil.rmtree(partial_dir, ignore_errors=True)
+            if not os.path.exists(staged_path):
+                raise
+            # Another run staged the same files at the same time.
+        LOGGER.info('Staged %s in %.2fs', path, time.time() - start_time)
+        return staged_path
+
+    def clean(self, keep=()):
+        """Remove the least recently used copies until within the quota.
+
+        Parameters:
+            keep=() (iterable): Names of staged directories not to remove.
+        """
+        entries = []
+        total_size = 0
+        for name in os.listdir(self.staging_dir):
+            entry_path = os.path.join(self.staging_dir, name)
+            try:
+                last_used = os.path.getmtime(entry_path)
+            except OSError:
+                continue
+            if name.endswith('.partial'):
+                if time.time() - last_used > _PARTIAL_COPY_AGE:
+                    shutil.rmtree(entry_path, ignore_errors=True)
+                continue
+            size = _directory_size(entry_path)
+            total_size += size
+            entries.append((last_used, name, size))
+
+        for last_used, name, size in sorted(entries):
+            if total_size <= self.quota:
+                break
+            if name in keep:
+                continue
+            LOGGER.debug('Removing staged inputs %s', name)
+            shutil.rmtree(os.path.join(self.staging_dir, name),
+                          ignore_errors=True)
+            total_size -= size
+
+
+def _user_name():
+    try:
+        return getpass.getuser()
+    except Exception:
+        # No name in the environment or the password database.
+        return str(os.getuid()) if hasattr(os, 'getuid') else 'unknown'
+
+
+def _process_exists(pid):
+    if os.name == 'nt':
+        # os.kill would terminate the process on Windows.
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # query access
+        if not handle:
+            return False
+        kernel32.CloseHandle(handle)
+        return True
+    try:
+        os.kill(pid, 0)
+    except OSError as error:
+        return error.errno == errno.EPERM
+    return True
+
+
+class ScratchSpace(object):
+    """A temporary directory for one run, removed when the run ends.
+
+    Scratch directories are made in a ``natcap_ui_runs-<user>`` directory
+    under ``root``, which defaults to the system temporary directory, or to
+    ``RAM_SCRATCH_ROOT`` if ``in_memory`` is True and it exists.  Each
+    directory's name includes the id of the process that made it, so that
+    directories left by crashed processes are removed by the next ``create``.
+    The ``natcap_ui_runs-<user>`` directory is only accessible to the user,
+    and ``create`` refuses one that another user owns.
+
+    While ``active``, the directory is where ``tempfile`` and child
+    processes put temporary files, and if ``quota`` bytes are exceeded a
+    warning is logged and ``quota_exceeded`` is set.  The run can't be
+    stopped safely, since it shares this process.
+    """
+
+    def __init__(self, root=None, quota=None, in_memory=False,
+                 check_interval=5.0):
+        if root is None:
+            if in_memory and os.path.isdir(RAM_SCRATCH_ROOT):
+                root = RAM_SCRATCH_ROOT
+            else:
+                if in_memory:
+                    LOGGER.warning('%s does not exist, scratch space will '
+                                   'be on disk', RAM_SCRATCH_ROOT)
+                root = tempfile.gettempdir()
+        self.root = root
+        self.runs_dir = os.path.join(
+            root, '%s-%s' % (SCRATCH_DIRNAME, _user_name()))
+        self.quota = quota
+        self.check_interval = check_interval
+        self.path = None
+        self.quota_exceeded = False
+
+    def create(self):
+        """Remove orphaned scratch directories and make a new one.
+
+        Returns:
+            The path to the new directory.
+        """
+        if not os.path.isdir(self.runs_dir):
+            os.makedirs(self.runs_dir, 0o700)
+        if not _owned_by_user(self.runs_dir):
+            raise OSError('%s is owned by another user' % self.runs_dir)
+        self.remove_orphans()
+        self.path = tempfile.mkdtemp(prefix='run-%s-' % os.getpid(),
+                                     dir=self.runs_dir)
+        return self.path
+
+    def remove_orphans(self):
+        """Remove scratch directories and logfiles whose process no longer
+        exists."""
+        for name in os.listdir(self.runs_dir):
+            match = re.match(r'^run-(\d+)-', name)
+            if match is None or _process_exists(int(match.group(1))):
+                continue
+            LOGGER.info('Removing scratch space left by process %s: %s',
+                        match.group(1), name)
+            orphan = os.path.join(self.runs_dir, name)
+            if os.path.isdir(orphan):
+                shutil.rmtree(orphan, ignore_errors=True)
+            else:
+                try:
+                    os.remove(orphan)
+                except OSError:
+                    pass
+
+    def usage(self):
+        """Get the number of bytes in the scratch directory."""
+        return _directory_size(self.path)
+
+    @contextlib.contextmanager
+    def active(self):
+        """Make the scratch directory the process's temporary directory.
+
+        ``tempfile.tempdir`` and the ``TMPDIR``, ``TEMP`` and ``TMP``
+        environment variables are set for the duration, and restored after.
+        These are process-wide, so threads other than the run's are
+        affected too.
+        """
+        old_tempdir = tempfile.tempdir
+        old_environment = dict((name, os.environ.get(name))
+                               for name in _TEMPDIR_VARIABLES)
+        for name in _TEMPDIR_VARIABLES:
+            os.environ[name] = self.path
+        tempfile.tempdir = self.path
+
+        stopped = threading.Event()
+        watcher = None
+        if self.quota is not None:
+            watcher = threading.Thread(target=self._watch_quota,
+                                       args=(stopped,))
+            watcher.daemon = True
+            watcher.start()
+        try:
+            yield self.path
+        finally:
+            stopped.set()
+            if watcher is not None:
+                watcher.join()
+            tempfile.tempdir = old_tempdir
+            for name, value in old_environment.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+
+    def _watch_quota(self, stopped):
+        while not stopped.wait(self.check_interval):
+            usage = self.usage()
+            if usage > self.quota and not self.quota_exceeded:
+                self.quota_exceeded = True
+                LOGGER.warning(
+                    'Scratch space %s uses %s bytes, more than its quota '
+                    'of %s bytes', self.path, usage, self.quota)
+
+    def remove(self):
+        """Remove the scratch directory."""
+        if self.path is not None:
+            shutil.rmtree(self.path, ignore_errors=True)
+            self.path = None
+
+
+def _existing_ancestor(path):
+    # The folder itself, or the nearest of its parents that exists, since
+    # a workspace is often created by the run.
+    path = os.path.abspath(path)
+    while not os.path.isdir(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return path
+
+
+def free_space(path):
+    """Get the bytes available to us on the filesystem holding ``path``.
+
+    ``path`` needn't exist yet; its nearest existing parent is used.
+    """
+    path = _existing_ancestor(path)
+    if hasattr(shutil, 'disk_usage'):
+        return shutil.disk_usage(path).free
+    # Python 2 on posix.
+    stat_result = os.statvfs(path)
+    return stat_result.f_bavail * stat_result.f_frsize
+
+
+def measure_write_throughput(path, max_bytes=PROBE_BYTES,
+                             max_seconds=PROBE_SECONDS):
+    """Measure the sequential write throughput of a folder.
+
+    A temporary file is written in blocks, each synced to disk before the
+    next, until ``max_bytes`` have been written or ``max_seconds`` have
+    passed.  Syncing each block keeps a slow disk from hiding a backlog of
+    cached writes that would make a last sync take far longer than
+    ``max_seconds``.  The file is then removed.
+
+    Parameters:
+        path (string): The folder.  If it doesn't exist, its nearest
+            existing parent is measured.
+        max_bytes=PROBE_BYTES (int): The most bytes to write.
+        max_seconds=PROBE_SECONDS (float): About the longest to write for,
+            exceeded by at most the time to write and sync one block.
+
+    Returns:
+        The throughput, in bytes per second.
+    """
+    block = b'\0' * _PROBE_BLOCKSIZE
+    handle, probe_path = tempfile.mkstemp(prefix='.natcap_ui_probe',
+                                          dir=_existing_ancestor(path))
+    written = 0
+    try:
+        start_time = time.time()
+        elapsed = 0
+        try:
+            while written < max_bytes and elapsed < max_seconds:
+                written += os.write(handle, block)
+                os.fsync(handle)
+                elapsed = time.time() - start_time
+        finally:
+            os.close(handle)
+    finally:
+        os.remove(probe_path)
+    return written / max(elapsed, 1e-6)
+
+
+def _format_bytes(n_bytes):
+    return '%.1f MB' % (n_bytes / float(2**20))
+
+
+def preflight(out_folder, required_space=None, min_write_speed=None):
+    """Check that a folder has room for a run's outputs and is fast enough.
+
+    Parameters:
+        out_folder (string): Where the run will write its outputs.
+        required_space=None (int): The bytes the run is expected to write.
+            Free space isn't checked if ``None``.
+        min_write_speed=None (float): The slowest acceptable sequential
+            write throughput, in bytes per second.  Throughput isn't
+            measured if ``None``.
+
+    Returns:
+        A list of problems found, each a sentence describing it.
+    """
+    problems = []
+    try:
+        if required_space is not None:
+            available = free_space(out_folder)
+            if available < required_space:
+                problems.append(
+                    'Only %s are free where outputs will be written (%s), '
+                    'but about %s are needed.' % (
+                        _format_bytes(available), out_folder,
+                        _format_bytes(required_space)))
+        if min_write_speed is not None:
+            throughput = measure_write_throughput(out_folder)
+            if throughput < min_write_speed:
+                problems.append(
+                    'Writing to %s is slow: %s/s, where at least %s/s is '
+                    'expected.' % (out_folder, _format_bytes(throughput),
+                                   _format_bytes(min_write_speed)))
+    except (IOError, OSError) as error:
+        problems.append('Could not check %s: %s' % (out_folder, error))
+    return problems
+
+
+ResourceSample = collections.namedtuple(
+    'ResourceSample', ['time', 'cpu_percent', 'rss', 'read_rate',
+                       'write_rate', 'available_memory', 'total_memory'])
+
+
+def _read_proc_file(pid, name):
+    with open(os.path.join(PROC_ROOT, str(pid), name), 'rb') as proc_file:
+        return proc_file.read().decode('utf-8', 'replace')
+
+
+def _child_pids(pid):
+    # The live descendants of a process.  /proc/<pid>/task/<tid>/children
+    # needs linux 3.5 or later; without it, children aren't included.
+    children = []
+    try:
+        thread_ids = os.listdir(os.path.join(PROC_ROOT, str(pid), 'task'))
+    except OSError:
+        return children
+    for thread_id in thread_ids:
+        try:
+            text = _read_proc_file(pid, os.path.join('task', thread_id,
+                                                     'children'))
+        except (IOError, OSError):
+            continue
+        for child_pid in text.split():
+            children.append(int(child_pid))
+            children.extend(_child_pids(child_pid))
+    return children
+
+
+def process_counters(pid):
+    """Read a process's cumulative CPU time, memory and I/O from /proc.
+
+    Returns:
+        A dict of ``cpu_seconds`` (user and system time, including children
+        that have been waited for), ``rss`` (resident bytes), and
+        ``read_bytes`` and ``write_bytes`` (storage I/O, which is 0 if
+        /proc/<pid>/io can't be read), or ``None`` if the process can't be
+        read, such as when it has exited or there is no /proc.
+    """
+    try:
+        stat = _read_proc_file(pid, 'stat')
+    except (IOError, OSError):
+        return None
+    # The command name is in parentheses and may contain spaces.
+    fields = stat[stat.rindex(')') + 2:].split()
+    # utime, stime, cutime and cstime are fields 14 to 17 of stat, and rss
+    # field 24; fields here start at field 3.
+    clock_ticks = float(os.sysconf('SC_CLK_TCK'))
+    counters = {
+        'cpu_seconds': sum(int(field) for field in fields[11:15]) /
+        clock_ticks,
+        'rss': int(fields[21]) * os.sysconf('SC_PAGE_SIZE'),
+        'read_bytes': 0,
+        'write_bytes': 0,
+    }
+    try:
+        for line in _read_proc_file(pid, 'io').splitlines():
+            key, _, value = line.partition(':')
+            if key in ('read_bytes', 'write_bytes'):
+                counters[key] = int(value)
+    except (IOError, OSError):
+        pass
+    return counters
+
+
+def system_memory():
+    """Get the system's available and total memory, from /proc.
+
+    Returns:
+        A tuple of the bytes available without swapping (``MemAvailable``,
+        or ``MemFree`` on linux before 3.14) and the total bytes, or
+        ``(None, None)`` if /proc/meminfo can't be read.
+    """
+    try:
+        with open(os.path.join(PROC_ROOT, 'meminfo')) as meminfo:
+            values = dict(line.split(':', 1) for line in meminfo)
+        available = values.get('MemAvailable', values['MemFree'])
+        total = values['MemTotal']
+    except (IOError, OSError, ValueError, KeyError):
+        return None, None
+    # Values are in kB.
+    return int(available.split()[0]) * 1024, int(total.split()[0]) * 1024
+
+
+class ResourceSampler(QtCore.QObject):
+    """Sample a process's CPU, memory and I/O use from /proc.
+
+    A background thread reads the process's counters every ``interval``
+    seconds, and ``sampled`` is emitted with a ``ResourceSample`` of its
+    CPU utilization (in percent of one core), resident memory, read and
+    write rates (in bytes per second) and the system's available and total
+    memory.
+    Each sample reads a few small files, so sampling costs next to nothing.
+    Live child processes are included if ``include_children`` is True.
+
+    Since an Executor runs its target in a thread, the process sampled is
+    this one by default, and its CPU time includes the GUI's.  Where there
+    is no /proc, nothing is sampled.
+    """
+
+    sampled = QtCore.Signal(object)
+
+    def __init__(self, pid=None, interval=1.0, include_children=True,
+                 parent=None):
+        QtCore.QObject.__init__(self, parent)
+        if pid is None:
+            pid = os.getpid()
+        self.pid = pid
+        self.interval = interval
+        self.include_children = include_children
+        self._thread = None
+        self._stopped = threading.Event()
+
+        # The thread relays samples while holding _emit_lock and only if it
+        # hasn't been stopped, so that once stopped it never calls a sampler
+        # that may have been destroyed.
+        self._relay_sampled = filesystem.ThreadRelay(
+            self, '_finished_sampling')
+        self._emit_lock = threading.Lock()
+
+    def _finished_sampling(self, sample):
+        self.sampled.emit(sample)
+
+    def start(self):
+        """Start sampling, if /proc can be read."""
+        self.stop()
+        if process_counters(self.pid) is None:
+            LOGGER.debug('Cannot read %s for process %s, not sampling',
+                         PROC_ROOT, self.pid)
+            return
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._sample,
+                                        args=(self._stopped,))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def is_sampling(self):
+        """Whether the sampling thread is running."""
+        return self._thread is not None
+
+    def stop(self):
+        """Stop sampling.  Nothing is emitted after this returns, though it
+        doesn't wait for the thread to exit."""
+        if self._thread is None:
+            return
+        with self._emit_lock:
+            self._stopped.set()
+        self._thread = None
+
+    def _counters(self):
+        # Counters of the process and its live children.  A child's CPU
+        # time moves to the process's cutime when it is waited for, so
+        # CPU time doesn't drop when a child exits.
+        totals = process_counters(self.pid)
+        if totals is None or not self.include_children:
+            return totals
+        for child_pid in _child_pids(self.pid):
+            counters = process_counters(child_pid)
+            if counters is None:
+                continue
+            for key, value in counters.items():
+                totals[key] += value
+        return totals
+
+    def _sample(self, stopped):
+        previous = self._counters()
+        previous_time = time.time()
+        while not stopped.wait(self.interval):
+            counters = self._counters()
+            now = time.time()
+            if counters is None:
+                return  # The process has exited.
+            elapsed = max(now - previous_time, 1e-6)
+
+            def _rate(key):
+                return max(counters[key] - previous[key], 0) / elapsed
+
+            available, total = system_memory()
+            sample = ResourceSample(
+                time=now,
+                cpu_percent=_rate('cpu_seconds') * 100,
+                rss=counters['rss'],
+                read_rate=_rate('read_bytes'),
+                write_rate=_rate('write_bytes'),
+                available_memory=available,
+                total_memory=total)
+            with self._emit_lock:
+                if stopped.is_set():
+                    return
+                self._relay_sampled(sample)
+            previous = counters
+            previous_time = now
+
 
 class Executor(QtCore.QObject, threading.Thread):
     """Executor represents a thread of control that runs a python function with
@@ -30,15 +791,28 @@ class Executor(QtCore.QObject, threading.Thread):
     and saved locally for retrieval later on.
     In keeping with convention, a single Executor thread instance is only
     designed to be run once.  To run the same function again, it is best to
-    create a new Executor instance and run that."""
+    create a new Executor instance and run that.
+    Each run gets its own ScratchSpace under tempdir, made when it starts,
+    which is the run's temporary directory while it runs and is removed when
+    it finishes.  The default logfile is kept beside it, so it outlives the
+    run, and is removed like an orphaned scratch directory once this process
+    has exited.  Nothing is made until the run starts.
+    Files named by the args keys in stage_inputs are first copied there by
+    an InputStager."""
 
     finished = QtCore.Signal()
 
-    def __init__(self, target, args, kwargs, logfile, tempdir=None):
+    def __init__(self, target, args, kwargs, logfile, tempdir=None,
+                 stage_inputs=(), staging_quota=STAGING_QUOTA,
+                 scratch_quota=None, scratch_in_memory=False):
         QtCore.QObject.__init__(self)
         threading.Thread.__init__(self)
         self.target = target
         self.tempdir = tempdir
+        self.stage_inputs = stage_inputs
+        self.staging_quota = staging_quota
+        self.scratch = ScratchSpace(tempdir, quota=scratch_quota,
+                                    in_memory=scratch_in_memory)
 
         if not args:
             args = ()
@@ -49,13 +823,16 @@ class Executor(QtCore.QObject, threading.Thread):
         self.kwargs = kwargs
 
         if logfile is None:
-            logfile = os.path.join(tempfile.mkdtemp(), 'logfile.txt')
+            logfile = os.path.join(
+                self.scratch.runs_dir,
+                'run-%s-%s.log' % (os.getpid(), next(_LOGFILE_NUMBERS)))
         self.logfile = logfile
 
         self.failed = False
         self.exception = None
         self.traceback = None
 
+    @diagnostics.traced('executor')
     def run(self):
         """Run the python script provided by the user with the arguments
         specified.  This function also prints the arguments to the logfile
@@ -63,7 +840,13 @@ class Executor(QtCore.QObject, threading.Thread):
         of the module or function, a traceback is printed and the exception is
         saved."""
         try:
-            self.target(*self.args, **self.kwargs)
+            # Made here rather than on the GUI thread, where the Executor is
+            # created, since removing orphans may take a while.
+            self.scratch.create()
+            if self.stage_inputs:
+                self._stage_inputs()
+            with self.scratch.active():
+                self.target(*self.args, **self.kwargs)
         except Exception as error:
             # We deliberately want to catch all possible exceptions.
             LOGGER.exception(error)
@@ -71,6 +854,19 @@ class Executor(QtCore.QObject, threading.Thread):
             self.exception = error
             self.traceback = traceback.format_exc()
         finally:
+            self.scratch.remove()
             LOGGER.info('Execution finished')
 
         self.finished.emit()
+
+    def _stage_inputs(self):
+        # Copy input files to the user's private scratch directory, where
+        # the target reads them from.
+        staging_dir = os.path.join(self.scratch.runs_dir, STAGING_DIRNAME)
+        stager = InputStager(staging_dir, quota=self.staging_quota)
+        try:
+            self.args, self.kwargs = stager.stage(self.args, self.kwargs,
+                                                  self.stage_inputs)
+        except (IOError, OSError):
+            LOGGER.exception('Could not stage inputs in %s, using them in '
+                             'place', staging_dir)
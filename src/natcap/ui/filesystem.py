@@ -0,0 +1,973 @@
+"""Filesystem access for path inputs, kept off the GUI thread.
+
+Listing a directory on a network share can take seconds, so directories
+are listed in background threads and the listings are cached.  A cached
+listing is returned right away, even if it is older than the time to live,
+and refreshed in the background; the ``listed`` signal reports the fresh
+listing when it is ready.
+
+Files referenced by path inputs are watched for changes, so that they can
+be validated again when another program changes them, and paths dropped on
+path inputs are resolved in the background.  Files are also probed for a
+short description of their contents, reading at most ``_HEADER_BYTES`` of
+each, so that large files cost no more than small ones.  While a model
+runs, its output folder can be monitored for the files it writes.
+"""
+import os
+import csv
+import mmap
+import time
+import bisect
+import struct
+import logging
+import platform
+import threading
+import subprocess
+import collections
+
+import qtpy
+from qtpy import QtCore
+
+from . import snapshot
+
+
+LOGGER = logging.getLogger(__name__)
+
+# The platform doesn't change while we run, and platform.system() is slow
+# the first time it's called.
+_SYSTEM = platform.system()
+
+# On mac, Qt<5.4.1 gives file reference URLs for dropped files, which only
+# the OS can turn into paths.  See https://bugreports.qt.io/browse/QTBUG-40449
+_NEEDS_OSASCRIPT = (
+    _SYSTEM == 'Darwin' and
+    tuple(int(part) for part in qtpy.QT_VERSION.split('.')[:3]) < (5, 4, 1))
+
+# A directory's entry names, sorted, and the names of the entries that are
+# directories, also sorted.
+Listing = collections.namedtuple('Listing', ['names', 'directories'])
+
+
+def list_directory(dirpath):
+    """List a directory.
+
+    Parameters:
+        dirpath (string): The directory to list.
+
+    Returns:
+        A ``Listing``.
+
+    Raises:
+        OSError: When the directory can't be listed.
+    """
+    names = []
+    directories = []
+    scandir = getattr(os, 'scandir', None)
+    if scandir is not None:
+        for entry in scandir(dirpath):
+            names.append(entry.name)
+            try:
+                if entry.is_dir():
+                    directories.append(entry.name)
+            except OSError:
+                pass
+    else:
+        # Python 2 has no scandir, so each entry has to be stat'ed.
+        for name in os.listdir(dirpath):
+            names.append(name)
+            if os.path.isdir(os.path.join(dirpath, name)):
+                directories.append(name)
+    names.sort()
+    directories.sort()
+    return Listing(names, directories)
+
+
+def complete(listing, prefix, limit=100, directories_only=False):
+    """Find the names in a listing that start with a prefix.
+
+    Hidden names, starting with a dot, are only included if the prefix
+    starts with a dot too.  Only the matches are visited, so this is fast
+    even for very large directories.
+
+    Parameters:
+        listing (Listing): The listing to search.
+        prefix (string): The start of the names to find.
+        limit=100 (int): The most names to return.
+        directories_only=False (bool): Whether to only return directories.
+
+    Returns:
+        A sorted list of at most ``limit`` names.
+    """
+    if directories_only:
+        names = listing.directories
+    else:
+        names = listing.names
+    show_hidden = prefix.startswith('.')
+
+    matches = []
+    index = bisect.bisect_left(names, prefix)
+    while (index < len(names) and len(matches) < limit and
+           names[index].startswith(prefix)):
+        if show_hidden or not names[index].startswith('.'):
+            matches.append(names[index])
+        index += 1
+    return matches
+
+
+def _normalize(dirpath):
+    return os.path.normpath(os.path.expanduser(dirpath))
+
+
+class ThreadRelay(QtCore.QObject):
+    """Call a QObject's method from worker threads, in the QObject's thread.
+
+    Calling the relay from any thread queues a call to the method of
+    ``owner`` named ``method_name``, with the same arguments, in the thread
+    that owns ``owner``.  The relay is a child of ``owner``, so calls still
+    queued when ``owner`` is destroyed are dropped.
+    """
+
+    _called = QtCore.Signal(object)
+
+    def __init__(self, owner, method_name):
+        QtCore.QObject.__init__(self, owner)
+        self._method_name = method_name
+        self._called.connect(self._call)
+
+    def __call__(self, *args):
+        self._called.emit(args)
+
+    def _call(self, args):
+        getattr(self.parent(), self._method_name)(*args)
+
+
+class DirectoryLister(QtCore.QObject):
+    """List directories in background threads and cache the listings.
+
+    ``listed`` is emitted in the thread that owns the lister with each
+    directory's normalized path and its ``Listing``, or ``None`` if it could
+    not be listed.  At most ``max_directories`` listings are cached; the
+    least recently used is dropped first.
+    """
+
+    listed = QtCore.Signal(object, object)
+
+    def __init__(self, ttl=5.0, max_directories=64, max_threads=2,
+                 parent=None):
+        QtCore.QObject.__init__(self, parent)
+        self.ttl = ttl
+        self.max_directories = max_directories
+        self._cache = collections.OrderedDict()
+        self._semaphore = threading.BoundedSemaphore(max_threads)
+        self._pending = set()
+        self._threads = []
+        self._relay_listed = ThreadRelay(self, '_finished_listing')
+
+    def listing(self, dirpath):
+        """Get a directory's cached listing.
+
+        If there is no listing, or it is older than ``ttl`` seconds, the
+        directory is listed in the background.
+
+        Parameters:
+            dirpath (string): The directory.
+
+        Returns:
+            The cached ``Listing``, which may be stale, or ``None`` if the
+            directory hasn't been listed yet.
+        """
+        dirpath = _normalize(dirpath)
+        try:
+            listed_at, listing = self._cache.pop(dirpath)
+            self._cache[dirpath] = (listed_at, listing)
+        except KeyError:
+            listed_at, listing = None, None
+
+        if listed_at is None or time.time() - listed_at > self.ttl:
+            self._request(dirpath)
+        return listing
+
+    def invalidate(self, dirpath):
+        """Drop a directory's cached listing."""
+        self._cache.pop(_normalize(dirpath), None)
+
+    def _request(self, dirpath):
+        if dirpath in self._pending:
+            return
+        self._pending.add(dirpath)
+        thread = threading.Thread(target=self._list, args=(dirpath,))
+        thread.daemon = True
+        self._threads = [old_thread for old_thread in self._threads
+                         if old_thread.is_alive()]
+        self._threads.append(thread)
+        thread.start()
+
+    def _list(self, dirpath):
+        with self._semaphore:
+            try:
+                listing = list_directory(dirpath)
+            except OSError:
+                LOGGER.debug('Could not list %s', dirpath)
+                listing = None
+        self._relay_listed(dirpath, listing)
+
+    def _finished_listing(self, dirpath, listing):
+        self._pending.discard(dirpath)
+        self._cache.pop(dirpath, None)
+        if listing is not None:
+            self._cache[dirpath] = (time.time(), listing)
+            while len(self._cache) > self.max_directories:
+                self._cache.popitem(last=False)
+        self.listed.emit(dirpath, listing)
+
+    def join(self, timeout=None):
+        """Wait for every listing thread started so far to finish."""
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = [thread for thread in self._threads
+                         if thread.is_alive()]
+
+
+# Shared by every path input, so that a directory is listed once for all of
+# them.
+DIRECTORY_LISTER = DirectoryLister()
+
+
+class PathWatcher(QtCore.QObject):
+    """Report changes on disk to files and folders.
+
+    An existing path is watched directly.  A missing path is watched through
+    its parent directory, so that its creation is noticed.  Changes are
+    coalesced: ``paths_changed`` is emitted with the set of watched paths
+    that changed at most once every ``delay`` milliseconds.  At most
+    ``max_paths`` paths are watched; the least recently watched is dropped
+    first.  Every watch of a path must be matched by an unwatch.
+    """
+
+    paths_changed = QtCore.Signal(object)
+
+    def __init__(self, max_paths=256, delay=200, parent=None):
+        QtCore.QObject.__init__(self, parent)
+        self.max_paths = max_paths
+        self.delay = delay
+        # path -> [watched target, number of watches], least recently
+        # watched first.
+        self._paths = collections.OrderedDict()
+        # watched target -> set of the paths watched through it
+        self._targets = {}
+        self._changed = set()
+        # Created when first needed, since a watcher may be created before
+        # the QApplication.
+        self._watcher = None
+        self._timer = None
+
+    def _qt_watcher(self):
+        if self._watcher is None:
+            self._watcher = QtCore.QFileSystemWatcher(self)
+            self._watcher.fileChanged.connect(self._target_changed)
+            self._watcher.directoryChanged.connect(self._directory_changed)
+            self._timer = QtCore.QTimer(self)
+            self._timer.setSingleShot(True)
+            self._timer.setInterval(self.delay)
+            self._timer.timeout.connect(self._emit_changes)
+        return self._watcher
+
+    def watched_paths(self):
+        """Get the watched paths, least recently watched first."""
+        return list(self._paths)
+
+    def watch(self, path):
+        """Start watching a path."""
+        if path in self._paths:
+            entry = self._paths.pop(path)
+            entry[1] += 1
+            self._paths[path] = entry
+            return
+        self._paths[path] = [None, 1]
+        self._retarget(path)
+        while len(self._paths) > self.max_paths:
+            old_path, (target, _) = self._paths.popitem(last=False)
+            LOGGER.debug('Too many watched paths, no longer watching %s',
+                         old_path)
+            self._drop_target(old_path, target)
+
+    def unwatch(self, path):
+        """Stop watching a path, unless it was watched more than once."""
+        entry = self._paths.get(path)
+        if entry is None:
+            return
+        entry[1] -= 1
+        if entry[1] <= 0:
+            del self._paths[path]
+            self._drop_target(path, entry[0])
+
+    def release(self, owner):
+        """Unwatch the path named by a QObject's ``watched_path`` property.
+
+        Connect an object's ``destroyed`` signal to this so that its watch
+        is dropped with it.  ``destroyed`` only carries a plain QObject, so
+        the path is kept as a property rather than an attribute.
+        """
+        path = owner.property('watched_path')
+        if path:
+            self.unwatch(path)
+
+    def _retarget(self, path):
+        # Watch the path itself, or its parent directory if it doesn't
+        # exist.  The target is watched again even if it hasn't changed,
+        # since Qt stops watching files that are removed or replaced.
+        entry = self._paths[path]
+        self._drop_target(path, entry[0])
+        abspath = os.path.abspath(path)
+        if os.path.exists(abspath):
+            target = abspath
+        elif os.path.isdir(os.path.dirname(abspath)):
+            target = os.path.dirname(abspath)
+        else:
+            target = None
+        entry[0] = target
+        if target is None:
+            return
+        target_paths = self._targets.setdefault(target, set())
+        if not target_paths:
+            self._qt_watcher().addPath(target)
+        target_paths.add(path)
+
+    def _drop_target(self, path, target):
+        target_paths = self._targets.get(target)
+        if not target_paths:
+            return
+        target_paths.discard(path)
+        if not target_paths:
+            del self._targets[target]
+            self._watcher.removePath(target)
+
+    def _directory_changed(self, target):
+        DIRECTORY_LISTER.invalidate(target)
+        self._target_changed(target)
+
+    def _target_changed(self, target):
+        target_paths = self._targets.get(target)
+        if not target_paths:
+            return
+        self._changed.update(target_paths)
+        if not self._timer.isActive():
+            self._timer.start()
+
+    def _emit_changes(self):
+        changed_paths = set()
+        for path in self._changed:
+            if path not in self._paths:
+                continue
+            old_target = self._paths[path][0]
+            self._retarget(path)
+            # A missing path watched through its directory has only changed
+            # if it was created.
+            if (old_target == os.path.abspath(path) or
+                    self._paths[path][0] != old_target):
+                changed_paths.add(path)
+        self._changed = set()
+        if changed_paths:
+            self.paths_changed.emit(changed_paths)
+
+
+# Shared by every path input, so that the number of watches stays bounded.
+PATH_WATCHER = PathWatcher()
+
+
+def _ask_osascript(url_path):
+    command = (
+        "osascript -e 'get posix path of my posix file \""
+        "file://{fileid}\" -- kthx. bai'").format(fileid=url_path)
+    process = subprocess.Popen(
+        command, shell=True,
+        stderr=subprocess.STDOUT,
+        stdout=subprocess.PIPE)
+    output = process.communicate()[0]
+    if isinstance(output, bytes):
+        output = output.decode('utf-8')
+    return output.strip()
+
+
+class DropResolver(QtCore.QObject):
+    """Turn the paths of dropped URLs into local paths.
+
+    Where that means asking the OS, it's done in a background thread and
+    ``resolved`` is emitted in the thread that owns the resolver with the
+    URL path and the local path.  The last ``max_paths`` results are
+    cached.
+    """
+
+    resolved = QtCore.Signal(object, object)
+
+    def __init__(self, max_paths=64, parent=None):
+        QtCore.QObject.__init__(self, parent)
+        self.max_paths = max_paths
+        self._cache = collections.OrderedDict()
+        self._pending = set()
+        self._relay_resolved = ThreadRelay(self, '_finished_resolving')
+
+    def resolve(self, url_path):
+        """Resolve a dropped URL's path.
+
+        Returns:
+            The local path if it's known right away, otherwise ``None``, in
+            which case ``resolved`` will be emitted when it is known.
+        """
+        if _SYSTEM == 'Windows':
+            return url_path[1:]  # Remove the '/' ahead of disk letter
+        if not _NEEDS_OSASCRIPT:
+            return url_path
+
+        try:
+            local_path = self._cache.pop(url_path)
+            self._cache[url_path] = local_path
+            return local_path
+        except KeyError:
+            pass
+        if url_path not in self._pending:
+            self._pending.add(url_path)
+            thread = threading.Thread(target=self._resolve, args=(url_path,))
+            thread.daemon = True
+            thread.start()
+        return None
+
+    def _resolve(self, url_path):
+        try:
+            local_path = _ask_osascript(url_path)
+        except (OSError, ValueError):
+            LOGGER.exception('Could not resolve dropped path %s', url_path)
+            local_path = ''
+        self._relay_resolved(url_path, local_path or url_path)
+
+    def _finished_resolving(self, url_path, local_path):
+        self._pending.discard(url_path)
+        self._cache[url_path] = local_path
+        while len(self._cache) > self.max_paths:
+            self._cache.popitem(last=False)
+        self.resolved.emit(url_path, local_path)
+
+
+# Shared by every path input.
+DROP_RESOLVER = DropResolver()
+
+
+# The most bytes read from a file to describe it.
+_HEADER_BYTES = 2**16
+
+_SHAPE_TYPES = {
+    0: 'null', 1: 'point', 3: 'polyline', 5: 'polygon', 8: 'multipoint',
+    11: 'point', 13: 'polyline', 15: 'polygon', 18: 'multipoint',
+    21: 'point', 23: 'polyline', 25: 'polygon', 28: 'multipoint',
+    31: 'multipatch',
+}
+
+# TIFF field types: (struct format, size in bytes)
+_TIFF_TYPES = {1: ('B', 1), 3: ('H', 2), 4: ('I', 4), 16: ('Q', 8)}
+_TIFF_SAMPLE_FORMATS = {1: 'uint', 2: 'int', 3: 'float'}
+_GEOTIFF_TAGS = (33550, 33922, 34264, 34735)
+
+
+def read_header(path, max_bytes=_HEADER_BYTES):
+    """Read the start of a file through a bounded memory map.
+
+    Parameters:
+        path (string): The file to read.
+        max_bytes=_HEADER_BYTES (int): The most bytes to read.
+
+    Returns:
+        A tuple of the bytes read and the size of the file.
+    """
+    with open(path, 'rb') as file_obj:
+        size = os.fstat(file_obj.fileno()).st_size
+        if size == 0:
+            # Empty files can't be mapped.
+            return b'', 0
+        length = min(size, max_bytes)
+        header_map = mmap.mmap(file_obj.fileno(), length,
+                               access=mmap.ACCESS_READ)
+        try:
+            return header_map[:length], size
+        finally:
+            header_map.close()
+
+
+def _sniff_csv(header, size):
+    complete = len(header) == size
+    if not complete:
+        # Only count whole lines.
+        header = header[:header.rfind(b'\n') + 1]
+    lines = header.splitlines()
+    if not lines:
+        return {'format': 'CSV'}
+    first_line = lines[0].decode('utf-8', 'replace').lstrip(u'\ufeff')
+    columns = next(csv.reader([first_line]))
+
+    metadata = {'format': 'CSV', 'columns': columns,
+                'rows_estimated': not complete}
+    if complete:
+        metadata['rows'] = len([line for line in lines[1:] if line.strip()])
+    elif len(lines) > 1:
+        header_length = len(header.split(b'\n', 1)[0]) + 1
+        body_length = len(header) - header_length
+        metadata['rows'] = int(round(
+            (size - header_length) * (len(lines) - 1) / float(body_length)))
+    return metadata
+
+
+def _sniff_tiff(header):
+    if header[:2] == b'II':
+        order = '<'
+    elif header[:2] == b'MM':
+        order = '>'
+    else:
+        return None
+    try:
+        magic = struct.unpack(order + 'H', header[2:4])[0]
+        if magic == 42:
+            ifd_offset = struct.unpack(order + 'I', header[4:8])[0]
+            count_format, entry_format, field_size = 'H', 'HHI', 4
+        elif magic == 43:  # BigTIFF
+            ifd_offset = struct.unpack(order + 'Q', header[8:16])[0]
+            count_format, entry_format, field_size = 'Q', 'HHQ', 8
+        else:
+            return None
+    except struct.error:
+        return None
+
+    count_size = struct.calcsize(order + count_format)
+    entry_size = struct.calcsize(order + entry_format) + field_size
+    if ifd_offset + count_size > len(header):
+        # The tags are beyond the bytes we're willing to read.
+        return {'format': 'TIFF'}
+    n_entries = struct.unpack(
+        order + count_format,
+        header[ifd_offset:ifd_offset + count_size])[0]
+
+    tags = {}
+    entry_offset = ifd_offset + count_size
+    for _ in range(n_entries):
+        entry = header[entry_offset:entry_offset + entry_size]
+        if len(entry) < entry_size:
+            break
+        entry_offset += entry_size
+        tag, field_type, count = struct.unpack(
+            order + entry_format, entry[:-field_size])
+        tags[tag] = None
+        if field_type not in _TIFF_TYPES:
+            continue
+        value_format, value_size = _TIFF_TYPES[field_type]
+        if count * value_size <= field_size:
+            value_bytes = entry[-field_size:]
+        else:
+            value_offset = struct.unpack(
+                order + ('I' if field_size == 4 else 'Q'),
+                entry[-field_size:])[0]
+            value_bytes = header[value_offset:value_offset + value_size]
+        if len(value_bytes) >= value_size:
+            tags[tag] = struct.unpack(order + value_format,
+                                      value_bytes[:value_size])[0]
+
+    metadata = {'format': 'TIFF'}
+    if any(tag in tags for tag in _GEOTIFF_TAGS):
+        metadata['format'] = 'GeoTIFF'
+    if tags.get(256) is not None and tags.get(257) is not None:
+        metadata['width'] = tags[256]
+        metadata['height'] = tags[257]
+        metadata['bands'] = tags.get(277) or 1
+        metadata['data_type'] = '%s%s' % (
+            _TIFF_SAMPLE_FORMATS.get(tags.get(339) or 1, 'uint'),
+            tags.get(258) or 1)
+    return metadata
+
+
+def _sniff_shapefile(path, header):
+    if len(header) < 100 or struct.unpack('>i', header[:4])[0] != 9994:
+        return None
+    shape_type = struct.unpack('<i', header[32:36])[0]
+    metadata = {'format': 'ESRI Shapefile',
+                'geometry': _SHAPE_TYPES.get(shape_type, 'unknown')}
+    # The index has a 100 byte header and 8 bytes per feature, so its size
+    # gives the feature count without reading it.
+    for extension in ('.shx', '.SHX'):
+        index_fingerprint = snapshot.fingerprint(
+            os.path.splitext(path)[0] + extension)
+        if index_fingerprint is not None:
+            metadata['features'] = (index_fingerprint['size'] - 100) // 8
+            break
+    return metadata
+
+
+def sniff(path):
+    """Describe a file's format from its first bytes.
+
+    CSVs are described by their columns and an estimate of their row
+    count, TIFFs by their dimensions and data type and shapefiles by their
+    geometry type and feature count.  At most ``_HEADER_BYTES`` are read.
+
+    Parameters:
+        path (string): The file to describe.
+
+    Returns:
+        A dict with at least ``format``, which is ``None`` if the format
+        isn't recognized, and ``size``.
+
+    Raises:
+        IOError, OSError: When the file can't be read.
+    """
+    header, size = read_header(path)
+    extension = os.path.splitext(path)[1].lower()
+    metadata = None
+    if extension == '.csv':
+        metadata = _sniff_csv(header, size)
+    elif extension == '.shp':
+        metadata = _sniff_shapefile(path, header)
+    else:
+        metadata = _sniff_tiff(header)
+    if metadata is None:
+        metadata = {'format': None}
+    metadata['size'] = size
+    return metadata
+
+
+def _format_size(size):
+    for unit in ('bytes', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            break
+        size /= 1024.0
+    if unit == 'bytes':
+        return '%d bytes' % size
+    return '%.1f %s' % (size, unit)
+
+
+def describe(metadata):
+    """Describe a file from the metadata returned by ``sniff``.
+
+    Returns:
+        A short, multi-line description.
+    """
+    lines = ['%s, %s' % (metadata['format'] or 'File',
+                         _format_size(metadata['size']))]
+    if 'columns' in metadata:
+        lines.append('%s columns: %s' % (len(metadata['columns']),
+                                         ', '.join(metadata['columns'])))
+    if 'rows' in metadata:
+        lines.append('%s%s rows' % (
+            'about ' if metadata['rows_estimated'] else '',
+            '{:,}'.format(metadata['rows'])))
+    if 'width' in metadata:
+        lines.append('%s x %s pixels, %s band%s of %s' % (
+            metadata['width'], metadata['height'], metadata['bands'],
+            '' if metadata['bands'] == 1 else 's', metadata['data_type']))
+    if 'geometry' in metadata:
+        if 'features' in metadata:
+            lines.append('{:,} {} features'.format(metadata['features'],
+                                                   metadata['geometry']))
+        else:
+            lines.append('%s features' % metadata['geometry'])
+    return '\n'.join(lines)
+
+
+class MetadataProbe(QtCore.QObject):
+    """Sniff files in a background thread and cache their metadata.
+
+    ``probed`` is emitted in the thread that owns the probe with each path
+    and its metadata, or ``None`` if it isn't a readable file.  Requests
+    are handled newest first, and a path already waiting isn't queued
+    again, so typing a path doesn't pile up work.  Metadata is cached by
+    path, size and modification time.
+    """
+
+    probed = QtCore.Signal(object, object)
+
+    def __init__(self, max_files=256, parent=None):
+        QtCore.QObject.__init__(self, parent)
+        self.max_files = max_files
+        self._cache = collections.OrderedDict()
+        self._queue = collections.deque(maxlen=64)
+        self._condition = threading.Condition()
+        self._thread = None
+        self._relay_probed = ThreadRelay(self, '_finished_probing')
+
+    def request(self, path):
+        """Sniff ``path`` in the background."""
+        with self._condition:
+            if path in self._queue:
+                return
+            self._queue.append(path)
+            self._condition.notify()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._work)
+                self._thread.daemon = True
+                self._thread.start()
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._queue:
+                    self._condition.wait()
+                path = self._queue.pop()
+            self._relay_probed(path, self._probe(path))
+
+    def _finished_probing(self, path, metadata):
+        self.probed.emit(path, metadata)
+
+    def _probe(self, path):
+        if not os.path.isfile(path):
+            return None
+        file_fingerprint = snapshot.fingerprint(path)
+        if file_fingerprint is None:
+            return None
+        cache_key = (os.path.abspath(path), file_fingerprint['size'],
+                     file_fingerprint['mtime'])
+        with self._condition:
+            if cache_key in self._cache:
+                self._cache[cache_key] = self._cache.pop(cache_key)
+                return self._cache[cache_key]
+        try:
+            metadata = sniff(path)
+        except (IOError, OSError, ValueError):
+            LOGGER.debug('Could not sniff %s', path, exc_info=True)
+            return None
+        with self._condition:
+            self._cache[cache_key] = metadata
+            while len(self._cache) > self.max_files:
+                self._cache.popitem(last=False)
+        return metadata
+
+
+# Shared by every path input.
+METADATA_PROBE = MetadataProbe()
+
+
+def _scan_directory(dirpath):
+    # Yield (path, is_directory, size, mtime) for each entry of a directory.
+    scandir = getattr(os, 'scandir', None)
+    if scandir is not None:
+        for entry in scandir(dirpath):
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    yield entry.path, True, 0, 0
+                elif entry.is_file():
+                    stat_result = entry.stat()
+                    yield (entry.path, False, stat_result.st_size,
+                           stat_result.st_mtime)
+            except OSError:
+                continue
+    else:
+        for name in os.listdir(dirpath):
+            path = os.path.join(dirpath, name)
+            try:
+                if os.path.isdir(path) and not os.path.islink(path):
+                    yield path, True, 0, 0
+                else:
+                    stat_result = os.stat(path)
+                    yield (path, False, stat_result.st_size,
+                           stat_result.st_mtime)
+            except OSError:
+                continue
+
+
+class OutputMonitor(QtCore.QObject):
+    """Report files created, modified and deleted under a folder.
+
+    A background thread scans the folder every ``interval`` seconds and
+    ``files_changed`` is emitted once per scan with everything that changed
+    and the write throughput since the last scan.  Files that existed when
+    monitoring started aren't reported unless they change.
+
+    Directories are watched with a QFileSystemWatcher (inotify on linux),
+    so that most scans only list the directories that changed and re-stat
+    the files that were recently written.  Every ``full_scan_every`` scans,
+    or every scan if a directory can't be watched or there are more than
+    ``max_directories`` of them, the whole tree is scanned instead.  A
+    scan visits at most ``max_entries`` entries.
+
+    Stopping doesn't wait for the last scan, whose changes are emitted as
+    usual when it's done, unless the monitor has since been started again.
+    """
+
+    # A list of (path relative to the folder, size, status) tuples, where
+    # status is 'created', 'modified' or 'deleted', and bytes per second.
+    files_changed = QtCore.Signal(list, float)
+
+    def __init__(self, interval=1.0, max_directories=256, max_entries=20000,
+                 full_scan_every=10, parent=None):
+        QtCore.QObject.__init__(self, parent)
+        self.interval = interval
+        self.max_directories = max_directories
+        self.max_entries = max_entries
+        self.full_scan_every = full_scan_every
+        self.folder = None
+        self._thread = None
+        self._stopping_thread = None
+        self._generation = 0
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+        self._dirty = set()
+        self._polling = False
+        self._watcher = None
+
+        # Scans are relayed to this object's thread, where the watcher
+        # lives.  The thread relays while holding _emit_lock, and only if
+        # _generation is still the one it was started with, so that once
+        # stopped without a last scan it never calls a monitor that may have
+        # been destroyed.
+        self._relay_scanned = ThreadRelay(self, '_scanned')
+        self._emit_lock = threading.Lock()
+
+    def start(self, folder):
+        """Start monitoring a folder, which needn't exist yet."""
+        self.stop()
+        self.folder = os.path.abspath(folder)
+        self._stopped = threading.Event()
+        self._dirty = set()
+        self._polling = False
+        with self._emit_lock:
+            self._generation += 1
+        self._watcher = QtCore.QFileSystemWatcher(self)
+        self._watcher.directoryChanged.connect(self._directory_changed)
+        self._thread = threading.Thread(
+            target=self._poll,
+            args=(self.folder, self._stopped, self._generation))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, last_scan=True):
+        """Stop monitoring after scanning the whole folder one last time.
+
+        The last scan happens in the background; this doesn't wait for it.
+        If ``last_scan`` is False, nothing more is emitted, such as when the
+        monitor is about to be destroyed.
+        """
+        if self._thread is None:
+            return
+        if not last_scan:
+            with self._emit_lock:
+                self._generation += 1
+        self._stopped.set()
+        self._stopping_thread = self._thread
+        self._thread = None
+        self._watcher.deleteLater()
+        self._watcher = None
+
+    def join(self, timeout=None):
+        """Wait for the last scan after ``stop``.
+
+        Returns:
+            ``True`` if no scan is still running, ``False`` on timeout.
+        """
+        thread = self._stopping_thread
+        if thread is not None:
+            thread.join(timeout)
+            if thread.is_alive():
+                return False
+            self._stopping_thread = None
+        return True
+
+    def _directory_changed(self, dirpath):
+        with self._lock:
+            self._dirty.add(dirpath)
+
+    def _scanned(self, changes, throughput, new_directories, generation):
+        if generation != self._generation:
+            return  # From a run the monitor has since been restarted for.
+        if self._watcher is not None and not self._polling:
+            for dirpath in new_directories:
+                if (len(self._watcher.directories()) >= self.max_directories
+                        or not self._watcher.addPath(dirpath)):
+                    LOGGER.debug('Could not watch %s, polling %s instead',
+                                 dirpath, self.folder)
+                    with self._lock:
+                        self._polling = True
+                    break
+        if changes:
+            self.files_changed.emit(changes, throughput)
+
+    def _poll(self, folder, stopped, generation):
+        files = {}  # path -> (size, mtime)
+        directories = set()
+        recent = set()  # files that changed in the last scan
+        n_scans = 0
+        last_scan_time = time.time()
+        while True:
+            # The first scan, of the files that already exist, is right away.
+            stopping = stopped.wait(self.interval if n_scans else 0)
+            with self._lock:
+                dirty = self._dirty
+                self._dirty = set()
+                polling = self._polling
+            full_scan = (polling or stopping or folder not in directories or
+                         n_scans % self.full_scan_every == 0)
+            n_scans += 1
+
+            if full_scan:
+                to_scan = [folder]
+            else:
+                to_scan = sorted(dirty)
+            scanned_directories = set()
+            new_directories = []
+            current = {}
+            n_entries = 0
+            while to_scan and n_entries < self.max_entries:
+                dirpath = to_scan.pop()
+                try:
+                    entries = list(_scan_directory(dirpath))
+                except OSError:
+                    continue
+                scanned_directories.add(dirpath)
+                if dirpath not in directories:
+                    directories.add(dirpath)
+                    new_directories.append(dirpath)
+                for path, is_directory, size, mtime in entries:
+                    n_entries += 1
+                    if is_directory:
+                        if full_scan or path not in directories:
+                            to_scan.append(path)
+                    else:
+                        current[path] = (size, mtime)
+
+            # Files being written may not change their directory.
+            for path in recent - set(current):
+                if os.path.dirname(path) in scanned_directories:
+                    continue
+                try:
+                    stat_result = os.stat(path)
+                except OSError:
+                    continue
+                current[path] = (stat_result.st_size, stat_result.st_mtime)
+
+            changes = []
+            bytes_written = 0
+            if n_scans > 1:
+                for path, (size, mtime) in current.items():
+                    previous = files.get(path)
+                    if previous is None:
+                        changes.append((path, size, 'created'))
+                        bytes_written += size
+                    elif previous != (size, mtime):
+                        changes.append((path, size, 'modified'))
+                        bytes_written += max(size - previous[0], 0)
+            for path in list(files):
+                if path not in current and (
+                        os.path.dirname(path) in scanned_directories or
+                        path in recent):
+                    if not os.path.exists(path):
+                        del files[path]
+                        changes.append((path, 0, 'deleted'))
+            files.update(current)
+            recent = set(path for (path, _, status) in changes
+                         if status != 'deleted')
+
+            now = time.time()
+            throughput = bytes_written / max(now - last_scan_time, 1e-6)
+            last_scan_time = now
+            changes = [(os.path.relpath(path, folder), size, status)
+                       for (path, size, status) in sorted(changes)]
+            with self._emit_lock:
+                if generation != self._generation:
+                    return
+                self._relay_scanned(changes, throughput, new_directories,
+                                    generation)
+            if stopping:
+                return
@@ -8,7 +8,12 @@ import subprocess
 import warnings
 import sys
 import atexit
-import itertools
+import bisect
+import contextlib
+import weakref
+import time
+import csv
+import collections
 
 import qtpy
 from qtpy import QtWidgets
@@ -17,7 +22,10 @@ from qtpy import QtGui
 import six
 import qtawesome
 
+from . import diagnostics
 from . import execution
+from . import filesystem
+from . import snapshot
 
 try:
     QApplication = QtGui.QApplication
@@ -54,6 +62,60 @@ def _apply_sizehint(widget):
         widget.setMinimumSize(size_hint)
 
 
+def _call_weakly(object_ref, method_name):
+    # Call a method of a weakly referenced object, unless it is gone, so
+    # that a queued callback doesn't keep the object alive.
+    obj = object_ref()
+    if obj is not None:
+        getattr(obj, method_name)()
+
+
+class _LayoutScheduler(QtCore.QObject):
+    """Defer layout work to the next turn of the event loop.
+
+    Callbacks queued here run together when control returns to the event
+    loop.  A callback queued many times with the same arguments before then
+    only runs once, so building or changing a form costs one size hint or
+    layout pass per widget rather than one per change.  Nothing here pumps
+    the event loop.
+    """
+
+    def __init__(self, parent=None):
+        QtCore.QObject.__init__(self, parent)
+        self._callbacks = collections.OrderedDict()
+        self._timer = QtCore.QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(0)
+        self._timer.timeout.connect(self.flush)
+
+    def call_later(self, callback, *args):
+        """Queue ``callback(*args)`` to run on the next event loop turn."""
+        self._callbacks[(callback, args)] = None
+        if not self._timer.isActive():
+            self._timer.start()
+
+    def apply_sizehint(self, widget):
+        """Queue setting the minimum size of ``widget`` to its size hint."""
+        self.call_later(_apply_sizehint, widget)
+
+    @diagnostics.traced('layout')
+    def flush(self):
+        """Run all queued callbacks now, including any they queue."""
+        self._timer.stop()
+        while self._callbacks:
+            (callback, args), _ = self._callbacks.popitem(last=False)
+            try:
+                callback(*args)
+            except RuntimeError:
+                # PyQt raises RuntimeError when the underlying C++ object
+                # was deleted after the callback was queued.
+                LOGGER.debug('Skipping layout callback %s for a deleted '
+                             'object', callback)
+
+
+LAYOUT_SCHEDULER = _LayoutScheduler()
+
+
 def open_workspace(dirname):
     LOGGER.debug("Opening dirname %s", dirname)
     # Try opening up a file explorer to see the results.
@@ -122,12 +184,17 @@ class Validator(QtCore.QObject):
 
     def __init__(self, parent):
         QtCore.QObject.__init__(self, parent)
+        # The thread is only started when there's something to validate.  It
+        # quits once validation finishes, so inputs that are never validated
+        # don't each hold a running thread.
         self._validation_thread = QtCore.QThread(parent=self)
-        self._validation_thread.start()
         self._validation_worker = None
 
+    @diagnostics.traced('validation')
     def validate(self, target, args, limit_to=None):
         self.started.emit()
+        if not self._validation_thread.isRunning():
+            self._validation_thread.start()
         self._validation_worker = ValidationWorker(
             target=target,
             args=args,
@@ -144,6 +211,7 @@ class Validator(QtCore.QObject):
             self.finished.emit(warnings_)
             self._validation_worker.deleteLater()
             self._validation_thread.quit()
+            self._validation_thread.wait()
 
         self._validation_worker.finished.connect(_finished)
         self._validation_worker.start()
@@ -191,12 +259,187 @@ class LogMessagePane(QtWidgets.QPlainTextEdit):
     def write(self, message):
         self.message_received.emit(message)
 
+    @diagnostics.traced('log')
     def _write(self, message):
         self.insertPlainText(message)
         self.textCursor().movePosition(QtGui.QTextCursor.End)
         self.setTextCursor(self.textCursor())
 
 
+class _OutputFilesModel(QtCore.QAbstractTableModel):
+    """A table of the files a model has written, most recent first.
+
+    Each batch of changes from an ``OutputMonitor`` resets the model once.
+    Only the ``max_rows`` most recently changed files are shown, though
+    ``n_files`` and ``total_size`` count every file.
+    """
+
+    HEADERS = ('File', 'Size', 'Status')
+
+    def __init__(self, max_rows=500, parent=None):
+        QtCore.QAbstractTableModel.__init__(self, parent)
+        self.max_rows = max_rows
+        self.n_files = 0
+        self.total_size = 0
+        self._files = collections.OrderedDict()  # path -> (size, status)
+        self._sizes = {}  # path -> size, for every existing file
+        self._rows = []
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self._rows)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.HEADERS)
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if (role == QtCore.Qt.DisplayRole and
+                orientation == QtCore.Qt.Horizontal):
+            return self.HEADERS[section]
+        return None
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid() or role != QtCore.Qt.DisplayRole:
+            return None
+        path, size, status = self._rows[index.row()]
+        if index.column() == 0:
+            return path
+        elif index.column() == 1:
+            return filesystem._format_size(size)
+        return status
+
+    def clear(self):
+        self.beginResetModel()
+        self.n_files = 0
+        self.total_size = 0
+        self._files.clear()
+        self._sizes.clear()
+        self._rows = []
+        self.endResetModel()
+
+    def update(self, changes):
+        """Record a list of (path, size, status) changes."""
+        self.beginResetModel()
+        for path, size, status in changes:
+            if status == 'deleted':
+                self._sizes.pop(path, None)
+            else:
+                self._sizes[path] = size
+            previous = self._files.pop(path, None)
+            if (previous is not None and previous[1] == 'created' and
+                    status == 'modified'):
+                status = 'created'
+            self._files[path] = (size, status)
+        while len(self._files) > self.max_rows:
+            self._files.popitem(last=False)
+        self.n_files = len(self._sizes)
+        self.total_size = sum(self._sizes.values())
+        self._rows = [(path, size, status) for (path, (size, status))
+                      in reversed(self._files.items())]
+        self.endResetModel()
+
+
+class Sparkline(QtWidgets.QWidget):
+    """A small line chart of the most recent values of a series."""
+
+    def __init__(self, max_values=60, color='#3e895b', parent=None):
+        QtWidgets.QWidget.__init__(self, parent)
+        self.values = collections.deque(maxlen=max_values)
+        self.color = QtGui.QColor(color)
+        self.setMinimumSize(120, 24)
+        self.setSizePolicy(QtWidgets.QSizePolicy.Expanding,
+                           QtWidgets.QSizePolicy.Fixed)
+
+    def sizeHint(self):
+        return QtCore.QSize(200, 24)
+
+    def add_value(self, value):
+        self.values.append(value)
+        self.update()
+
+    def clear(self):
+        self.values.clear()
+        self.update()
+
+    def paintEvent(self, event):
+        if len(self.values) < 2:
+            return
+        width = self.width() - 1
+        height = self.height() - 1
+        maximum = max(max(self.values), 1e-9)
+        step = float(width) / (self.values.maxlen - 1)
+        # Right-aligned, so that the newest value is always at the right.
+        left = width - step * (len(self.values) - 1)
+        points = [QtCore.QPointF(left + step * index,
+                                 height - height * value / maximum)
+                  for index, value in enumerate(self.values)]
+        painter = QtGui.QPainter(self)
+        painter.setRenderHint(QtGui.QPainter.Antialiasing)
+        painter.setPen(QtGui.QPen(self.color, 1.5))
+        painter.drawPolyline(QtGui.QPolygonF(points))
+        painter.end()
+
+
+class ResourcePanel(QtWidgets.QWidget):
+    """Sparklines of a run's CPU, memory and I/O, with the latest values.
+
+    Connect a ``ResourceSampler``'s ``sampled`` signal to ``add_sample``.
+    Memory is shown in red when less than ``low_memory_fraction`` of the
+    system's memory is available, as it is then about to swap.
+    """
+
+    def __init__(self, low_memory_fraction=0.1, parent=None):
+        QtWidgets.QWidget.__init__(self, parent)
+        self.low_memory_fraction = low_memory_fraction
+        self.setLayout(QtWidgets.QGridLayout())
+        self.layout().setContentsMargins(0, 0, 0, 0)
+        self.labels = {}
+        self.sparklines = {}
+        for row, (key, color) in enumerate((('cpu', '#3e6ea2'),
+                                            ('memory', '#3e895b'),
+                                            ('read', '#a2783e'),
+                                            ('write', '#a23e8e'))):
+            self.labels[key] = QtWidgets.QLabel()
+            self.labels[key].setMinimumWidth(220)
+            self.sparklines[key] = Sparkline(color=color)
+            self.layout().addWidget(self.labels[key], row, 0)
+            self.layout().addWidget(self.sparklines[key], row, 1)
+        self.clear()
+
+    def clear(self):
+        for key, text in (('cpu', 'CPU:'), ('memory', 'Memory:'),
+                          ('read', 'Reading:'), ('write', 'Writing:')):
+            self.labels[key].setText(text)
+            self.labels[key].setStyleSheet('')
+            self.sparklines[key].clear()
+
+    def add_sample(self, sample):
+        """Show an ``execution.ResourceSample``."""
+        self.sparklines['cpu'].add_value(sample.cpu_percent)
+        self.sparklines['memory'].add_value(sample.rss)
+        self.sparklines['read'].add_value(sample.read_rate)
+        self.sparklines['write'].add_value(sample.write_rate)
+
+        self.labels['cpu'].setText('CPU: %.0f%%' % sample.cpu_percent)
+        memory_text = 'Memory: %s' % filesystem._format_size(sample.rss)
+        low_memory = False
+        if sample.available_memory is not None:
+            memory_text += ' (%s free)' % filesystem._format_size(
+                sample.available_memory)
+            low_memory = (sample.available_memory <
+                          sample.total_memory * self.low_memory_fraction)
+        self.labels['memory'].setText(memory_text)
+        self.labels['memory'].setStyleSheet(
+            'QLabel { color: #a23332; }' if low_memory else '')
+        self.labels['read'].setText(
+            'Reading: %s/s' % filesystem._format_size(sample.read_rate))
+        self.labels['write'].setText(
+            'Writing: %s/s' % filesystem._format_size(sample.write_rate))
+
+
 class FileSystemRunDialog(QtWidgets.QDialog):
     def __init__(self):
         QtWidgets.QDialog.__init__(self)
@@ -239,9 +482,33 @@ class FileSystemRunDialog(QtWidgets.QDialog):
         self.messageArea = MessageArea()
         self.messageArea.clear()
 
+        # A live table of the files written to the workspace.
+        self.outputsLabel = QtWidgets.QLabel('Output files:')
+        self.output_files = _OutputFilesModel(parent=self)
+        self.outputFilesView = QtWidgets.QTableView()
+        self.outputFilesView.setModel(self.output_files)
+        self.outputFilesView.verticalHeader().setVisible(False)
+        self.outputFilesView.horizontalHeader().setStretchLastSection(True)
+        self.outputFilesView.setSelectionMode(
+            QtWidgets.QAbstractItemView.NoSelection)
+        self.outputFilesView.setColumnWidth(0, 400)
+        self.outputFilesView.setMaximumHeight(150)
+        self.output_monitor = filesystem.OutputMonitor(parent=self)
+        self.output_monitor.files_changed.connect(self._output_files_changed)
+
+        # Live CPU, memory and I/O of the run, hidden where they can't be
+        # sampled.
+        self.resourcePanel = ResourcePanel()
+        self.resourcePanel.setVisible(False)
+        self.resource_sampler = execution.ResourceSampler(parent=self)
+        self.resource_sampler.sampled.connect(self.resourcePanel.add_sample)
+
         # Add the new widgets to the window
         self.layout().addWidget(self.statusAreaLabel)
         self.layout().addWidget(self.log_messages_pane)
+        self.layout().addWidget(self.outputsLabel)
+        self.layout().addWidget(self.outputFilesView)
+        self.layout().addWidget(self.resourcePanel)
         self.layout().addWidget(self.messageArea)
         self.layout().addWidget(self.progressBar)
         self.layout().addWidget(self.openWorkspaceCB)
@@ -273,6 +540,7 @@ class FileSystemRunDialog(QtWidgets.QDialog):
 
     def __del__(self):
         self.logger.removeHandler(self.loghandler)
+        self._stop_monitoring(last_scan=False)
         self.deleteLater()
 
     def start(self, window_title, out_folder):
@@ -288,12 +556,24 @@ class FileSystemRunDialog(QtWidgets.QDialog):
 
         self.log_messages_pane.write('Initializing...\n')
 
+        self.output_files.clear()
+        self.outputsLabel.setText('Output files:')
+        # Monitoring a whole filesystem would cost more than it's worth.
+        if out_folder and os.path.dirname(
+                os.path.abspath(out_folder)) != os.path.abspath(out_folder):
+            self.output_monitor.start(out_folder)
+
+        self.resourcePanel.clear()
+        self.resource_sampler.start()
+        self.resourcePanel.setVisible(self.resource_sampler.is_sampling())
+
     def finish(self, exception_found, thread_exception=None):
         """Notify the user that model processing has finished.
             returns nothing."""
 
         self.is_executing = False
         self.progressBar.setMaximum(1)  # stops the progressbar.
+        self._stop_monitoring()
         self.backButton.setDisabled(False)
 
         if exception_found:
@@ -319,6 +599,20 @@ class FileSystemRunDialog(QtWidgets.QDialog):
         self.openWorkspaceCB.setVisible(False)
         self.openWorkspaceButton.setVisible(True)
 
+    def _stop_monitoring(self, last_scan=True):
+        # Stop the background threads watching the run, without waiting.
+        self.output_monitor.stop(last_scan=last_scan)
+        self.resource_sampler.stop()
+
+    @diagnostics.traced('slot')
+    def _output_files_changed(self, changes, throughput):
+        self.output_files.update(changes)
+        self.outputsLabel.setText(
+            'Output files: %s files, %s, writing %s/s' % (
+                self.output_files.n_files,
+                filesystem._format_size(self.output_files.total_size),
+                filesystem._format_size(throughput)))
+
     def _request_workspace(self, event=None):
         open_workspace(self.out_folder)
 
@@ -332,6 +626,11 @@ class FileSystemRunDialog(QtWidgets.QDialog):
         self.cancel = False
         self.done(0)
 
+    def done(self, result):
+        """Close the dialog with a result.  Overridden from Qt."""
+        self._stop_monitoring()
+        QtWidgets.QDialog.done(self, result)
+
     def reject(self):
         """Reject the dialog.
 
@@ -351,6 +650,7 @@ class FileSystemRunDialog(QtWidgets.QDialog):
         if self.is_executing:
             event.ignore()
         else:
+            self._stop_monitoring()
             QtWidgets.QDialog.closeEvent(self, event)
 
 
@@ -411,8 +711,8 @@ class ValidationWorker(QtCore.QObject):
     def start(self):
         self.started.emit()
 
+    @diagnostics.traced('validation')
     def run(self):
-        QT_APP.processEvents()
         # Target must adhere to InVEST validation API.
         LOGGER.info(('Starting validation thread with target=%s, args=%s, '
                      'limit_to=%s'), self.target, self.args, self.limit_to)
@@ -426,47 +726,94 @@ class ValidationWorker(QtCore.QObject):
                              self.target)
         self._finished = True
         self.finished.emit()
-        QT_APP.processEvents()
+
+
+# The QFileDialog shared by every FileDialog, created when first needed.
+_FILE_DIALOG = None
+
+
+def _shared_file_dialog():
+    global _FILE_DIALOG
+    if _FILE_DIALOG is None:
+        _FILE_DIALOG = QtWidgets.QFileDialog()
+    return _FILE_DIALOG
 
 
 class FileDialog(object):
-    def __init__(self):
-        object.__init__(self)
-        self.file_dialog = QtWidgets.QFileDialog()
+    """Ask the user for files and folders.
 
-    def __del__(self):
-        self.file_dialog.deleteLater()
+    Every FileDialog uses one shared QFileDialog, created the first time a
+    dialog is needed, so building a form with many path inputs creates no
+    dialogs.  Reusing the dialog keeps its filesystem model, so directories
+    it has already read open instantly.  Between uses the dialog is pointed
+    at ``DATA['last_dir']``, where the next dialog will most likely open,
+    so that directory is read in the background before the dialog is shown.
+    """
+
+    @property
+    def file_dialog(self):
+        return _shared_file_dialog()
+
+    def warm(self):
+        """Start reading ``DATA['last_dir']`` before the dialog is opened."""
+        start_dir = os.path.expanduser(DATA['last_dir'])
+        if start_dir and os.path.isdir(start_dir):
+            self.file_dialog.setDirectory(start_dir)
+
+    def _ask(self, title, start_path, accept_mode, file_mode):
+        dialog = self.file_dialog
+        dialog.setWindowTitle(title)
+        dialog.setAcceptMode(accept_mode)
+        dialog.setFileMode(file_mode)
+        dialog.setOption(QtWidgets.QFileDialog.ShowDirsOnly,
+                         file_mode == QtWidgets.QFileDialog.Directory)
+
+        # Allow us to open folders with spaces in them.
+        start_path = os.path.normpath(start_path)
+        if (os.path.isdir(start_path) or
+                file_mode == QtWidgets.QFileDialog.Directory):
+            dialog.setDirectory(start_path)
+            dialog.selectFile('')
+        else:
+            dialog.setDirectory(os.path.dirname(start_path))
+            dialog.selectFile(os.path.basename(start_path))
+
+        if dialog.exec_() == QtWidgets.QDialog.Accepted:
+            selected_files = dialog.selectedFiles()
+        else:
+            selected_files = []
+        if not selected_files:
+            return ''
+        return six.text_type(selected_files[0])
 
     def save_file(self, title, start_dir=None, savefile=None):
         if not start_dir:
             start_dir = os.path.expanduser(DATA['last_dir'])
 
-        # Allow us to open folders with spaces in them.
-        os.path.normpath(start_dir)
-
         if savefile:
             default_path = os.path.join(start_dir, savefile)
         else:
             # If we pass a folder, the dialog will open to the folder
             default_path = start_dir
 
-        filename = self.file_dialog.getSaveFileName(self.file_dialog, title, default_path)
-        DATA['last_dir'] = os.path.dirname(six.text_type(filename))
+        filename = self._ask(title, default_path,
+                             QtWidgets.QFileDialog.AcceptSave,
+                             QtWidgets.QFileDialog.AnyFile)
+        if filename:
+            DATA['last_dir'] = os.path.dirname(filename)
+            self.warm()
         return filename
 
     def open_file(self, title, start_dir=None):
         if not start_dir:
             start_dir = os.path.expanduser(DATA['last_dir'])
 
-        # Allow us to open folders with spaces in them.
-        os.path.normpath(start_dir)
-
-        result = self.file_dialog.getOpenFileName(self.file_dialog, title, start_dir)
-        if int(qtpy.QT_VERSION[0]) == 5:  # pyqt5
-            filename, last_filter = result
-        else:  # pyqt4
-            filename = result
-        DATA['last_dir'] = os.path.dirname(six.text_type(filename))
+        filename = self._ask(title, start_dir,
+                             QtWidgets.QFileDialog.AcceptOpen,
+                             QtWidgets.QFileDialog.ExistingFile)
+        if filename:
+            DATA['last_dir'] = os.path.dirname(filename)
+            self.warm()
         return filename
 
     def open_folder(self, title, start_dir=None):
@@ -474,10 +821,12 @@ class FileDialog(object):
             start_dir = os.path.expanduser(DATA['last_dir'])
         dialog_title = 'Select folder: ' + title
 
-        dirname = self.file_dialog.getExistingDirectory(self.file_dialog, dialog_title,
-                                                        start_dir)
-        dirname = six.text_type(dirname)
-        DATA['last_dir'] = dirname
+        dirname = self._ask(dialog_title, start_dir,
+                            QtWidgets.QFileDialog.AcceptOpen,
+                            QtWidgets.QFileDialog.Directory)
+        if dirname:
+            DATA['last_dir'] = dirname
+            self.warm()
         return dirname
 
 
@@ -494,6 +843,11 @@ class _FileSystemButton(QtWidgets.QPushButton):
         self.open_method = None  # This should be overridden
         self.clicked.connect(self._get_path)
 
+    def enterEvent(self, event):
+        # The user may be about to open the dialog.
+        self.dialog.warm()
+        QtWidgets.QPushButton.enterEvent(self, event)
+
     def _get_path(self):
         selected_path = self.open_method(title=self.dialog_title,
                                          start_dir=DATA['last_dir'])
@@ -518,6 +872,16 @@ class FolderButton(_FileSystemButton):
         self.open_method = self.dialog.open_folder
 
 
+@contextlib.contextmanager
+def _signals_blocked(qobjects):
+    was_blocked = [qobject.blockSignals(True) for qobject in qobjects]
+    try:
+        yield
+    finally:
+        for qobject, blocked in zip(qobjects, was_blocked):
+            qobject.blockSignals(blocked)
+
+
 class Input(QtCore.QObject):
 
     value_changed = QtCore.Signal(six.text_type)
@@ -526,7 +890,11 @@ class Input(QtCore.QObject):
 
     def __init__(self, label, helptext=None, required=False, interactive=True,
                  args_key=None):
-        QtCore.QObject.__init__(self)
+        # A Container is already initialized as a QGroupBox.  Initializing
+        # it again would create a second C++ object, leaving the first one
+        # as an empty window pointing at this one long after it's gone.
+        if not isinstance(self, QtWidgets.QWidget):
+            QtCore.QObject.__init__(self)
         self.label = label
         self.widgets = []
         self.dirty = False
@@ -537,10 +905,12 @@ class Input(QtCore.QObject):
         self.lock = threading.Lock()
         self.sufficient = False
         self._visible_hint = True
+        self._detached = False
 
         self.value_changed.connect(self._check_sufficiency)
         self.interactivity_changed.connect(self._check_sufficiency)
 
+    @diagnostics.traced('slot')
     def _check_sufficiency(self, event=None):
         new_sufficiency = bool(self.value()) and self.interactive
 
@@ -554,12 +924,16 @@ class Input(QtCore.QObject):
     def visible(self):
         return self._visible_hint
 
+    @diagnostics.traced('slot')
     def set_visible(self, visible_hint):
         # Qt visibility is actually controlled by containers and the parent
         # window.
         # We use self._visible_hint to indicate whether the widgets should
         # be considered by natcap.ui as being visible.
         self._visible_hint = visible_hint
+        self._apply_visible_hint()
+
+    def _apply_visible_hint(self):
         if any(widget.parent().isVisible() for widget in self.widgets
                if widget and widget.parent()):
             for widget in self.widgets:
@@ -573,23 +947,52 @@ class Input(QtCore.QObject):
     def set_value(self):
         raise NotImplementedError
 
+    def _set_value_silently(self, value):
+        # Set the value without emitting any signals, so that nothing reacts
+        # until _value_restored is called.  See Form._restore_history.
+        with _signals_blocked([self]):
+            self.set_value(value)
+
+    def _value_restored(self):
+        # Signal a value set with _set_value_silently.
+        self.value_changed.emit(self.value())
+
+    def detach(self):
+        """Release the input once its widgets have been removed.
+
+        Removing an input's widgets, as a Multi does when an item is
+        removed, leaves the input itself in place.  A detached input no
+        longer reacts to anything and is deleted.
+        """
+        if self._detached:
+            return
+        self._detached = True
+        # A validation thread can't be deleted while it runs, so an input
+        # that is being validated is deleted once validation finishes.
+        if not self.lock.locked():
+            self.deleteLater()
+
     def set_required(self, required):
         self.required = required
 
     def set_noninteractive(self, noninteractive):
         self.set_interactive(not noninteractive)
 
+    @diagnostics.traced('slot')
     def set_interactive(self, enabled):
         self.interactive = enabled
+        self._apply_interactive()
+        self.interactivity_changed.emit(self.interactive)
+
+    def _apply_interactive(self):
         for widget in self.widgets:
             if not widget:  # widgets to be skipped are None
                 continue
-            widget.setEnabled(enabled)
-        self.interactivity_changed.emit(self.interactive)
+            widget.setEnabled(self.interactive)
 
-    def _add_to(self, layout):
+    def _add_to(self, layout, row=None):
         self.setParent(layout.parent().window())  # all widgets belong to Form
-        current_row = layout.rowCount()
+        current_row = layout.rowCount() if row is None else row
         for widget_index, widget in enumerate(self.widgets):
             if not widget:
                 continue
@@ -597,7 +1000,7 @@ class Input(QtCore.QObject):
             # set the default interactivity based on self.interactive
             widget.setEnabled(self.interactive)
 
-            _apply_sizehint(widget)
+            LAYOUT_SCHEDULER.apply_sizehint(widget)
             layout.addWidget(
                 widget,  # widget
                 current_row,  # row
@@ -642,14 +1045,25 @@ class GriddedInput(Input):
             self.widgets[1] = self.label_widget
             self.label_widget.stateChanged.connect(self._hideability_changed)
             self._hideability_changed(True)
-            QT_APP.processEvents()
 
         self.lock = threading.Lock()
 
         # initialize visibility, as we've changed the input's widgets
         self.set_visible(self.visible)
 
+    def _widgets_deleted(self):
+        # A Multi deletes an item's widgets with its row, which may be
+        # before the input itself is deleted.
+        try:
+            self.valid_button.objectName()
+        except RuntimeError:
+            return True
+        return False
+
+    @diagnostics.traced('validation')
     def _validate(self):
+        if self._detached or self._widgets_deleted():
+            return
         self.lock.acquire()
 
         try:
@@ -711,7 +1125,15 @@ class GriddedInput(Input):
             self.lock.release()
             raise
 
+    @diagnostics.traced('validation')
     def _validation_finished(self, validation_warnings):
+        if self._detached or self._widgets_deleted():
+            self.lock.release()
+            if self._detached:
+                self.deleteLater()
+            return
+        if not validation_warnings:
+            validation_warnings = []
         new_validity = not bool(validation_warnings)
         appliccable_warnings = [w[1] for w in validation_warnings
                                 if self.args_key in w[0]]
@@ -792,6 +1214,7 @@ class Text(GriddedInput):
         self.textfield.textChanged.connect(self._text_changed)
         self.widgets[2] = self.textfield
 
+    @diagnostics.traced('slot')
     def _text_changed(self, new_text):
         self.dirty = True
         self.value_changed.emit(new_text)
@@ -800,6 +1223,13 @@ class Text(GriddedInput):
     def value(self):
         return self.textfield.text()
 
+    def _set_value_silently(self, value):
+        with _signals_blocked([self, self.textfield]):
+            self.set_value(value)
+
+    def _value_restored(self):
+        self._text_changed(self.value())
+
     def set_value(self, value):
         if value and self.hideable:
             self.set_hidden(False)
@@ -809,11 +1239,74 @@ class Text(GriddedInput):
         self.textfield.setText(value)
 
 
+class PathCompleter(QtWidgets.QCompleter):
+    """Complete paths typed into a line edit, without blocking typing.
+
+    Directories are listed by ``filesystem.DIRECTORY_LISTER`` in the
+    background.  Suggestions from a cached listing are shown right away and
+    updated when a fresh listing arrives.  At most ``MAX_COMPLETIONS``
+    suggestions are shown, so huge directories stay responsive.
+    """
+
+    MAX_COMPLETIONS = 100
+
+    def __init__(self, line_edit, directories_only=False, lister=None):
+        QtWidgets.QCompleter.__init__(self, line_edit)
+        self.directories_only = directories_only
+        if lister is None:
+            lister = filesystem.DIRECTORY_LISTER
+        self._lister = lister
+        self._model = QtCore.QStringListModel(self)
+        self.setModel(self._model)
+        # The model only ever holds matches, so Qt needn't filter it.
+        self.setCompletionMode(
+            QtWidgets.QCompleter.UnfilteredPopupCompletion)
+        line_edit.setCompleter(self)
+        line_edit.textEdited.connect(self._update)
+        self._lister.listed.connect(self._listed)
+
+    def _update(self, text):
+        directory, prefix = os.path.split(text)
+        if not directory:
+            self._model.setStringList([])
+            return
+        listing = self._lister.listing(directory)
+        if listing is not None:
+            self._show(directory, prefix, listing)
+
+    def _listed(self, dirpath, listing):
+        line_edit = self.widget()
+        if listing is None or line_edit is None:
+            return
+        directory, prefix = os.path.split(line_edit.text())
+        if (not directory or
+                os.path.normpath(os.path.expanduser(directory)) != dirpath):
+            return
+        self._show(directory, prefix, listing)
+        if line_edit.hasFocus():
+            self.complete()
+
+    def _show(self, directory, prefix, listing):
+        names = filesystem.complete(listing, prefix, self.MAX_COMPLETIONS,
+                                    self.directories_only)
+        self._model.setStringList(
+            [os.path.join(directory, name) for name in names])
+
+
 class _Path(Text):
+    # Whether to only suggest directories when completing paths.
+    _directories_only = False
+
+    # Milliseconds after the last edit before the path is watched and
+    # probed, so that typing doesn't touch the filesystem.
+    WATCH_DELAY_MS = 300
+
     class FileField(QtWidgets.QLineEdit):
         def __init__(self, starting_value=''):
             QtWidgets.QLineEdit.__init__(self, starting_value)
             self.setAcceptDrops(True)
+            self._unresolved_path = None
+            filesystem.DROP_RESOLVER.resolved.connect(self._drop_resolved)
 
         def dragEnterEvent(self, event=None):
             """Overriding the default dragEnterEvent function for when a file is
@@ -834,32 +1327,45 @@ class _Path(Text):
             """Overriding the default Qt DropEvent function when a file is
             dragged and dropped onto this qlineedit."""
             path = event.mimeData().urls()[0].path()
-            if platform.system() == 'Windows':
-                path = path[1:]  # Remove the '/' ahead of disk letter
-            elif platform.system() == 'Darwin':
-                # On mac, we need to ask the OS nicely for the fileid.
-                # This is only needed on Qt<5.4.1.
-                # See bug report at https://bugreports.qt.io/browse/QTBUG-40449
-                command = (
-                    "osascript -e 'get posix path of my posix file \""
-                    "file://{fileid}\" -- kthx. bai'").format(
-                        fileid=path)
-                process = subprocess.Popen(
-                    command, shell=True,
-                    stderr=subprocess.STDOUT,
-                    stdout=subprocess.PIPE)
-                path = process.communicate()[0].lstrip().rstrip()
-
             LOGGER.info('Accepting drop event with path: "%s"', path)
             event.accept()
-            self.setText(path)
+
+            local_path = filesystem.DROP_RESOLVER.resolve(path)
+            if local_path is None:
+                # Show the raw path until the OS has resolved it.
+                self._unresolved_path = path
+                self.setText(path)
+            else:
+                self._unresolved_path = None
+                self.setText(local_path)
+
+        def _drop_resolved(self, path, local_path):
+            if path != self._unresolved_path:
+                return
+            self._unresolved_path = None
+            # Unless the user has changed the text since the drop.
+            if self.text() == path:
+                self.setText(local_path)
 
     def __init__(self, label, helptext=None, required=False, interactive=True,
                  args_key=None, hideable=False, validator=None):
         Text.__init__(self, label, helptext, required, interactive, args_key,
                       hideable, validator=validator)
+        self._watched_path = None
+        self._watch_timer = QtCore.QTimer(self)
+        self._watch_timer.setSingleShot(True)
+        self._watch_timer.setInterval(self.WATCH_DELAY_MS)
+        self._watch_timer.timeout.connect(self._watch_text)
+        filesystem.PATH_WATCHER.paths_changed.connect(
+            self._watched_paths_changed)
+        filesystem.METADATA_PROBE.probed.connect(self._probed)
+        # The watch is released when the input is deleted without being
+        # detached, such as with its form.
+        self.destroyed.connect(filesystem.PATH_WATCHER.release)
         self.textfield = _Path.FileField()
         self.textfield.textChanged.connect(self._text_changed)
+        self.completer = PathCompleter(
+            self.textfield, directories_only=self._directories_only)
 
         self.widgets = [
             self.valid_button,
@@ -869,8 +1375,64 @@ class _Path(Text):
             self.help_button,
         ]
 
+    def _text_changed(self, new_text):
+        self._watch_timer.start()
+        Text._text_changed(self, new_text)
+
+    def _watch_text(self):
+        # Watch the path once editing pauses, so it's validated again if it
+        # changes on disk.
+        new_text = self.textfield.text()
+        if new_text == self._watched_path:
+            return
+        if self._watched_path:
+            filesystem.PATH_WATCHER.unwatch(self._watched_path)
+        if new_text:
+            filesystem.PATH_WATCHER.watch(new_text)
+            filesystem.METADATA_PROBE.request(new_text)
+        else:
+            self.textfield.setToolTip('')
+        self._watched_path = new_text
+        self.setProperty('watched_path', new_text)
+
+    def detach(self):
+        if self._detached:
+            return
+        self._watch_timer.stop()
+        if self._watched_path:
+            filesystem.PATH_WATCHER.unwatch(self._watched_path)
+        self._watched_path = None
+        self.setProperty('watched_path', None)
+        filesystem.PATH_WATCHER.paths_changed.disconnect(
+            self._watched_paths_changed)
+        filesystem.METADATA_PROBE.probed.disconnect(self._probed)
+        filesystem.DROP_RESOLVER.resolved.disconnect(
+            self.textfield._drop_resolved)
+        Text.detach(self)
+
+    def _watched_paths_changed(self, paths):
+        if self._watched_path not in paths:
+            return
+        filesystem.METADATA_PROBE.request(self._watched_path)
+        # A validation already in progress will see the change.
+        if not self.lock.locked():
+            LOGGER.debug('%s changed on disk, validating %s again',
+                         self._watched_path, self.args_key)
+            self._validate()
+
+    def _probed(self, path, metadata):
+        # Describe the selected file in the text field's tooltip.
+        if path != self._watched_path:
+            return
+        if metadata is None:
+            self.textfield.setToolTip('')
+        else:
+            self.textfield.setToolTip(filesystem.describe(metadata))
+
 
 class Folder(_Path):
+    _directories_only = True
+
     def __init__(self, label, helptext=None, required=False, interactive=True,
                  args_key=None, hideable=False, validator=None):
         _Path.__init__(self, label, helptext, required, interactive, args_key,
@@ -924,10 +1486,306 @@ class Checkbox(GriddedInput):
     def set_value(self, value):
         self.checkbox.setChecked(value)
 
+    def _set_value_silently(self, value):
+        with _signals_blocked([self, self.checkbox]):
+            self.set_value(value)
+
+
+def csv_column_options(path, column):
+    """Yield the unique values of a CSV column, in the order they appear.
+
+    Parameters:
+        path (string): The path to a CSV file with a header row.
+        column (string): The name of the column to read.
+    """
+    seen = set()
+    with open(path) as csv_file:
+        for row in csv.DictReader(csv_file):
+            value = row.get(column)
+            if value is None or value in seen:
+                continue
+            seen.add(value)
+            yield value
+
+
+def vector_field_options(path, field, layer_index=0):
+    """Yield the unique values of a vector's attribute field.
+
+    Requires GDAL's ``osgeo.ogr``.
+
+    Parameters:
+        path (string): The path to a vector readable by OGR.
+        field (string): The name of the attribute field to read.
+        layer_index=0 (int): The index of the layer to read.
+    """
+    from osgeo import ogr
+    vector = ogr.Open(path)
+    if vector is None:
+        raise IOError('Could not open vector %s' % path)
+    layer = vector.GetLayer(layer_index)
+    seen = set()
+    for feature in layer:
+        value = feature.GetField(field)
+        if value is None or value in seen:
+            continue
+        seen.add(value)
+        yield value
+
+
+def raster_unique_values(path, band_index=1):
+    """Yield the unique values of a raster band, excluding nodata.
+
+    The band is read one block at a time.  Requires GDAL's ``osgeo.gdal``
+    and numpy.
+
+    Parameters:
+        path (string): The path to a raster readable by GDAL.
+        band_index=1 (int): The 1-based index of the band to read.
+    """
+    import numpy
+    from osgeo import gdal
+    raster = gdal.Open(path)
+    if raster is None:
+        raise IOError('Could not open raster %s' % path)
+    band = raster.GetRasterBand(band_index)
+    nodata = band.GetNoDataValue()
+    block_xsize, block_ysize = band.GetBlockSize()
+    seen = set()
+    for yoff in range(0, band.YSize, block_ysize):
+        win_ysize = min(block_ysize, band.YSize - yoff)
+        for xoff in range(0, band.XSize, block_xsize):
+            win_xsize = min(block_xsize, band.XSize - xoff)
+            block = band.ReadAsArray(xoff, yoff, win_xsize, win_ysize)
+            for value in numpy.unique(block).tolist():
+                if value == nodata or value in seen:
+                    continue
+                seen.add(value)
+                yield value
+
+
+class _OptionsLoader(QtCore.QObject, threading.Thread):
+    """Read options from a provider in a background thread.
+
+    ``provider(path, *args)`` must return an iterable of options.  Options
+    are emitted in lists of up to ``chunk_size`` through ``options_loaded``
+    so that a dropdown can show them while the rest are still loading.  Both
+    signals carry the loader so that slots can ignore loaders that have since
+    been replaced.
+    """
+
+    options_loaded = QtCore.Signal(object, list)
+    finished = QtCore.Signal(object)
+
+    def __init__(self, provider, path, args=(), chunk_size=1000):
+        QtCore.QObject.__init__(self)
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.provider = provider
+        self.path = path
+        self.args = args
+        self.chunk_size = chunk_size
+        self.options = []
+        self.failed = False
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    @diagnostics.traced('options')
+    def run(self):
+        chunk = []
+        try:
+            for option in self.provider(self.path, *self.args):
+                if self.cancelled:
+                    return
+                chunk.append(option)
+                if len(chunk) >= self.chunk_size:
+                    self.options.extend(chunk)
+                    self.options_loaded.emit(self, chunk)
+                    chunk = []
+            if chunk and not self.cancelled:
+                self.options.extend(chunk)
+                self.options_loaded.emit(self, chunk)
+        except Exception:
+            # Any error from the provider is reported, not raised in a thread.
+            LOGGER.exception('Could not load options from %s', self.path)
+            self.failed = True
+        finally:
+            self.finished.emit(self)
+
+
+# Options loaded from files, keyed by (provider, args, path, mtime).  Only the
+# most recently used are kept.
+_OPTIONS_CACHE = collections.OrderedDict()
+_OPTIONS_CACHE_SIZE = 32
+
+
+def _cast_option(label):
+    if type(label) in (int, float):
+        label = str(label)
+    try:
+        return six.text_type(label, 'utf-8')
+    except TypeError:
+        # It's already unicode, so can't decode further.
+        return label
+
 
 class Dropdown(GriddedInput):
+
+    loading_changed = QtCore.Signal(bool)
+
+    class _OptionsModel(QtCore.QAbstractListModel):
+        """A list model of dropdown options, indexed for fast lookup.
+
+        Options are replaced in bulk with ``set_options``, which resets the
+        model once rather than inserting one row at a time, or streamed in
+        with ``append_options``.  Rows can be
+        looked up in O(1) by their text or by the value the user provided,
+        and searched by prefix or by fuzzy (subsequence) match.
+        """
+
+        def __init__(self, parent=None):
+            QtCore.QAbstractListModel.__init__(self, parent)
+            self.options = []
+            self.user_options = []
+            self._option_rows = {}
+            self._user_option_rows = {}
+            self._sorted_keys = []
+            self._sorted_rows = []
+            self._last_query = None
+            self._last_matches = None
+
+        def rowCount(self, parent=QtCore.QModelIndex()):
+            if parent.isValid():
+                return 0
+            return len(self.options)
+
+        def data(self, index, role=QtCore.Qt.DisplayRole):
+            if not index.isValid():
+                return None
+            if role in (QtCore.Qt.DisplayRole, QtCore.Qt.EditRole):
+                return self.options[index.row()]
+            return None
+
+        def _extend(self, user_options):
+            first_row = len(self.options)
+            cast_options = [_cast_option(label) for label in user_options]
+            self.options.extend(cast_options)
+            self.user_options.extend(user_options)
+
+            # setdefault so that duplicates map to their first row, as
+            # list.index() would.
+            for row, (label, user_label) in enumerate(
+                    zip(cast_options, user_options), first_row):
+                self._option_rows.setdefault(label, row)
+                try:
+                    self._user_option_rows.setdefault(user_label, row)
+                except TypeError:
+                    # Unhashable user options can still be found by text.
+                    pass
+
+            # The search index is rebuilt on the next search.
+            self._sorted_keys = None
+            self._sorted_rows = None
+            self._last_query = None
+            self._last_matches = None
+
+        def set_options(self, options):
+            self.beginResetModel()
+            self.options = []
+            self.user_options = []
+            self._option_rows = {}
+            self._user_option_rows = {}
+            self._extend(list(options))
+            self.endResetModel()
+
+        def append_options(self, options):
+            options = list(options)
+            if not options:
+                return
+            first_row = len(self.options)
+            self.beginInsertRows(QtCore.QModelIndex(), first_row,
+                                 first_row + len(options) - 1)
+            self._extend(options)
+            self.endInsertRows()
+
+        def row(self, value):
+            """Get the row of an option.
+
+            Parameters:
+                value: Either the text of an option or the value that was
+                    provided for it.
+
+            Returns:
+                The int row of the first matching option.
+
+            Raises:
+                ValueError: When the value is not an option.
+            """
+            for rows in (self._option_rows, self._user_option_rows):
+                try:
+                    return rows[value]
+                except (KeyError, TypeError):
+                    # TypeError when value is not hashable.
+                    pass
+            raise ValueError(value)
+
+        def search(self, query, limit=None):
+            """Find options matching ``query``, ignoring case.
+
+            Options starting with ``query`` are found by bisecting a sorted
+            index and come first, in sorted order.  They are followed by
+            options containing the characters of ``query`` in order, in
+            option order.  When ``query`` extends the previous query, only
+            the previous fuzzy matches are searched again.
+
+            Parameters:
+                query (string): The text to search for.
+                limit=None (int): If provided, the maximum number of rows to
+                    return.
+
+            Returns:
+                A list of matching int rows.
+            """
+            if self._sorted_keys is None:
+                keyed_rows = sorted((label.lower(), row) for (row, label)
+                                    in enumerate(self.options))
+                self._sorted_keys = [key for (key, _) in keyed_rows]
+                self._sorted_rows = [row for (_, row) in keyed_rows]
+
+            query = query.lower()
+            start = bisect.bisect_left(self._sorted_keys, query)
+            end = bisect.bisect_left(self._sorted_keys, query + u'\uffff',
+                                     lo=start)
+            prefix_rows = self._sorted_rows[start:end]
+
+            if (self._last_query is not None and
+                    query.startswith(self._last_query)):
+                candidates = self._last_matches
+            else:
+                candidates = range(len(self.options))
+
+            fuzzy_rows = []
+            for row in candidates:
+                option_chars = iter(self.options[row].lower())
+                if all(char in option_chars for char in query):
+                    fuzzy_rows.append(row)
+            self._last_query = query
+            self._last_matches = fuzzy_rows
+
+            prefix_row_set = set(prefix_rows)
+            matches = prefix_rows + [row for row in fuzzy_rows
+                                     if row not in prefix_row_set]
+            if limit is not None:
+                matches = matches[:limit]
+            return matches
+
     def __init__(self, label, helptext=None, interactive=True, args_key=None,
-                 hideable=False, options=()):
+                 hideable=False, options=(), filterable=False):
         # Dropdowns are always required ... there isn't a way for the dropdown
         # to *not* provide a value, so it always produces a value and is always
         # satisfied.
@@ -935,15 +1793,50 @@ class Dropdown(GriddedInput):
                               interactive=interactive, args_key=args_key,
                               hideable=hideable, validator=None, required=True)
         self.dropdown = QtWidgets.QComboBox()
+        self._model = Dropdown._OptionsModel(self.dropdown)
+        self.dropdown.setModel(self._model)
         self.widgets[2] = self.dropdown
+
+        # Options loaded in the background.  A value set while loading is
+        # selected once it arrives.
+        self.loading = False
+        self._options_loader = None
+        self._pending_value = None
+        # The (input, provider, args) that options are loaded from.
+        self._options_source = None
+
         self.set_options(options)
         self.dropdown.currentIndexChanged.connect(self._index_changed)
         self.satisfied = True
 
+        # When filterable, the user can type into the dropdown to filter the
+        # options shown in a popup.
+        self.filterable = filterable
+        if self.filterable:
+            self.dropdown.setEditable(True)
+            self.dropdown.setInsertPolicy(QtWidgets.QComboBox.NoInsert)
+            self._filter_results = QtCore.QStringListModel(self.dropdown)
+            self._completer = QtWidgets.QCompleter(self._filter_results,
+                                                   self.dropdown)
+            self._completer.setCompletionMode(
+                QtWidgets.QCompleter.UnfilteredPopupCompletion)
+            self._completer.activated[str].connect(self.set_value)
+            self.dropdown.setCompleter(self._completer)
+            self.dropdown.lineEdit().textEdited.connect(self._filter_options)
+
         # Init hideability if needed
         if self.hideable:
             self._hideability_changed(False)
 
+    @property
+    def options(self):
+        return self._model.options
+
+    @property
+    def user_options(self):
+        return self._model.user_options
+
+    @diagnostics.traced('slot')
     def _index_changed(self, newindex):
         try:
             self.value_changed.emit(self.options[newindex])
@@ -951,38 +1844,163 @@ class Dropdown(GriddedInput):
             # When options are cleared and there is no current index
             self.value_changed.emit('')
 
+    def _set_value_silently(self, value):
+        with _signals_blocked([self, self.dropdown]):
+            self.set_value(value)
+
+    def _value_restored(self):
+        self._index_changed(self.dropdown.currentIndex())
+
+    def _filter_options(self, text):
+        rows = self._model.search(text, limit=self._completer.maxVisibleItems())
+        self._filter_results.setStringList([self.options[row] for row in rows])
+
+    @diagnostics.traced('slot')
     def set_options(self, options):
-        self.dropdown.clear()
-        cast_options = []
-        for label in options:
-            if type(label) in (int, float):
-                label = str(label)
+        self._cancel_options_load()
+        self._model.set_options(options)
+
+    def set_options_source(self, path_input, provider, *args):
+        """Load options from the file selected in another input.
+
+        Whenever the value of ``path_input`` changes, any load in progress is
+        cancelled and options are loaded from the new path with
+        ``load_options``.
+
+        Parameters:
+            path_input (Input): An input whose value is a path, such as a
+                ``File``.
+            provider (callable): Called as ``provider(path, *args)`` to
+                produce options.  See ``csv_column_options``,
+                ``vector_field_options`` and ``raster_unique_values``.
+                If ``None``, options stop being loaded from any input.
+        """
+        if self._options_source is not None:
+            previous_input = self._options_source[0]
             try:
-                cast_value = six.text_type(label, 'utf-8')
-            except TypeError:
-                # It's already unicode, so can't decode further.
-                cast_value = label
-            self.dropdown.addItem(cast_value)
-            cast_options.append(cast_value)
-        self.options = cast_options
-        self.user_options = options
+                previous_input.value_changed.disconnect(
+                    self._options_source_changed)
+            except (TypeError, RuntimeError):
+                # The previous input has been deleted.
+                pass
+            self._options_source = None
+        if provider is None:
+            return
+        self._options_source = (path_input, provider, args)
+        path_input.value_changed.connect(self._options_source_changed)
+        if path_input.value():
+            self._options_source_changed(path_input.value())
+
+    def _options_source_changed(self, path):
+        _, provider, args = self._options_source
+        self.load_options(path, provider, *args)
+
+    def load_options(self, path, provider, *args):
+        """Load options from a file in a background thread.
+
+        Options are added to the dropdown in chunks as they are read.  The
+        options are cached for each path and modification time, so loading
+        an unchanged file again doesn't read it.  Options that fail to load
+        leave the dropdown empty and are logged.
+
+        Parameters:
+            path (string): The file to read options from.
+            provider (callable): Called as ``provider(path, *args)`` in the
+                background thread to produce options.
+            *args: Extra hashable arguments for ``provider``.
+        """
+        if self._pending_value is None and self.options:
+            self._pending_value = self.value()
+        self._cancel_options_load()
+
+        try:
+            cache_key = (provider, args, os.path.abspath(path),
+                         os.path.getmtime(path))
+        except (OSError, TypeError):
+            # The path doesn't exist (yet), so there are no options.
+            self._model.set_options([])
+            return
+
+        if cache_key in _OPTIONS_CACHE:
+            _OPTIONS_CACHE[cache_key] = _OPTIONS_CACHE.pop(cache_key)
+            self._model.set_options(_OPTIONS_CACHE[cache_key])
+            self._select_pending_value()
+            self._pending_value = None
+            return
+
+        self._model.set_options([])
+        self._set_loading(True)
+        loader = _OptionsLoader(provider, path, args)
+        loader.cache_key = cache_key
+        loader.options_loaded.connect(self._options_loaded)
+        loader.finished.connect(self._options_load_finished)
+        self._options_loader = loader
+        loader.start()
+
+    def _cancel_options_load(self):
+        if self._options_loader is not None:
+            LOGGER.debug('Cancelling options load from %s',
+                         self._options_loader.path)
+            self._options_loader.cancel()
+            self._options_loader = None
+            self._set_loading(False)
+
+    def _set_loading(self, loading):
+        self.loading = loading
+        self.dropdown.setEnabled(self.interactive and not loading)
+        if loading:
+            self.dropdown.setToolTip('Loading options...')
+        else:
+            self.dropdown.setToolTip('')
+        self.loading_changed.emit(loading)
+
+    def _select_pending_value(self):
+        if self._pending_value is None:
+            return
+        try:
+            self.dropdown.setCurrentIndex(self._model.row(self._pending_value))
+        except ValueError:
+            return
+        self._pending_value = None
+
+    def _options_loaded(self, loader, options):
+        if loader is not self._options_loader:
+            return
+        self._model.append_options(options)
+        self._select_pending_value()
+
+    def _options_load_finished(self, loader):
+        if loader is not self._options_loader:
+            return
+        self._options_loader = None
+        self._set_loading(False)
+        if not loader.failed:
+            _OPTIONS_CACHE[loader.cache_key] = loader.options
+            while len(_OPTIONS_CACHE) > _OPTIONS_CACHE_SIZE:
+                _OPTIONS_CACHE.popitem(last=False)
+        if self._pending_value is not None:
+            LOGGER.debug('Value %s not in options loaded from %s',
+                           self._pending_value, loader.path)
+            self._pending_value = None
 
     def value(self):
-        return self.dropdown.currentText()
+        index = self.dropdown.currentIndex()
+        if index < 0:
+            return u''
+        return self.options[index]
 
     def set_value(self, value):
         # Handle case where value is of the type provided by the user,
         # and the case where it's been converted to a utf-8 string.
-        for options_attr in ('options', 'user_options'):
-            try:
-                index = getattr(self, options_attr).index(value)
-                self.dropdown.setCurrentIndex(index)
+        try:
+            self.dropdown.setCurrentIndex(self._model.row(value))
+        except ValueError:
+            if self.loading:
+                # The value may not have been loaded yet.
+                self._pending_value = value
                 return
-            except ValueError:
-                # ValueError when the value is not in the list
-                pass
-        raise ValueError('Value %s not in options %s or user options %s' % (
-            value, self.options, self.user_options))
+            raise ValueError('Value %s not in options %s or user options %s' % (
+                value, self.options, self.user_options))
 
 
 class Label(QtWidgets.QLabel):
@@ -991,8 +2009,10 @@ class Label(QtWidgets.QLabel):
         self.setWordWrap(True)
         self.setOpenExternalLinks(True)
 
-    def _add_to(self, layout):
-        layout.addWidget(self, layout.rowCount(),  # target row
+    def _add_to(self, layout, row=None):
+        if row is None:
+            row = layout.rowCount()
+        layout.addWidget(self, row,  # target row
                          0,  # target starting column
                          1,  # row span
                          layout.columnCount())  # span all columns
@@ -1004,6 +2024,7 @@ class Container(QtWidgets.QGroupBox, Input):
     value_changed = QtCore.Signal(bool)
     interactivity_changed = QtCore.Signal(bool)
     sufficiency_changed = QtCore.Signal(bool)
+    child_added = QtCore.Signal(object)
 
     def __init__(self, label, interactive=True, expandable=False,
                  expanded=True, args_key=None, helptext=None):
@@ -1014,6 +2035,18 @@ class Container(QtWidgets.QGroupBox, Input):
         if self.helptext:
             warnings.warn('helptext option is currently ignored for Containers')
         self.widgets = [self]
+
+        # The widgets of the inputs in this container, in the order they were
+        # added, so that expanding or collapsing doesn't need to search the
+        # grid.  _widgets_stale is True when the widgets' visibility may not
+        # match self.expanded, such as when toggled while hidden.
+        self._child_widgets = []
+        self._widgets_stale = True
+
+        # The inputs directly inside this container.  Their interactivity
+        # and visibility follow this container's sufficiency.
+        self._child_inputs = []
+
         self.setCheckable(expandable)
         if expandable:
             self.setChecked(expanded)
@@ -1024,26 +2057,48 @@ class Container(QtWidgets.QGroupBox, Input):
         self.toggled.connect(self._hide_widgets)
         self.value_changed.connect(self._check_sufficiency)
         self.interactivity_changed.connect(self._check_sufficiency)
+        self.sufficiency_changed.connect(self._propagate_sufficiency)
 
         self.setSizePolicy(
             QtWidgets.QSizePolicy.Expanding,  # horizontal
             QtWidgets.QSizePolicy.MinimumExpanding)  # vertical
 
+    def _suspend_layout(self):
+        # Qt lays out the whole grid every time a child widget is shown
+        # inside a visible parent, so showing the widgets of each new row
+        # costs O(rows).  A disabled layout ignores these requests, so the
+        # grid is only laid out once, when the layout is resumed on the next
+        # event loop turn.
+        self.layout().setEnabled(False)
+        LAYOUT_SCHEDULER.call_later(self._resume_layout)
+
+    @diagnostics.traced('layout')
+    def _resume_layout(self):
+        self.layout().setEnabled(True)
+        self.layout().activate()
+        self.setMinimumSize(self.sizeHint())
+        self.update()
+
     @QtCore.Slot(bool)
+    @diagnostics.traced('layout')
     def _hide_widgets(self, check_state):
-        for layout_item in (self.layout().itemAtPosition(*coords)
-                            for coords in itertools.product(
-                                xrange(1, self.layout().rowCount()),
-                                xrange(1, self.layout().columnCount()))):
-            if layout_item and self.isVisible():
-                layout_item.widget().setVisible(self.isChecked())
-
-        # Update size based on sizehint now that widgets changed.
-        self.setMinimumSize(self.sizeHint())
-        #self.resize(self.sizeHint())
+        if not self.isVisible():
+            # Widgets are shown with their parent, so their visibility is
+            # set once this container is shown.
+            self._widgets_stale = True
+            return
+
+        self._suspend_layout()
+        self.setUpdatesEnabled(False)
+        try:
+            for widget in self._child_widgets:
+                widget.setVisible(check_state)
+        finally:
+            self.setUpdatesEnabled(True)
+        self._widgets_stale = False
 
     def showEvent(self, event=None):
-        if self.isCheckable():
+        if self.isCheckable() and self._widgets_stale:
             self._hide_widgets(self.value())
         self.resize(self.sizeHint())
 
@@ -1070,7 +2125,10 @@ class Container(QtWidgets.QGroupBox, Input):
 
     def add_input(self, input):
         input._add_to(layout=self.layout())
-        _apply_sizehint(self.layout().parent())
+        self._child_widgets.extend(
+            widget for widget in input.widgets if widget)
+        self._child_inputs.append(input)
+        self._suspend_layout()
 
         if self.expandable:
             input.set_visible(self.expanded)
@@ -1081,17 +2139,77 @@ class Container(QtWidgets.QGroupBox, Input):
                     if not widget:
                         continue
                     widget.setVisible(self.expanded)
-        self.sufficiency_changed.connect(input.set_interactive)
-        self.sufficiency_changed.connect(input.set_visible)
 
         if isinstance(input, Multi):
-            def _update_sizehints():
-                self.setMinimumSize(self.sizeHint())
-            input.input_added.connect(_update_sizehints)
+            input.input_added.connect(self._suspend_layout)
+        self.child_added.emit(input)
+
+    @diagnostics.traced('slot')
+    def _propagate_sufficiency(self, sufficient):
+        """Make the inputs in this container follow its sufficiency.
+
+        The new interactivity, visibility and sufficiency of every input
+        below this container is computed in one pass over the input tree,
+        skipping subtrees whose state doesn't change.  Only then are the net
+        changes applied to widgets and signalled, so the cost is proportional
+        to the number of inputs that change.
+
+        Parameters:
+            sufficient (bool): Whether this container is sufficient.
+
+        Returns:
+            ``None``
+        """
+        changes = []
+        pending = collections.deque(
+            (child, sufficient) for child in self._child_inputs)
+        while pending:
+            input_, enabled = pending.popleft()
+            interactivity_changed = input_.interactive != enabled
+            visibility_changed = input_._visible_hint != enabled
+            if not (interactivity_changed or visibility_changed):
+                continue
+            input_.interactive = enabled
+            input_._visible_hint = enabled
+
+            sufficiency_changed = False
+            if isinstance(input_, Container):
+                new_sufficiency = bool(input_.value()) and enabled
+                if input_.sufficient != new_sufficiency:
+                    input_.sufficient = new_sufficiency
+                    sufficiency_changed = True
+                    pending.extend((child, new_sufficiency)
+                                   for child in input_._child_inputs)
+            changes.append((input_, interactivity_changed, visibility_changed,
+                            sufficiency_changed))
+
+        if not changes:
+            return
 
-    def _add_to(self, layout):
+        self._suspend_layout()
+        self.setUpdatesEnabled(False)
+        try:
+            for input_, interactivity_changed, visibility_changed, _ in changes:
+                if interactivity_changed:
+                    input_._apply_interactive()
+                if visibility_changed:
+                    input_._apply_visible_hint()
+        finally:
+            self.setUpdatesEnabled(True)
+
+        # Signals are emitted once the whole tree is consistent.  Containers
+        # receiving their own sufficiency_changed find nothing left to change.
+        for input_, interactivity_changed, _, sufficiency_changed in changes:
+            if interactivity_changed:
+                input_.interactivity_changed.emit(input_.interactive)
+            if sufficiency_changed:
+                input_.sufficiency_changed.emit(input_.sufficient)
+
+    def _add_to(self, layout, row=None):
+        if row is None:
+            row = layout.rowCount()
         layout.addWidget(self,
-                         layout.rowCount(),  # target row
+                         row,  # target row
                          0,  # target starting column
                          1,  # row span
                          layout.columnCount())  # span all columns
@@ -1102,6 +2220,21 @@ class Container(QtWidgets.QGroupBox, Input):
     def set_value(self, value):
         self.expanded = value
 
+    def _set_value_silently(self, value):
+        # A container lays out its children when toggled, so its signals
+        # can't be blocked.
+        self.set_value(value)
+
+    def _value_restored(self):
+        pass
+
+    def detach(self):
+        if self._detached:
+            return
+        for input_ in self._child_inputs:
+            input_.detach()
+        Input.detach(self)
+
 
 class Multi(Container):
 
@@ -1110,19 +2243,25 @@ class Multi(Container):
 
     class _RemoveButton(QtWidgets.QPushButton):
 
-        remove_requested = QtCore.Signal(int)
+        remove_requested = QtCore.Signal(object)
 
-        def __init__(self, label, index):
+        def __init__(self, label, item):
             QtWidgets.QPushButton.__init__(self, label)
-            self.index = index
+            # Hold a reference to the item rather than its index so that the
+            # button stays correct as other rows are inserted or removed.
+            self.item = item
             self.clicked.connect(self._remove)
 
         def _remove(self, checked=False):
-            self.remove_requested.emit(self.index)
+            self.remove_requested.emit(self.item)
 
     def __init__(self, label, callable_, interactive=True, args_key=None,
                  link_text='Add Another', helptext=None):
         self.items = []
+        # The grid row of each item, in the same order as self.items.
+        self._item_rows = []
+        # Items added by add_values whose values haven't been signalled yet.
+        self._unsignalled_items = []
         Container.__init__(self,
                            label=label,
                            interactive=interactive,
@@ -1140,6 +2279,16 @@ class Multi(Container):
         self._append_add_link()
         self.remove_buttons = []
 
+        # Items are placed on consecutive grid rows from _first_row.  Rows
+        # left empty by removed items are reclaimed by _compact_rows.
+        self._first_row = self.layout().rowCount()
+        self._next_row = self._first_row
+
+        # Many values can be added at once by dropping several files onto
+        # the Multi or by pasting newline-separated values while it has focus.
+        self.setAcceptDrops(True)
+        self.setFocusPolicy(QtCore.Qt.ClickFocus)
+
     def value(self):
         return [input_.value() for input_ in self.items]
 
@@ -1155,34 +2304,111 @@ class Multi(Container):
     def _add_templated_item(self, label=None):
         self.add_item()
 
+    def add_values(self, values):
+        """Add one new item for each of ``values`` in a single batch.
+
+        Parameters:
+            values (iterable): Values for the new items.  Each new item is
+                created with ``callable_`` and then set to its value.  The
+                new items signal their values and are validated together on
+                the next event loop turn, once the whole batch is in.
+
+        Returns:
+            ``None``
+        """
+        self.setUpdatesEnabled(False)
+        try:
+            for value in values:
+                new_input = self.callable_()
+                new_input._set_value_silently(value)
+                self.add_item(new_input)
+                self._unsignalled_items.append(new_input)
+        finally:
+            self.setUpdatesEnabled(True)
+        LAYOUT_SCHEDULER.call_later(_call_weakly, weakref.ref(self),
+                                    '_signal_added_values')
+        self.value_changed.emit(self.value())
+
+    def _signal_added_values(self):
+        items, self._unsignalled_items = self._unsignalled_items, []
+        for item in items:
+            if not item._detached:
+                item._value_restored()
+
+    @staticmethod
+    def _values_from_mimedata(mime_data):
+        if mime_data.hasUrls():
+            values = []
+            for url in mime_data.urls():
+                if url.isLocalFile():
+                    values.append(url.toLocalFile())
+                else:
+                    values.append(url.toString())
+            return values
+
+        if mime_data.hasText():
+            return [line.strip() for line in mime_data.text().splitlines()
+                    if line.strip()]
+        return []
+
+    def dragEnterEvent(self, event=None):
+        if event.mimeData().hasUrls() or event.mimeData().hasText():
+            event.accept()
+        else:
+            event.ignore()
+
+    def dropEvent(self, event=None):
+        values = Multi._values_from_mimedata(event.mimeData())
+        LOGGER.info('Adding %s dropped values to %s', len(values), self)
+        event.accept()
+        self.add_values(values)
+
+    def paste(self):
+        """Add one item for each path or line of text on the clipboard."""
+        values = Multi._values_from_mimedata(QT_APP.clipboard().mimeData())
+        LOGGER.info('Adding %s pasted values to %s', len(values), self)
+        self.add_values(values)
+
+    def keyPressEvent(self, event):
+        if event.matches(QtGui.QKeySequence.Paste):
+            self.paste()
+            event.accept()
+        else:
+            Container.keyPressEvent(self, event)
+
+    @diagnostics.traced('slot')
     def add_item(self, new_input=None):
         if not new_input:
             new_input = self.callable_()
 
-        new_input._add_to(self.layout())
-        self.items.append(new_input)
+        self._suspend_layout()
 
+        # Each item is placed on its own grid row.  Removing an item only
+        # detaches the widgets on its row, so the remaining items are never
+        # reparented.  QGridLayout gives empty rows no space, so they don't
+        # affect the layout until they are reclaimed.
         layout = self.layout()
-        rightmost_item = layout.itemAtPosition(
-            layout.rowCount()-1, layout.columnCount()-1)
+        row = self._next_row
+        self._next_row += 1
+        new_input._add_to(layout, row)
+        self.items.append(new_input)
+        self._item_rows.append(row)
+
+        rightmost_item = layout.itemAtPosition(row, layout.columnCount()-1)
         if not rightmost_item:
             col_index = layout.columnCount()-1
         else:
             col_index = layout.columnCount()
 
-        new_remove_button = Multi._RemoveButton(
-            '-R-', index=max(0, len(self.items)-1))
-        new_remove_button.remove_requested.connect(self.remove)
+        new_remove_button = Multi._RemoveButton('-R-', item=new_input)
+        new_remove_button.remove_requested.connect(self._remove_item)
         self.remove_buttons.append(new_remove_button)
 
         layout.addWidget(new_remove_button,
-                         layout.rowCount()-1,  # current last row
+                         row,
                          col_index,
                          1,  # span 1 row
                          1)  # span 1 column
-        QT_APP.processEvents()
-        self.setMinimumSize(self.sizeHint())
-        self.update()
         self.input_added.emit()
 
     def _append_add_link(self):
@@ -1193,29 +2419,107 @@ class Multi(Container):
                          1,  # row span
                          layout.columnCount())  # span all columns
 
-    def clear(self):
+    def _detach_row(self, item, remove_button):
+        # Only the widgets on this item's row are touched.  They are hidden
+        # before being removed so that Qt doesn't re-lay out the rest of the
+        # grid, and deleted once control returns to the event loop, as is
+        # the item itself.
+        item.detach()
         layout = self.layout()
-        for i in reversed(range(layout.count())):
-            layout.itemAt(i).widget().setParent(None)
-        self._append_add_link()
-
-    def remove(self, index):
-        # clear all widgets from the layout.
-        self.clear()
+        for widget in item.widgets + [remove_button]:
+            if not widget:
+                continue
+            widget.hide()
+            layout.removeWidget(widget)
+            widget.deleteLater()
 
-        self.items.pop(index)
-        self.remove_buttons.pop(index)
-        old_items = self.items[:]
+    def clear(self):
+        self._suspend_layout()
+        for item, remove_button in zip(self.items, self.remove_buttons):
+            self._detach_row(item, remove_button)
         self.items = []
         self.remove_buttons = []
-        for item in old_items:
-            self.add_item(item)
+        self._item_rows = []
+        self._next_row = self._first_row
+
+    def detach(self):
+        if self._detached:
+            return
+        for item in self.items:
+            item.detach()
+        Container.detach(self)
+
+    def _remove_item(self, item):
+        self.remove(self.items.index(item))
+
+    @diagnostics.traced('slot')
+    def remove(self, index):
+        self._suspend_layout()
+        item = self.items.pop(index)
+        remove_button = self.remove_buttons.pop(index)
+        self._item_rows.pop(index)
+        self._detach_row(item, remove_button)
+        self._compact_rows()
+
+    def _compact_rows(self):
+        # QGridLayout never drops a row, so the rows of removed items are
+        # reclaimed by moving the remaining items up, once the empty rows
+        # outnumber them.  Each item is moved at most once for every item
+        # removed before it, so the grid stays proportional to the number of
+        # items at a constant amortized cost per removal.
+        empty_rows = self._next_row - self._first_row - len(self.items)
+        if empty_rows <= len(self.items):
+            return
+
+        layout = self.layout()
+        for new_row, (item, remove_button, old_row) in enumerate(
+                zip(self.items, self.remove_buttons, self._item_rows),
+                self._first_row):
+            if old_row == new_row:
+                continue
+            for widget in item.widgets + [remove_button]:
+                if not widget:
+                    continue
+                _, column, row_span, column_span = layout.getItemPosition(
+                    layout.indexOf(widget))
+                layout.removeWidget(widget)
+                layout.addWidget(widget, new_row, column, row_span,
+                                 column_span)
+        self._item_rows = list(range(self._first_row,
+                                     self._first_row + len(self.items)))
+        self._next_row = self._first_row + len(self.items)
+
+
+# A condition for Form.add_rule that holds while an input is sufficient.
+SUFFICIENT = object()
+
+# The number of changes Form.undo can go back, and the time within which
+# changes to the same input are undone together.
+HISTORY_LENGTH = 1000
+HISTORY_MERGE_SECONDS = 1.0
+
+# Python 2 has no monotonic clock.
+_monotonic = getattr(time, 'monotonic', time.time)
+
+# Milliseconds without changes before Form autosaves its args.
+AUTOSAVE_DELAY_MS = 2000
+
+
+def _rule_condition_holds(input_, condition):
+    if condition is SUFFICIENT:
+        return bool(input_.sufficient)
+    if hasattr(condition, '__call__'):
+        return bool(condition(input_.value()))
+    return input_.value() == condition
 
 
 class Form(QtWidgets.QWidget):
 
     submitted = QtCore.Signal()
     run_finished = QtCore.Signal()
+    # The files referenced by a loaded snapshot that were changed or removed
+    # since it was saved, sorted.
+    snapshot_files_changed = QtCore.Signal(list)
 
     def __init__(self):
         QtWidgets.QWidget.__init__(self)
@@ -1246,8 +2550,7 @@ class Form(QtWidgets.QWidget):
 
         # set the sizehint of the inputs again ... needed after setting
         # scroll_area.
-        if self.inputs.sizeHint().isValid():
-            self.inputs.setMinimumSize(self.inputs.sizeHint())
+        LAYOUT_SCHEDULER.apply_sizehint(self.inputs)
         self.layout().setSizeConstraint(QtWidgets.QLayout.SetMinimumSize)
         self.inputs.layout().setSizeConstraint(QtWidgets.QLayout.SetMinimumSize)
 
@@ -1262,34 +2565,114 @@ class Form(QtWidgets.QWidget):
 
         self.run_dialog = FileSystemRunDialog()
 
+        # Rules from add_rule, keyed by the (args_key, action) they control,
+        # and the rule keys that depend on each args_key.
+        self._rules = collections.OrderedDict()
+        self._rule_dependents = {}
+        self._changed_rule_sources = set()
+
+        # The value of every input with an args_key, updated as values
+        # change so that assemble_args doesn't need to visit every input.
+        self._args = {}
+        self._inputs_by_key = {}
+        self._volatile_args_keys = set()
+        self.inputs.child_added.connect(self._register_input)
+
+        self._file_hasher = snapshot.FileHasher(self)
+
+        # Undo and redo history of self._args.  Each entry is a list of the
+        # time it was made and a dict mapping only the args_keys that changed
+        # to their (old, new) values, so an entry costs O(changed keys) and
+        # unchanged values are never copied.  Changes made in the same event
+        # loop turn are collected in self._history_changes and become one
+        # entry.
+        self._undo_history = []
+        self._redo_history = []
+        self._history_changes = {}
+        self._restoring_history = False
+
+        self._autosaver = None
+
     def update_scroll_border(self, min, max):
         if min == 0 and max == 0:
-            self.scroll_area.setStyleSheet("QScrollArea { border: None } ")
+            stylesheet = "QScrollArea { border: None } "
         else:
-            self.scroll_area.setStyleSheet("")
+            stylesheet = ""
 
-    def run(self, target, logfile=None, args=(), kwargs=None, tempdir=None,
-            window_title='', out_folder='/'):
+        # Setting a stylesheet restyles every widget in the scroll area, and
+        # the scroll range changes whenever inputs are added or resized.
+        if self.scroll_area.styleSheet() != stylesheet:
+            self.scroll_area.setStyleSheet(stylesheet)
 
+    @diagnostics.traced('executor')
+    def run(self, target, logfile=None, args=(), kwargs=None, tempdir=None,
+            window_title='', out_folder='/', stage_inputs=(),
+            scratch_quota=None, scratch_in_memory=False,
+            required_space=None, min_write_speed=None):
+        """Run a target in a thread while showing the run dialog.
+
+        If ``required_space`` (bytes) or ``min_write_speed`` (bytes per
+        second) are given, ``out_folder`` is checked first with
+        ``execution.preflight``.  If it looks too small or too slow, the
+        user is asked whether to run anyway.
+
+        The target gets a scratch directory under ``tempdir`` (or the system
+        temporary directory, or a RAM-backed one if ``scratch_in_memory``)
+        as its temporary directory, removed when it finishes.  A warning is
+        logged if it holds more than ``scratch_quota`` bytes.  See
+        ``execution.ScratchSpace``.
+
+        Input files named by the values of the args keys in
+        ``stage_inputs`` are first copied to ``tempdir``, which should be on
+        fast local storage, and the target is given the copies.  Only list
+        keys of inputs here, since writes to a staged copy are lost.  See
+        ``execution.InputStager``.
+
+        Returns:
+            ``False`` if the user chose not to run, ``True`` otherwise.
+        """
         if not hasattr(target, '__call__'):
             raise ValueError('Target %s must be callable' % target)
 
+        if required_space is not None or min_write_speed is not None:
+            QtWidgets.QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
+            try:
+                problems = execution.preflight(out_folder, required_space,
+                                               min_write_speed)
+            finally:
+                QtWidgets.QApplication.restoreOverrideCursor()
+            if problems:
+                for problem in problems:
+                    LOGGER.warning('Preflight: %s', problem)
+                answer = QtWidgets.QMessageBox.question(
+                    self, 'Run anyway?',
+                    '\n\n'.join(problems + ['Run anyway?']),
+                    QtWidgets.QMessageBox.Yes | QtWidgets.QMessageBox.No)
+                if answer != QtWidgets.QMessageBox.Yes:
+                    return False
+
         self._thread = execution.Executor(target,
                                           args,
                                           kwargs,
                                           logfile=logfile,
-                                          tempdir=tempdir)
+                                          tempdir=tempdir,
+                                          stage_inputs=stage_inputs,
+                                          scratch_quota=scratch_quota,
+                                          scratch_in_memory=scratch_in_memory)
         self._thread.finished.connect(self._run_finished)
 
         self.run_dialog.start(window_title=window_title,
                               out_folder=out_folder)
-        QT_APP.processEvents()
         self.run_dialog.show()
-        QT_APP.processEvents()
         self._thread.start()
+        return True
 
+    @diagnostics.traced('executor')
     def _run_finished(self):
         # When the thread finishes.
+        if self._thread.exception is None and self._autosaver is not None:
+            # The args are no longer at risk of being lost.
+            self._autosaver.discard()
         self.run_dialog.finish(
             exception_found=(self._thread.exception is not None),
             thread_exception=self._thread.exception)
@@ -1297,3 +2680,376 @@ class Form(QtWidgets.QWidget):
 
     def add_input(self, input):
         self.inputs.add_input(input)
+
+    def _register_input(self, input_):
+        if isinstance(input_, Container):
+            input_.child_added.connect(self._register_input)
+            for child_input in input_._child_inputs:
+                self._register_input(child_input)
+
+        if not input_.args_key:
+            return
+        self._inputs_by_key[input_.args_key] = input_
+        # Bound methods of the form, rather than partials holding it, so that
+        # the inputs' signals don't keep the form alive.  Qt disconnects them
+        # when either side is destroyed.  destroyed() only carries a plain
+        # QObject, so the args_key is kept as a property to find the input.
+        input_.setProperty('args_key', input_.args_key)
+        input_.destroyed.connect(self._input_destroyed)
+        if isinstance(input_, Multi):
+            # A Multi doesn't signal changes to its items' values, so its
+            # value is read whenever args are assembled.
+            self._volatile_args_keys.add(input_.args_key)
+            input_.value_changed.connect(self._args_changed)
+            return
+        self._args[input_.args_key] = input_.value()
+        input_.value_changed.connect(self._update_arg)
+
+    def _input_destroyed(self, destroyed_input):
+        args_key = destroyed_input.property('args_key')
+        try:
+            # Unless another input has since taken the args_key.
+            self._inputs_by_key[args_key].objectName()
+            return
+        except RuntimeError:
+            pass
+        except KeyError:
+            return
+        del self._inputs_by_key[args_key]
+        self._args.pop(args_key, None)
+        self._volatile_args_keys.discard(args_key)
+
+    def _update_arg(self, *args):
+        input_ = self.sender()
+        args_key = input_.args_key
+        old_value = self._args.get(args_key)
+        new_value = input_.value()
+        self._args[args_key] = new_value
+        if old_value != new_value:
+            self._args_changed()
+        if self._restoring_history or old_value == new_value:
+            return
+        self._record_change(args_key, old_value, new_value)
+
+    def _record_change(self, args_key, old_value, new_value):
+        if args_key in self._history_changes:
+            old_value = self._history_changes[args_key][0]
+        self._history_changes[args_key] = (old_value, new_value)
+        LAYOUT_SCHEDULER.call_later(_call_weakly, weakref.ref(self),
+                                    '_commit_history')
+
+    def _args_changed(self, *args):
+        if self._autosaver is not None:
+            self._autosaver.schedule()
+
+    def enable_autosave(self, recovery_path, delay=AUTOSAVE_DELAY_MS):
+        """Save the form's args to a recovery file as they change.
+
+        Call this once the form's inputs have been added.  If the recovery
+        file exists, a previous session ended without the form being closed,
+        and the user is asked whether to restore its args.  Writes happen in
+        a background thread, at most once per ``delay`` milliseconds of
+        inactivity, and are skipped if nothing changed.  The first write is
+        after the first change.  The recovery file is removed after a
+        successful run, and when the form is closed or destroyed or the
+        application quits.
+
+        Parameters:
+            recovery_path (string): The path of the recovery file.
+            delay=AUTOSAVE_DELAY_MS (int): Milliseconds to wait after the last
+                change before saving.
+
+        Returns:
+            ``True`` if args were restored from the recovery file, ``False``
+            otherwise.
+        """
+        restored = False
+        if os.path.exists(recovery_path):
+            answer = QtWidgets.QMessageBox.question(
+                self, 'Restore parameters?',
+                ('The parameters from a previous session were not saved. '
+                 'Restore them?'),
+                QtWidgets.QMessageBox.Yes | QtWidgets.QMessageBox.No)
+            if answer == QtWidgets.QMessageBox.Yes:
+                try:
+                    self.load_snapshot(recovery_path)
+                    restored = True
+                except (IOError, OSError, ValueError):
+                    LOGGER.exception('Could not restore args from %s',
+                                     recovery_path)
+
+        self._autosaver = snapshot.Autosaver(recovery_path,
+                                             self.assemble_args,
+                                             delay=delay, parent=self)
+        if not restored:
+            # The recovery file was declined, so don't offer it again.
+            self._autosaver.discard()
+
+        # A form embedded in a main window may never get a closeEvent.
+        QApplication.instance().aboutToQuit.connect(self._stop_autosave)
+        self.setProperty('recovery_path', recovery_path)
+        self.destroyed.connect(snapshot.stop_autosaving)
+        return restored
+
+    def _stop_autosave(self):
+        if self._autosaver is not None:
+            self._autosaver.stop(remove=True)
+            self._autosaver = None
+
+    def closeEvent(self, event):
+        self._stop_autosave()
+        QtWidgets.QWidget.closeEvent(self, event)
+
+    def _commit_history(self):
+        changes = dict((args_key, values) for (args_key, values)
+                       in self._history_changes.items()
+                       if values[0] != values[1])
+        self._history_changes = {}
+        if not changes:
+            return
+
+        now = _monotonic()
+        if self._undo_history:
+            last_time, last_changes = self._undo_history[-1]
+            # Consecutive edits of one input, such as typing, are merged.
+            if (len(changes) == 1 and list(changes) == list(last_changes) and
+                    now - last_time < HISTORY_MERGE_SECONDS and
+                    not self._redo_history):
+                args_key = list(changes)[0]
+                last_changes[args_key] = (last_changes[args_key][0],
+                                          changes[args_key][1])
+                self._undo_history[-1][0] = now
+                return
+
+        self._undo_history.append([now, changes])
+        if len(self._undo_history) > HISTORY_LENGTH:
+            del self._undo_history[0]
+        self._redo_history = []
+
+    def _set_values(self, values):
+        # Values are set with the inputs' signals blocked, so that nothing
+        # reacts to a partly set form.  Then each input signals its new value
+        # once, which validates it against the complete args.  Returns the
+        # (old value, new value) of each args_key whose value changed.
+        changes = {}
+        set_inputs = []
+        self.inputs._suspend_layout()
+        self.inputs.setUpdatesEnabled(False)
+        try:
+            for args_key, value in values.items():
+                input_ = self._inputs_by_key.get(args_key)
+                if input_ is None:
+                    LOGGER.debug('No input with args_key %s, skipping',
+                                 args_key)
+                    continue
+                old_value = input_.value()
+                input_._set_value_silently(value)
+                new_value = input_.value()
+                if args_key not in self._volatile_args_keys:
+                    self._args[args_key] = new_value
+                if old_value != new_value:
+                    changes[args_key] = (old_value, new_value)
+                set_inputs.append(input_)
+            for input_ in set_inputs:
+                input_._value_restored()
+        finally:
+            self.inputs.setUpdatesEnabled(True)
+        return changes
+
+    def _restore_history(self, changes, index):
+        # index 0 restores the old values, 1 the new values.
+        self._restoring_history = True
+        try:
+            self._set_values(dict((args_key, values[index])
+                                  for (args_key, values) in changes.items()))
+        finally:
+            self._restoring_history = False
+
+    def undo(self):
+        """Restore the args from before the most recent change.
+
+        Changes made within ``HISTORY_MERGE_SECONDS`` of each other to a
+        single input are undone together.
+
+        Returns:
+            ``True`` if there was a change to undo, ``False`` otherwise.
+        """
+        self._commit_history()
+        if not self._undo_history:
+            return False
+        entry = self._undo_history.pop()
+        self._restore_history(entry[1], 0)
+        self._redo_history.append(entry)
+        return True
+
+    def redo(self):
+        """Re-apply the most recently undone change.
+
+        Returns:
+            ``True`` if there was a change to redo, ``False`` otherwise.
+        """
+        self._commit_history()
+        if not self._redo_history:
+            return False
+        entry = self._redo_history.pop()
+        self._restore_history(entry[1], 1)
+        self._undo_history.append(entry)
+        return True
+
+    def assemble_args(self):
+        """Get the value of every input in the form with an args_key.
+
+        Returns:
+            A new dict mapping each args_key to its input's value.
+        """
+        args = dict(self._args)
+        for args_key in self._volatile_args_keys:
+            args[args_key] = self._inputs_by_key[args_key].value()
+        return args
+
+    @diagnostics.traced('slot')
+    def set_args(self, args):
+        """Set the values of many inputs at once.
+
+        The form's layout is suspended and nothing is repainted until every
+        value has been set.  The inputs only signal their new values, and
+        are validated, once all of them are set.  The new values are undone
+        together and autosaved once.
+
+        Parameters:
+            args (dict): Maps args_keys to values.  Keys without an input in
+                the form are skipped.
+
+        Returns:
+            ``None``
+        """
+        changes = self._set_values(args)
+        for args_key, (old_value, new_value) in changes.items():
+            self._record_change(args_key, old_value, new_value)
+        if changes:
+            self._args_changed()
+
+    def save_snapshot(self, snapshot_path):
+        """Save the form's args and fingerprints of their files.
+
+        Files that haven't been hashed yet are hashed in the background and
+        their hashes added to the snapshot when ready.  See
+        ``natcap.ui.snapshot``.
+
+        Parameters:
+            snapshot_path (string): Where to save the snapshot.
+
+        Returns:
+            The snapshot, as a dict.
+        """
+        return snapshot.save(snapshot_path, self.assemble_args(),
+                             hasher=self._file_hasher)
+
+    def load_snapshot(self, snapshot_path):
+        """Restore the form's args from a snapshot.
+
+        Parameters:
+            snapshot_path (string): The path to a snapshot saved with
+                ``save_snapshot``.
+
+        Returns:
+            A sorted list of the files referenced by the snapshot that were
+            changed or removed since it was saved.  If there are any, they
+            are also emitted with ``snapshot_files_changed``, so that they
+            can be shown to the user wherever the snapshot was loaded from.
+        """
+        args, changed_files = snapshot.load(snapshot_path)
+        self.set_args(args)
+        if changed_files:
+            LOGGER.warning('Files changed since snapshot %s was saved: %s',
+                           snapshot_path, changed_files)
+            self.snapshot_files_changed.emit(changed_files)
+        return changed_files
+
+    def _input(self, args_key):
+        try:
+            return self._inputs_by_key[args_key]
+        except KeyError:
+            raise ValueError('No input with args_key %s in this form' %
+                             args_key)
+
+    def add_rule(self, args_key, when, action='interactive'):
+        """Make an input's interactivity or visibility follow other inputs.
+
+        For example, to make ``x`` interactive only while ``y`` is sufficient
+        and ``z`` is ``'foo'``::
+
+            form.add_rule('x', {'y': inputs.SUFFICIENT, 'z': 'foo'})
+
+        Rules are compiled into a graph of the args_keys they depend on, so a
+        change to one input only re-evaluates the rules that depend on it.
+        Changed rules are evaluated once per event loop turn and their
+        results applied in one batch.  When several rules control the same
+        input and action, all of them must hold.  The inputs must already be
+        in the form.
+
+        Parameters:
+            args_key (string): The args_key of the input to control.
+            when (dict): Maps the args_key of each input the rule depends on
+                to a condition.  A condition is ``SUFFICIENT``, a callable
+                that takes the input's value and returns a bool, or a value
+                that the input's value must equal.  All conditions must hold.
+            action='interactive' (string): Either ``'interactive'`` or
+                ``'visible'``.
+
+        Returns:
+            ``None``
+
+        Raises:
+            ValueError: When ``action`` is unknown or an args_key is not in
+                the form.
+        """
+        if action not in ('interactive', 'visible'):
+            raise ValueError('Unknown rule action %s' % action)
+        target = self._input(args_key)
+        conditions = [(self._input(source_key), condition)
+                      for (source_key, condition) in when.items()]
+
+        rule_key = (args_key, action)
+        self._rules.setdefault(rule_key, (target, []))[1].append(conditions)
+        for source, _ in conditions:
+            if source.args_key not in self._rule_dependents:
+                self._rule_dependents[source.args_key] = set()
+                source.value_changed.connect(self._rule_source_changed)
+                source.sufficiency_changed.connect(self._rule_source_changed)
+            self._rule_dependents[source.args_key].add(rule_key)
+        self._apply_rules([rule_key])
+
+    def _rule_source_changed(self, *args):
+        self._changed_rule_sources.add(self.sender().args_key)
+        LAYOUT_SCHEDULER.call_later(_call_weakly, weakref.ref(self),
+                                    '_apply_changed_rules')
+
+    def _apply_changed_rules(self):
+        changed_sources = self._changed_rule_sources
+        self._changed_rule_sources = set()
+        rule_keys = set()
+        for args_key in changed_sources:
+            rule_keys.update(self._rule_dependents[args_key])
+        self._apply_rules(rule_keys)
+
+    @diagnostics.traced('slot')
+    def _apply_rules(self, rule_keys):
+        results = []
+        for rule_key in rule_keys:
+            target, rules = self._rules[rule_key]
+            holds = all(_rule_condition_holds(input_, condition)
+                        for conditions in rules
+                        for (input_, condition) in conditions)
+            results.append((target, rule_key[1], holds))
+
+        self.inputs.setUpdatesEnabled(False)
+        try:
+            for target, action, holds in results:
+                if action == 'interactive':
+                    if target.interactive != holds:
+                        target.set_interactive(holds)
+                elif target.visible() != holds:
+                    target.set_visible(holds)
+        finally:
+            self.inputs.setUpdatesEnabled(True)
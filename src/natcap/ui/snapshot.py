@@ -0,0 +1,451 @@
+"""Save and load snapshots of a form's args.
+
+A snapshot is a JSON file holding a set of args and a fingerprint of every
+file the args refer to::
+
+    {"version": 1,
+     "args": {"workspace_dir": "/tmp/ws", "lulc_path": "/data/lulc.tif"},
+     "files": {"/data/lulc.tif": {"size": 1048576,
+                                  "mtime": 1500000000.0,
+                                  "sha256": "9f86d08..."}}}
+
+Sizes and modification times are cheap to compare, so loading a snapshot can
+report changed files right away.  Content hashes are computed in background
+threads, cached, and added to the snapshot once they are ready.
+"""
+import os
+import json
+import hashlib
+import time
+import logging
+import threading
+import collections
+import weakref
+
+import six
+from qtpy import QtCore
+
+
+LOGGER = logging.getLogger(__name__)
+FORMAT_VERSION = 1
+_HASH_BLOCKSIZE = 2**20  # read files 1MB at a time
+
+# sha256 hex digests, keyed by (path, size, mtime) so that a changed file is
+# hashed again.
+_HASH_CACHE = {}
+_HASH_CACHE_LOCK = threading.Lock()
+
+# Running autosavers, keyed by recovery path.
+_AUTOSAVERS = weakref.WeakValueDictionary()
+
+# Python 2 has no os.replace, but os.rename replaces files on posix there.
+_replace = getattr(os, 'replace', os.rename)
+
+
+def fingerprint(path):
+    """Get the size and modification time of a file.
+
+    Parameters:
+        path (string): The path to a file.
+
+    Returns:
+        A dict with ``size`` and ``mtime`` keys, or ``None`` if the file
+        does not exist.
+    """
+    try:
+        stat_result = os.stat(path)
+    except OSError:
+        return None
+    return {'size': stat_result.st_size, 'mtime': stat_result.st_mtime}
+
+
+def _hash_cache_key(path, file_fingerprint):
+    return (os.path.abspath(path), file_fingerprint['size'],
+            file_fingerprint['mtime'])
+
+
+def cached_hash(path, file_fingerprint=None):
+    """Get the cached sha256 of a file, if it has been hashed.
+
+    Parameters:
+        path (string): The path to a file.
+        file_fingerprint=None (dict): The file's fingerprint, if already
+            known.
+
+    Returns:
+        The hex digest, or ``None`` if the file has not been hashed since it
+        last changed.
+    """
+    if file_fingerprint is None:
+        file_fingerprint = fingerprint(path)
+        if file_fingerprint is None:
+            return None
+    with _HASH_CACHE_LOCK:
+        return _HASH_CACHE.get(_hash_cache_key(path, file_fingerprint))
+
+
+def hash_file(path):
+    """Compute the sha256 of a file, reading it one block at a time.
+
+    The result is cached.
+
+    Parameters:
+        path (string): The path to a file.
+
+    Returns:
+        The hex digest.
+    """
+    file_fingerprint = fingerprint(path)
+    digest = cached_hash(path, file_fingerprint)
+    if digest is not None:
+        return digest
+
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as file_obj:
+        for block in iter(lambda: file_obj.read(_HASH_BLOCKSIZE), b''):
+            sha256.update(block)
+    digest = sha256.hexdigest()
+
+    # Only cache the digest if the file didn't change while it was read.
+    if fingerprint(path) == file_fingerprint:
+        with _HASH_CACHE_LOCK:
+            _HASH_CACHE[_hash_cache_key(path, file_fingerprint)] = digest
+    return digest
+
+
+class FileHasher(QtCore.QObject):
+    """Hash files in background threads.
+
+    Requests are queued for at most ``max_threads`` worker threads, which
+    are started as needed and kept for later requests.  A path that is
+    already queued or being hashed isn't queued again.  ``hashed`` is
+    emitted in the thread that owns the hasher with each path and its
+    digest, or ``None`` if the file could not be read.
+    """
+
+    hashed = QtCore.Signal(object, object)
+
+    def __init__(self, parent=None, max_threads=2):
+        QtCore.QObject.__init__(self, parent)
+        self.max_threads = max_threads
+        self._pending = set()  # Queued or being hashed.
+        self._queue = collections.deque()
+        self._n_hashing = 0
+        self._condition = threading.Condition()
+        self._threads = []
+
+        # filesystem imports this module, so it can't be imported above.
+        from . import filesystem
+        self._relay_hashed = filesystem.ThreadRelay(self, '_finished_hashing')
+
+    def request(self, path):
+        """Start hashing ``path`` in the background if it isn't cached.
+
+        Returns:
+            The cached digest if there is one, otherwise ``None``.
+        """
+        digest = cached_hash(path)
+        if digest is not None or path in self._pending:
+            return digest
+        self._pending.add(path)
+        with self._condition:
+            self._queue.append(path)
+            self._condition.notify()
+            if len(self._threads) < min(self.max_threads,
+                                        len(self._queue) + self._n_hashing):
+                thread = threading.Thread(target=self._work)
+                thread.daemon = True
+                self._threads.append(thread)
+                thread.start()
+        return None
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._queue:
+                    self._condition.wait()
+                path = self._queue.popleft()
+                self._n_hashing += 1
+            try:
+                digest = hash_file(path)
+            except (IOError, OSError):
+                LOGGER.exception('Could not hash %s', path)
+                digest = None
+            self._relay_hashed(path, digest)
+            with self._condition:
+                self._n_hashing -= 1
+                self._condition.notify_all()
+
+    def _finished_hashing(self, path, digest):
+        self._pending.discard(path)
+        self.hashed.emit(path, digest)
+
+    def pending(self):
+        """Get the paths still being hashed."""
+        return set(self._pending)
+
+    def join(self, timeout=None):
+        """Wait for every file requested so far to be hashed.
+
+        Returns:
+            ``True`` if every file was hashed, ``False`` on timeout.
+        """
+        with self._condition:
+            if timeout is None:
+                while self._queue or self._n_hashing:
+                    self._condition.wait()
+                return True
+            deadline = time.time() + timeout
+            while self._queue or self._n_hashing:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+            return True
+
+
+def _referenced_files(args):
+    # Every string in args (or in a list in args) that names an existing
+    # file.
+    for value in args.values():
+        if isinstance(value, (list, tuple)):
+            values = value
+        else:
+            values = [value]
+        for path in values:
+            if isinstance(path, six.string_types) and os.path.isfile(path):
+                yield path
+
+
+def _serialize(snapshot):
+    return json.dumps(snapshot, indent=4, sort_keys=True)
+
+
+def _write(snapshot_path, snapshot_text):
+    # Write to a temporary file and rename it, so that a snapshot is never
+    # left half-written.
+    temporary_path = snapshot_path + '.tmp'
+    with open(temporary_path, 'w') as snapshot_file:
+        snapshot_file.write(snapshot_text)
+    _replace(temporary_path, snapshot_path)
+
+
+def _make_snapshot(args):
+    files = {}
+    for path in _referenced_files(args):
+        file_fingerprint = fingerprint(path)
+        file_fingerprint['sha256'] = cached_hash(path, file_fingerprint)
+        files[path] = file_fingerprint
+    return {'version': FORMAT_VERSION, 'args': args, 'files': files}
+
+
+def save(snapshot_path, args, hasher=None):
+    """Save a snapshot of args and the files they refer to.
+
+    Files are fingerprinted by size and modification time.  Hashes that are
+    already cached are saved too.  If ``hasher`` is provided, the other files
+    are hashed in the background and the snapshot is saved again with their
+    hashes once they are all ready, unless the snapshot or the files have
+    changed in the meantime.
+
+    Parameters:
+        snapshot_path (string): Where to save the snapshot.
+        args (dict): The args to save.  Values must be JSON-serializable.
+        hasher=None (FileHasher): Used to hash files in the background.
+
+    Returns:
+        The snapshot, as a dict.
+    """
+    snapshot = _make_snapshot(args)
+    files = snapshot['files']
+    _write(snapshot_path, _serialize(snapshot))
+
+    unhashed = set(path for (path, file_fingerprint) in files.items()
+                   if file_fingerprint['sha256'] is None)
+    if hasher is None or not unhashed:
+        return snapshot
+
+    saved_fingerprint = fingerprint(snapshot_path)
+
+    def _hashed(path, digest):
+        if path not in unhashed:
+            return
+        unhashed.discard(path)
+        current_fingerprint = fingerprint(path)
+        if digest is not None and current_fingerprint is not None and (
+                current_fingerprint['size'] == files[path]['size'] and
+                current_fingerprint['mtime'] == files[path]['mtime']):
+            files[path]['sha256'] = digest
+        if unhashed:
+            return
+        hasher.hashed.disconnect(_hashed)
+        if fingerprint(snapshot_path) != saved_fingerprint:
+            LOGGER.info('Snapshot %s changed, not adding file hashes',
+                        snapshot_path)
+            return
+        LOGGER.debug('Adding file hashes to snapshot %s', snapshot_path)
+        _write(snapshot_path, _serialize(snapshot))
+
+    hasher.hashed.connect(_hashed)
+    for path in sorted(unhashed):
+        digest = hasher.request(path)
+        if digest is not None:
+            _hashed(path, digest)
+    return snapshot
+
+
+def load(snapshot_path):
+    """Load a snapshot and find which of its files have changed.
+
+    A file has changed if it no longer exists or if its size or
+    modification time differ from the snapshot.  No file is read.
+
+    Parameters:
+        snapshot_path (string): The path to a snapshot saved by ``save``.
+
+    Returns:
+        A tuple of the args dict and a sorted list of changed file paths.
+
+    Raises:
+        ValueError: When the snapshot's format version is not supported.
+    """
+    with open(snapshot_path) as snapshot_file:
+        snapshot = json.load(snapshot_file)
+    if snapshot.get('version') != FORMAT_VERSION:
+        raise ValueError('Unsupported snapshot version %s in %s' % (
+            snapshot.get('version'), snapshot_path))
+
+    changed_files = []
+    for path, saved_fingerprint in snapshot['files'].items():
+        current_fingerprint = fingerprint(path)
+        if (current_fingerprint is None or
+                current_fingerprint['size'] != saved_fingerprint['size'] or
+                current_fingerprint['mtime'] != saved_fingerprint['mtime']):
+            changed_files.append(path)
+    return snapshot['args'], sorted(changed_files)
+
+
+class Autosaver(QtCore.QObject):
+    """Save snapshots to a recovery file in a background thread.
+
+    Call ``schedule`` whenever the args change.  The snapshot is saved
+    ``delay`` milliseconds after the last call, so a burst of changes is
+    saved once.  Args are only read in the thread that owns the autosaver;
+    fingerprinting, serializing and writing happen in a background thread.
+    A snapshot identical to the last one written is not written again.
+    Nothing here waits for the background thread: if the recovery file is
+    removed while it is being written, the thread removes it once written.
+    """
+
+    def __init__(self, recovery_path, get_args, delay=2000, parent=None):
+        QtCore.QObject.__init__(self, parent)
+        self.recovery_path = recovery_path
+        self._get_args = get_args
+        self._last_digest = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._writing = False
+        self._remove_when_written = False
+        self._stopped = False
+        self._timer = QtCore.QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(delay)
+        self._timer.timeout.connect(self.save)
+        _AUTOSAVERS[recovery_path] = self
+
+    def schedule(self):
+        """Save a snapshot once no changes have been made for ``delay``."""
+        if not self._stopped:
+            self._timer.start()
+
+    def save(self):
+        """Start saving a snapshot of the current args now."""
+        self._timer.stop()
+        if self._stopped:
+            return
+        if self._thread is not None and self._thread.is_alive():
+            # Only one write at a time; try again after the delay.
+            self._timer.start()
+            return
+        self._thread = threading.Thread(target=self._write,
+                                        args=(self._get_args(),))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _write(self, args):
+        try:
+            snapshot_text = _serialize(_make_snapshot(args))
+            digest = hashlib.sha256(snapshot_text.encode('utf-8')).hexdigest()
+            with self._lock:
+                if self._stopped or digest == self._last_digest:
+                    return
+                self._writing = True
+            try:
+                _write(self.recovery_path, snapshot_text)
+            finally:
+                with self._lock:
+                    self._writing = False
+                    if self._remove_when_written:
+                        self._remove_when_written = False
+                        self._remove_file()
+                    else:
+                        self._last_digest = digest
+            LOGGER.debug('Autosaved args to %s', self.recovery_path)
+        except Exception:
+            # Autosave must never take down the GUI.
+            LOGGER.exception('Could not autosave to %s', self.recovery_path)
+
+    def _remove_file(self):
+        try:
+            if os.path.exists(self.recovery_path):
+                os.remove(self.recovery_path)
+        except OSError:
+            LOGGER.exception('Could not remove %s', self.recovery_path)
+
+    def join(self, timeout=None):
+        """Wait for a save in progress to finish."""
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def discard(self):
+        """Remove the recovery file, such as once the args have been run.
+
+        Autosaving continues; the next change is saved again.
+        """
+        self._timer.stop()
+        with self._lock:
+            self._last_digest = None
+            if self._writing:
+                self._remove_when_written = True
+            else:
+                self._remove_file()
+
+    def stop(self, remove=True):
+        """Stop autosaving, optionally removing the recovery file."""
+        self._timer.stop()
+        with self._lock:
+            self._stopped = True
+        if remove:
+            self.discard()
+
+
+def stop_autosaving(owner):
+    """Stop autosaving to the file named by a QObject's ``recovery_path``.
+
+    Connect an object's ``destroyed`` signal to this so that its recovery
+    file is removed with it.  ``destroyed`` only carries a plain QObject, so
+    the path is kept as a property rather than an attribute.
+    """
+    recovery_path = owner.property('recovery_path')
+    if not recovery_path:
+        return
+    autosaver = _AUTOSAVERS.get(recovery_path)
+    if autosaver is not None:
+        autosaver.stop(remove=True)
+    elif os.path.exists(recovery_path):
+        # The autosaver was collected along with its owner, so no write is
+        # in progress.
+        try:
+            os.remove(recovery_path)
+        except OSError:
+            LOGGER.exception('Could not remove %s', recovery_path)
@@ -1,5 +1,6 @@
 
 import unittest
+import gc
 import functools
 import warnings
 import threading
@@ -9,6 +10,13 @@ import shutil
 import os
 import contextlib
 import sys
+import time
+import json
+import hashlib
+import mmap
+import struct
+import weakref
+import collections
 
 import sip
 sip.setapi('QString', 2)  # qtpy assumes api version 2
@@ -49,6 +57,13 @@ def wait_on_signal(signal, timeout=250):
     signal.disconnect(loop.quit)
 
 
+def wait_until(condition, timeout=2000):
+    """Process events until condition() is true, or timeout (ms) elapses."""
+    deadline = time.time() + timeout / 1000.0
+    while not condition() and time.time() < deadline:
+        QTest.qWait(20)
+
+
 class InputTest(unittest.TestCase):
     @staticmethod
     def create_input(*args, **kwargs):
@@ -470,6 +485,175 @@ class PathTest(TextTest):
             input_instance.path_select_button.path_selected.emit(u'/tmp/foo')
             self.assertTrue(input_instance.value(), '/tmp/foo')
 
+    def test_completion(self):
+        input_instance = self.__class__.create_input(label='foo')
+        tempdir = tempfile.mkdtemp()
+        try:
+            os.mkdir(os.path.join(tempdir, 'alps'))
+            for filename in ('alpha.txt', 'beta.txt', '.alpha'):
+                open(os.path.join(tempdir, filename), 'w').close()
+
+            text = os.path.join(tempdir, 'al')
+            input_instance.textfield.setText(text)
+            input_instance.textfield.textEdited.emit(text)
+            completions = input_instance.completer.model()
+            wait_until(completions.stringList)
+        finally:
+            shutil.rmtree(tempdir)
+
+        if input_instance._directories_only:
+            expected = ['alps']
+        else:
+            expected = ['alpha.txt', 'alps']
+        self.assertEqual(completions.stringList(),
+                         [os.path.join(tempdir, name) for name in expected])
+
+    def test_drop(self):
+        input_instance = self.__class__.create_input(label='foo')
+        mime_data = QtCore.QMimeData()
+        mime_data.setUrls([QtCore.QUrl.fromLocalFile('/tmp/a.tif')])
+        event = mock.MagicMock()
+        event.mimeData.return_value = mime_data
+
+        with mock.patch('natcap.ui.filesystem._SYSTEM', 'Linux'):
+            input_instance.textfield.dropEvent(event)
+
+        event.accept.assert_called_once_with()
+        self.assertEqual(input_instance.value(), '/tmp/a.tif')
+
+    def test_drop_resolved_in_background(self):
+        from natcap.ui import filesystem
+        input_instance = self.__class__.create_input(label='foo')
+        mime_data = QtCore.QMimeData()
+        mime_data.setUrls([QtCore.QUrl('file:///.file/id=6571367.2773272')])
+        event = mock.MagicMock()
+        event.mimeData.return_value = mime_data
+        resolved = threading.Event()
+
+        def _ask_osascript(url_path):
+            resolved.wait()
+            return '/Users/foo/a.tif'
+
+        with mock.patch('natcap.ui.filesystem._SYSTEM', 'Darwin'), \
+                mock.patch('natcap.ui.filesystem._NEEDS_OSASCRIPT', True), \
+                mock.patch('natcap.ui.filesystem._ask_osascript',
+                           side_effect=_ask_osascript) as ask_osascript:
+            input_instance.textfield.dropEvent(event)
+            # The raw path is shown until the OS answers.
+            self.assertEqual(input_instance.value(),
+                             '/.file/id=6571367.2773272')
+            resolved.set()
+            wait_until(lambda: input_instance.value() == '/Users/foo/a.tif')
+            self.assertEqual(input_instance.value(), '/Users/foo/a.tif')
+
+            # Dropping the same file again uses the cached result.
+            input_instance.set_value('')
+            input_instance.textfield.dropEvent(event)
+            self.assertEqual(input_instance.value(), '/Users/foo/a.tif')
+            self.assertEqual(ask_osascript.call_count, 1)
+        filesystem.DROP_RESOLVER._cache.clear()
+
+    def test_metadata_tooltip(self):
+        input_instance = self.__class__.create_input(label='foo')
+        tempdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tempdir, 'data.csv')
+            with open(path, 'w') as data_file:
+                data_file.write('a,b\n1,2\n')
+            input_instance.set_value(path)
+            wait_until(input_instance.textfield.toolTip)
+            self.assertEqual(input_instance.textfield.toolTip(),
+                             'CSV, 8 bytes\n2 columns: a, b\n1 rows')
+        finally:
+            input_instance.set_value('')
+            shutil.rmtree(tempdir)
+
+    def test_watch_after_typing(self):
+        from natcap.ui import filesystem
+        input_instance = self.__class__.create_input(label='foo')
+        with mock.patch.object(filesystem.PATH_WATCHER, 'watch') as watch:
+            for text in ('/', '/t', '/tm', '/tmp'):
+                QTest.keyClicks(input_instance.textfield, text[-1])
+            watch.assert_not_called()
+            QTest.qWait(input_instance.WATCH_DELAY_MS + 50)
+        watch.assert_called_once_with('/tmp')
+        input_instance.set_value('')
+
+    def test_revalidate_on_change(self):
+        _validator = mock.MagicMock(return_value=[])
+        input_instance = self.__class__.create_input(
+            label='foo', args_key='path', validator=_validator)
+        tempdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tempdir, 'data.csv')
+            input_instance.set_value(path)
+            self.assertEqual(_validator.call_count, 1)
+            # The path is watched once editing pauses.
+            QTest.qWait(input_instance.WATCH_DELAY_MS + 50)
+            self.assertEqual(input_instance._watched_path, path)
+
+            # The file doesn't exist yet, so its creation is noticed through
+            # its directory.
+            with open(path, 'w') as data_file:
+                data_file.write('a,b\n')
+            wait_until(lambda: _validator.call_count > 1)
+            self.assertEqual(_validator.call_count, 2)
+
+            with open(path, 'a') as data_file:
+                data_file.write('1,2\n')
+            wait_until(lambda: _validator.call_count > 2)
+            self.assertEqual(_validator.call_count, 3)
+        finally:
+            input_instance.set_value('')
+            shutil.rmtree(tempdir)
+
+    def test_detach_releases_watch(self):
+        from natcap.ui import filesystem
+        _validator = mock.MagicMock(return_value=[])
+        input_instance = self.__class__.create_input(
+            label='foo', args_key='path', validator=_validator)
+        input_instance.set_value('/tmp/detached.csv')
+        QTest.qWait(input_instance.WATCH_DELAY_MS + 50)
+        self.assertIn('/tmp/detached.csv',
+                      filesystem.PATH_WATCHER.watched_paths())
+
+        input_instance.detach()
+        self.assertNotIn('/tmp/detached.csv',
+                         filesystem.PATH_WATCHER.watched_paths())
+
+        # A change reported for the path is ignored, and the input is
+        # deleted once control returns to the event loop.
+        filesystem.PATH_WATCHER.paths_changed.emit(set(['/tmp/detached.csv']))
+        self.assertEqual(_validator.call_count, 1)
+        destroyed = mock.MagicMock()
+        input_instance.destroyed.connect(destroyed)
+        QT_APP.sendPostedEvents(None, QtCore.QEvent.DeferredDelete)
+        self.assertTrue(destroyed.called)
+
+    def test_destroyed_releases_watch(self):
+        from natcap.ui import filesystem
+        input_instance = self.__class__.create_input(label='foo')
+        input_instance.set_value('/tmp/destroyed.csv')
+        QTest.qWait(input_instance.WATCH_DELAY_MS + 50)
+        self.assertIn('/tmp/destroyed.csv',
+                      filesystem.PATH_WATCHER.watched_paths())
+
+        input_instance.deleteLater()
+        QT_APP.sendPostedEvents(None, QtCore.QEvent.DeferredDelete)
+        self.assertNotIn('/tmp/destroyed.csv',
+                         filesystem.PATH_WATCHER.watched_paths())
+
+    def test_no_validation_once_widgets_deleted(self):
+        _validator = mock.MagicMock(return_value=[])
+        input_instance = self.__class__.create_input(
+            label='foo', args_key='path', validator=_validator)
+        input_instance.valid_button.deleteLater()
+        QT_APP.sendPostedEvents(None, QtCore.QEvent.DeferredDelete)
+
+        input_instance.set_value('/tmp/foo.csv')
+        self.assertEqual(_validator.call_count, 0)
+        self.assertFalse(input_instance.lock.locked())
+
 
 class FolderTest(PathTest):
     @staticmethod
@@ -623,6 +807,113 @@ class DropdownTest(GriddedInputTest):
 
         callback.assert_called_with('bar')
 
+    def test_set_value_missing(self):
+        input_instance = self.__class__.create_input(
+            label='label', options=('foo', 'bar', 'baz'))
+        with self.assertRaises(ValueError):
+            input_instance.set_value('qux')
+
+    def test_set_options_duplicates(self):
+        input_instance = self.__class__.create_input(
+            label='label', options=('foo', 'bar', 'foo'))
+        input_instance.set_value('bar')
+        input_instance.set_value('foo')
+        self.assertEqual(input_instance.dropdown.currentIndex(), 0)
+
+    def test_set_options_empty(self):
+        input_instance = self.__class__.create_input(
+            label='label', options=('foo', 'bar', 'baz'))
+        input_instance.set_options([])
+        self.assertEqual(input_instance.options, [])
+        self.assertEqual(input_instance.value(), u'')
+
+    def test_search(self):
+        input_instance = self.__class__.create_input(
+            label='label', options=('Grassland', 'forest', 'tiger', 'grove'))
+        model = input_instance._model
+        self.assertEqual(model.search('gr'), [0, 3, 2])
+        self.assertEqual(model.search('gro'), [3])
+        self.assertEqual(model.search('gr', limit=1), [0])
+
+    def test_filterable(self):
+        input_instance = self.__class__.create_input(
+            label='label', options=('foo', 'bar', 'baz'), filterable=True)
+        input_instance._filter_options('ba')
+        self.assertEqual(input_instance._filter_results.stringList(),
+                         [u'bar', u'baz'])
+
+    def test_load_options_csv(self):
+        from natcap.ui import inputs
+        tempdir = tempfile.mkdtemp()
+        try:
+            csv_path = os.path.join(tempdir, 'table.csv')
+            with open(csv_path, 'w') as csv_file:
+                csv_file.write('lucode,name\n1,forest\n2,grass\n1,forest\n')
+
+            input_instance = self.__class__.create_input(label='label')
+            input_instance.load_options(csv_path, inputs.csv_column_options,
+                                        'name')
+            input_instance.set_value('grass')  # before the options arrive
+            self.assertTrue(input_instance.loading)
+            with wait_on_signal(input_instance.loading_changed,
+                                timeout=2000):
+                pass
+
+            self.assertFalse(input_instance.loading)
+            self.assertEqual(input_instance.options, [u'forest', u'grass'])
+            self.assertEqual(input_instance.value(), u'grass')
+
+            # Loading the unchanged file again comes from the cache.
+            with mock.patch('natcap.ui.inputs._OptionsLoader') as loader:
+                input_instance.load_options(
+                    csv_path, inputs.csv_column_options, 'name')
+            loader.assert_not_called()
+            self.assertEqual(input_instance.options, [u'forest', u'grass'])
+        finally:
+            shutil.rmtree(tempdir)
+
+    def test_set_options_source(self):
+        from natcap.ui import inputs
+        first_input = inputs.Text(label='first')
+        second_input = inputs.Text(label='second')
+        input_instance = self.__class__.create_input(label='label')
+        input_instance.set_options_source(first_input,
+                                          inputs.csv_column_options, 'name')
+        input_instance.set_options_source(second_input,
+                                          inputs.csv_column_options, 'code')
+
+        with mock.patch.object(input_instance, 'load_options') as load:
+            first_input.set_value('first.csv')
+            load.assert_not_called()
+            second_input.set_value('second.csv')
+            load.assert_called_once_with(
+                'second.csv', inputs.csv_column_options, 'code')
+
+            input_instance.set_options_source(second_input, None)
+            second_input.set_value('other.csv')
+            self.assertEqual(load.call_count, 1)
+
+    def test_load_options_cancelled(self):
+        from natcap.ui import inputs
+        loaded = threading.Event()
+
+        def _provider(path):
+            yield 'foo'
+            loaded.wait(5)
+            yield 'bar'
+
+        input_instance = self.__class__.create_input(label='label')
+        input_instance.load_options(__file__, _provider)
+        loader = input_instance._options_loader
+        input_instance.load_options('/does/not/exist', _provider)
+        loaded.set()
+        loader.join()
+        QT_APP.processEvents()
+
+        self.assertTrue(loader.cancelled)
+        self.assertFalse(input_instance.loading)
+        self.assertEqual(input_instance.options, [])
+
     def test_label(self):
         # Override, sinve 'Optional' is irrelevant for Dropdown.
         pass
@@ -737,6 +1028,77 @@ class ContainerTest(InputTest):
         with self.assertRaises(ValueError):
             input_instance.set_value(False)
 
+    def test_collapse_hides_widgets(self):
+        from natcap.ui.inputs import Text
+        container = self.__class__.create_input(label='foo',
+                                                expandable=True,
+                                                expanded=True)
+        text = Text(label='text')
+        container.add_input(text)
+        container.show()
+        QT_APP.processEvents()
+        self.assertTrue(text.textfield.isVisible())
+
+        container.expanded = False
+        self.assertFalse(text.textfield.isVisible())
+        self.assertFalse(text.label_widget.isVisible())
+
+        container.expanded = True
+        self.assertTrue(text.textfield.isVisible())
+
+    def test_collapsed_when_shown(self):
+        from natcap.ui.inputs import Text
+        container = self.__class__.create_input(label='foo',
+                                                expandable=True,
+                                                expanded=True)
+        text = Text(label='text')
+        container.add_input(text)
+        container.expanded = False
+        container.show()
+        QT_APP.processEvents()
+        self.assertFalse(text.textfield.isVisible())
+
+    def test_one_window(self):
+        # The input's widget is its only window, so nothing is left behind
+        # for Qt to find once the input is gone.
+        from natcap.ui.inputs import LAYOUT_SCHEDULER
+        LAYOUT_SCHEDULER.flush()
+        gc.collect()
+        n_windows = len(QT_APP.topLevelWidgets())
+        input_instance = self.__class__.create_input(label='foo')
+        self.assertEqual(len(QT_APP.topLevelWidgets()), n_windows + 1)
+
+        del input_instance
+        LAYOUT_SCHEDULER.flush()
+        gc.collect()
+        self.assertEqual(len(QT_APP.topLevelWidgets()), n_windows)
+
+    def test_sufficiency_nested(self):
+        from natcap.ui.inputs import Container, Text
+        outer = Container(label='outer', expandable=True, expanded=True)
+        inner = Container(label='inner', expandable=True, expanded=True)
+        text = Text(label='text')
+        outer.add_input(inner)
+        inner.add_input(text)
+        outer.show()
+        QT_APP.processEvents()
+        self.assertTrue(inner.sufficient)
+
+        callback = mock.MagicMock()
+        text.interactivity_changed.connect(callback)
+        outer.expanded = False
+        self.assertFalse(inner.interactive)
+        self.assertFalse(inner.sufficient)
+        self.assertFalse(text.interactive)
+        self.assertFalse(text.visible())
+        self.assertFalse(text.textfield.isEnabled())
+        callback.assert_called_once_with(False)
+
+        outer.expanded = True
+        self.assertTrue(inner.sufficient)
+        self.assertTrue(text.interactive)
+        self.assertTrue(text.textfield.isEnabled())
+
     def test_helptext(self):
         pass
 
@@ -768,6 +1130,14 @@ class MultiTest(ContainerTest):
                 label='foo',
                 callable_=None)
 
+    def test_collapse_hides_widgets(self):
+        # Override, since a Multi is never expandable.
+        pass
+
+    def test_collapsed_when_shown(self):
+        # Override, since a Multi is never expandable.
+        pass
+
     def test_value_changed_signal_emitted(self):
         input_instance = self.__class__.create_input(
             label='foo',
@@ -827,6 +1197,140 @@ class MultiTest(ContainerTest):
 
         self.assertEqual(input_instance.value(), ['aaa', 'ccc'])
 
+    def test_remove_button_after_remove(self):
+        input_instance = self.__class__.create_input(
+            label='foo',
+            callable_=self.__class__.create_sample_callable(label='foo'))
+        input_instance.set_value(['aaa', 'bbb', 'ccc'])
+        ccc_button = input_instance.remove_buttons[2]
+
+        input_instance.remove(0)
+        self.assertEqual(input_instance.value(), ['bbb', 'ccc'])
+
+        # The button still removes the item it was created for.
+        QTest.mouseClick(ccc_button, QtCore.Qt.LeftButton)
+        self.assertEqual(input_instance.value(), ['bbb'])
+
+    def test_remove_leaves_other_rows(self):
+        input_instance = self.__class__.create_input(
+            label='foo',
+            callable_=self.__class__.create_sample_callable(label='foo'))
+        input_instance.set_value(['aaa', 'bbb', 'ccc'])
+        layout = input_instance.layout()
+        positions = [layout.getItemPosition(layout.indexOf(item.textfield))
+                     for item in input_instance.items]
+
+        input_instance.remove(1)
+
+        for item, position in zip(input_instance.items,
+                                  [positions[0], positions[2]]):
+            self.assertEqual(item.textfield.parent(), input_instance)
+            self.assertEqual(
+                layout.getItemPosition(layout.indexOf(item.textfield)),
+                position)
+
+    def test_rows_reclaimed(self):
+        input_instance = self.__class__.create_input(
+            label='foo',
+            callable_=self.__class__.create_sample_callable(label='foo'))
+        values = ['value_%s' % index for index in range(50)]
+        input_instance.add_values(values)
+        layout = input_instance.layout()
+        row_count = layout.rowCount()
+
+        for _ in range(3):
+            for _ in values:
+                input_instance.remove(0)
+            input_instance.add_values(values)
+            self.assertEqual(layout.rowCount(), row_count)
+
+        # Items stay in order as the remaining rows are moved up.
+        for index in range(0, 40, 2):
+            input_instance.remove(index // 2)
+        rows = [layout.getItemPosition(layout.indexOf(item.textfield))[0]
+                for item in input_instance.items]
+        self.assertEqual(rows, sorted(rows))
+        self.assertEqual(input_instance.value(),
+                         values[1:40:2] + values[40:])
+
+    def test_removed_item_torn_down(self):
+        from natcap.ui import filesystem
+        from natcap.ui.inputs import File
+        input_instance = self.__class__.create_input(
+            label='foo', callable_=functools.partial(File, label='foo'))
+        input_instance.set_value(['/tmp/multi_item.csv'])
+        item = input_instance.items[0]
+        QTest.qWait(item.WATCH_DELAY_MS + 50)
+        self.assertIn('/tmp/multi_item.csv',
+                      filesystem.PATH_WATCHER.watched_paths())
+        destroyed = mock.MagicMock()
+        item.destroyed.connect(destroyed)
+
+        input_instance.remove(0)
+        QT_APP.sendPostedEvents(None, QtCore.QEvent.DeferredDelete)
+
+        self.assertNotIn('/tmp/multi_item.csv',
+                         filesystem.PATH_WATCHER.watched_paths())
+        self.assertTrue(destroyed.called)
+        # A change on disk no longer reaches the removed item.
+        filesystem.PATH_WATCHER.paths_changed.emit(
+            set(['/tmp/multi_item.csv']))
+
+    def test_add_values(self):
+        input_instance = self.__class__.create_input(
+            label='foo',
+            callable_=self.__class__.create_sample_callable(label='foo'))
+        input_instance.set_value(['aaa'])
+        callback = mock.MagicMock()
+        input_instance.value_changed.connect(callback)
+
+        input_instance.add_values(['bbb', 'ccc'])
+
+        self.assertEqual(input_instance.value(), ['aaa', 'bbb', 'ccc'])
+        callback.assert_called_once_with(['aaa', 'bbb', 'ccc'])
+
+    def test_add_values_validated_after_batch(self):
+        from natcap.ui.inputs import LAYOUT_SCHEDULER
+        _validator = mock.MagicMock(return_value=[])
+        input_instance = self.__class__.create_input(
+            label='foo',
+            callable_=self.__class__.create_sample_callable(
+                label='foo', args_key='foo', validator=_validator))
+
+        input_instance.add_values(['aaa', 'bbb'])
+        _validator.assert_not_called()
+        self.assertEqual([item.sufficient for item in input_instance.items],
+                         [False, False])
+
+        LAYOUT_SCHEDULER.flush()
+        self.assertEqual([item.sufficient for item in input_instance.items],
+                         [True, True])
+
+    def test_drop_urls(self):
+        input_instance = self.__class__.create_input(
+            label='foo',
+            callable_=self.__class__.create_sample_callable(label='foo'))
+        mime_data = QtCore.QMimeData()
+        mime_data.setUrls([QtCore.QUrl.fromLocalFile('/tmp/a.tif'),
+                           QtCore.QUrl.fromLocalFile('/tmp/b.tif')])
+        event = mock.MagicMock()
+        event.mimeData.return_value = mime_data
+
+        input_instance.dropEvent(event)
+
+        event.accept.assert_called_once_with()
+        self.assertEqual(input_instance.value(), ['/tmp/a.tif', '/tmp/b.tif'])
+
+    def test_paste_lines(self):
+        input_instance = self.__class__.create_input(
+            label='foo',
+            callable_=self.__class__.create_sample_callable(label='foo'))
+        QT_APP.clipboard().setText('/tmp/a.csv\n\n  /tmp/b.csv  \n')
+
+        QTest.keySequence(input_instance, QtGui.QKeySequence.Paste)
+
+        self.assertEqual(input_instance.value(), ['/tmp/a.csv', '/tmp/b.csv'])
+
     def test_add_item_by_link(self):
         input_instance = self.__class__.create_input(
             label='foo',
@@ -845,6 +1349,480 @@ class MultiTest(ContainerTest):
         pass
 
 
+class LayoutSchedulerTest(unittest.TestCase):
+    def test_call_later_once(self):
+        from natcap.ui.inputs import _LayoutScheduler
+        scheduler = _LayoutScheduler()
+        callback = mock.MagicMock()
+        scheduler.call_later(callback, 'foo')
+        scheduler.call_later(callback, 'foo')
+        scheduler.call_later(callback, 'bar')
+        callback.assert_not_called()
+
+        with wait_on_signal(scheduler._timer.timeout):
+            pass
+        self.assertEqual(callback.call_args_list,
+                         [mock.call('foo'), mock.call('bar')])
+
+    def test_flush(self):
+        from natcap.ui.inputs import _LayoutScheduler
+        scheduler = _LayoutScheduler()
+        calls = []
+
+        def _first():
+            calls.append('first')
+            scheduler.call_later(calls.append, 'second')
+
+        scheduler.call_later(_first)
+        scheduler.flush()
+        self.assertEqual(calls, ['first', 'second'])
+
+    def test_deleted_widget(self):
+        from natcap.ui.inputs import _LayoutScheduler
+        scheduler = _LayoutScheduler()
+        widget = QtWidgets.QLabel('foo')
+        scheduler.apply_sizehint(widget)
+        sip.delete(widget)
+        scheduler.flush()  # must not raise
+
+
+class StallDetectorTest(unittest.TestCase):
+    def test_stall(self):
+        from natcap.ui import diagnostics
+        from natcap.ui.inputs import Dropdown
+
+        def _slow_options():
+            time.sleep(0.3)
+            yield 'foo'
+
+        detector = diagnostics.StallDetector(threshold=0.1, interval=0.02)
+        callback = mock.MagicMock()
+        detector.stalled.connect(callback)
+        detector.start()
+        try:
+            QTest.qWait(50)
+            dropdown = Dropdown(label='label')
+            with mock.patch('natcap.ui.diagnostics.LOGGER') as logger:
+                dropdown.set_options(_slow_options())
+                QTest.qWait(50)
+        finally:
+            detector.stop()
+
+        self.assertEqual(callback.call_count, 1)
+        self.assertTrue(callback.call_args[0][0] >= 0.1)
+        # The innermost natcap.ui function that was running.
+        handler = logger.warning.call_args[0][2]
+        self.assertTrue(handler.startswith('natcap.ui.inputs.'))
+        self.assertTrue(handler.endswith('set_options'))
+        self.assertTrue(max(detector.latencies) >= 0.1)
+        # Samples are tallied, not kept, and dropped once the stall is over.
+        self.assertEqual(detector._handlers, collections.Counter())
+        self.assertEqual(detector._last_stack, None)
+
+
+class TracerTest(unittest.TestCase):
+    def tearDown(self):
+        from natcap.ui import diagnostics
+        diagnostics.stop_tracing()
+
+    def test_trace_cascade(self):
+        from natcap.ui import diagnostics
+        from natcap.ui.inputs import Text
+
+        def _validate(args, limit_to=None):
+            return []
+
+        tracer = diagnostics.start_tracing()
+        text = Text(label='text', args_key='text', validator=_validate)
+        tracer.watch(text)
+        text.set_value('foo')
+        wait_until(lambda: not text.lock.locked())
+        self.assertTrue(diagnostics.stop_tracing() is tracer)
+
+        tempdir = tempfile.mkdtemp()
+        try:
+            trace_path = os.path.join(tempdir, 'trace.json')
+            tracer.export(trace_path)
+            with open(trace_path) as trace_file:
+                events = json.load(trace_file)['traceEvents']
+        finally:
+            shutil.rmtree(tempdir)
+
+        spans = dict((event['name'], event) for event in events
+                     if event['ph'] == 'X')
+        text_changed = spans['Text._text_changed']
+        check_sufficiency = spans['Input._check_sufficiency']
+        self.assertTrue('Validator.validate' in spans)
+        # Slots called from an emission are nested in the emitting span.
+        self.assertTrue(text_changed['ts'] <= check_sufficiency['ts'])
+        self.assertTrue(
+            check_sufficiency['ts'] + check_sufficiency['dur'] <=
+            text_changed['ts'] + text_changed['dur'])
+        self.assertTrue('Text.value_changed' in
+                        [event['name'] for event in events
+                         if event['ph'] == 'i'])
+        self.assertTrue('thread_name' in
+                        [event['name'] for event in events
+                         if event['ph'] == 'M'])
+
+    def test_not_tracing(self):
+        from natcap.ui import diagnostics
+
+        @diagnostics.traced()
+        def _function(value):
+            return value * 2
+
+        self.assertEqual(_function(2), 4)
+        tracer = diagnostics.start_tracing()
+        self.assertEqual(_function(3), 6)
+        diagnostics.stop_tracing()
+        self.assertEqual(_function(4), 8)
+        self.assertEqual([event['name'] for event in tracer.events()
+                          if event['ph'] == 'X'],
+                         ['TracerTest.test_not_tracing.<locals>._function'])
+
+
+class DirectoryListerTest(unittest.TestCase):
+    def setUp(self):
+        self.workspace = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.workspace)
+
+    def test_listing_cached(self):
+        from natcap.ui import filesystem
+        os.mkdir(os.path.join(self.workspace, 'subdir'))
+        open(os.path.join(self.workspace, 'file.txt'), 'w').close()
+
+        lister = filesystem.DirectoryLister(ttl=60)
+        callback = mock.MagicMock()
+        lister.listed.connect(callback)
+        self.assertEqual(lister.listing(self.workspace), None)
+        wait_until(lambda: callback.called)
+
+        listing = lister.listing(self.workspace)
+        self.assertEqual(listing.names, ['file.txt', 'subdir'])
+        self.assertEqual(listing.directories, ['subdir'])
+        # Fresh listings are not listed again.
+        lister.join()
+        QTest.qWait(20)
+        self.assertEqual(callback.call_count, 1)
+
+        lister.invalidate(self.workspace)
+        self.assertEqual(lister.listing(self.workspace), None)
+
+    def test_listing_missing_directory(self):
+        from natcap.ui import filesystem
+        lister = filesystem.DirectoryLister()
+        callback = mock.MagicMock()
+        lister.listed.connect(callback)
+        missing = os.path.join(self.workspace, 'missing')
+        lister.listing(missing)
+        wait_until(lambda: callback.called)
+        callback.assert_called_with(missing, None)
+        self.assertEqual(lister.listing(missing), None)
+
+    def test_complete_large_listing(self):
+        from natcap.ui import filesystem
+        names = sorted('file_%05d.txt' % index for index in range(50000))
+        listing = filesystem.Listing(names, [])
+
+        self.assertEqual(filesystem.complete(listing, 'file_4999'),
+                         ['file_4999%s.txt' % index for index in range(10)])
+        self.assertEqual(len(filesystem.complete(listing, 'file', limit=5)),
+                         5)
+        self.assertEqual(
+            filesystem.complete(listing, 'file', directories_only=True), [])
+
+
+class PathWatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.workspace = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.workspace)
+
+    def test_changes_coalesced(self):
+        from natcap.ui import filesystem
+        watcher = filesystem.PathWatcher(delay=100)
+        callback = mock.MagicMock()
+        watcher.paths_changed.connect(callback)
+        paths = [os.path.join(self.workspace, 'file_%s.txt' % index)
+                 for index in range(3)]
+        unchanged_path = os.path.join(self.workspace, 'unchanged.txt')
+        for path in paths + [unchanged_path]:
+            watcher.watch(path)
+
+        for path in paths:
+            with open(path, 'w') as new_file:
+                new_file.write('foo')
+        wait_until(lambda: callback.call_count >= 1)
+        QTest.qWait(150)
+
+        self.assertEqual(callback.call_count, 1)
+        self.assertEqual(callback.call_args[0][0], set(paths))
+
+    def test_replaced_file(self):
+        from natcap.ui import filesystem
+        watcher = filesystem.PathWatcher(delay=20)
+        callback = mock.MagicMock()
+        watcher.paths_changed.connect(callback)
+        path = os.path.join(self.workspace, 'file.txt')
+        open(path, 'w').close()
+        watcher.watch(path)
+
+        for call_count in (1, 2):
+            temporary_path = path + '.tmp'
+            with open(temporary_path, 'w') as new_file:
+                new_file.write('version %s' % call_count)
+            os.rename(temporary_path, path)
+            wait_until(lambda: callback.call_count >= call_count)
+            self.assertEqual(callback.call_count, call_count)
+
+    def test_least_recently_watched_dropped(self):
+        from natcap.ui import filesystem
+        watcher = filesystem.PathWatcher(max_paths=2)
+        paths = [os.path.join(self.workspace, 'file_%s.txt' % index)
+                 for index in range(3)]
+        for path in paths:
+            watcher.watch(path)
+        self.assertEqual(watcher.watched_paths(), paths[1:])
+
+        watcher.watch(paths[1])
+        self.assertEqual(watcher.watched_paths(), [paths[2], paths[1]])
+
+        # paths[1] was watched twice.
+        watcher.unwatch(paths[1])
+        self.assertEqual(watcher.watched_paths(), [paths[2], paths[1]])
+        watcher.unwatch(paths[1])
+        self.assertEqual(watcher.watched_paths(), [paths[2]])
+
+
+class SniffTest(unittest.TestCase):
+    def setUp(self):
+        self.workspace = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.workspace)
+
+    def test_csv(self):
+        from natcap.ui import filesystem
+        path = os.path.join(self.workspace, 'table.csv')
+        with open(path, 'w') as table:
+            table.write('lucode,"name, long",value\n1,a,2\n3,b,4\n')
+
+        metadata = filesystem.sniff(path)
+        self.assertEqual(metadata['columns'], ['lucode', 'name, long',
+                                               'value'])
+        self.assertEqual(metadata['rows'], 2)
+        self.assertFalse(metadata['rows_estimated'])
+
+    def test_large_csv_bounded(self):
+        from natcap.ui import filesystem
+        path = os.path.join(self.workspace, 'table.csv')
+        with open(path, 'w') as table:
+            table.write('id,value\n')
+            for index in range(100000):
+                table.write('%s,%s\n' % (index, index % 10))
+
+        with mock.patch('mmap.mmap', wraps=mmap.mmap) as mmap_call:
+            metadata = filesystem.sniff(path)
+        self.assertEqual(mmap_call.call_args[0][1], filesystem._HEADER_BYTES)
+        self.assertEqual(metadata['columns'], ['id', 'value'])
+        self.assertTrue(metadata['rows_estimated'])
+        # Later rows are longer than those sampled, so there are fewer
+        # than estimated.
+        self.assertTrue(100000 < metadata['rows'] < 130000)
+        self.assertTrue(
+            filesystem.describe(metadata).endswith('rows'))
+
+    def test_geotiff(self):
+        from natcap.ui import filesystem
+        path = os.path.join(self.workspace, 'raster.tif')
+        # width, height, bits per sample, samples per pixel, sample format
+        # and a geokey directory.
+        tags = [(256, 3, 1, 300), (257, 4, 1, 200), (258, 3, 1, 32),
+                (277, 3, 1, 1), (339, 3, 1, 3), (34735, 3, 4, 24)]
+        with open(path, 'wb') as raster:
+            raster.write(b'II' + struct.pack('<HI', 42, 8))
+            raster.write(struct.pack('<H', len(tags)))
+            for tag, field_type, count, value in tags:
+                raster.write(struct.pack('<HHII', tag, field_type, count,
+                                         value))
+            raster.write(struct.pack('<I', 0))
+
+        metadata = filesystem.sniff(path)
+        self.assertEqual(metadata['format'], 'GeoTIFF')
+        self.assertEqual((metadata['width'], metadata['height']), (300, 200))
+        self.assertEqual(metadata['bands'], 1)
+        self.assertEqual(metadata['data_type'], 'float32')
+        self.assertTrue('300 x 200 pixels, 1 band of float32' in
+                        filesystem.describe(metadata))
+
+    def test_shapefile(self):
+        from natcap.ui import filesystem
+        path = os.path.join(self.workspace, 'vector.shp')
+        with open(path, 'wb') as vector:
+            vector.write(struct.pack('>i', 9994) + b'\x00' * 20 +
+                         struct.pack('>i', 50) +
+                         struct.pack('<ii', 1000, 5) + b'\x00' * 64)
+        with open(os.path.join(self.workspace, 'vector.shx'), 'wb') as index:
+            index.write(b'\x00' * (100 + 8 * 12))
+
+        metadata = filesystem.sniff(path)
+        self.assertEqual(metadata['format'], 'ESRI Shapefile')
+        self.assertEqual(metadata['geometry'], 'polygon')
+        self.assertEqual(metadata['features'], 12)
+
+    def test_unknown_and_empty(self):
+        from natcap.ui import filesystem
+        path = os.path.join(self.workspace, 'notes.txt')
+        open(path, 'w').close()
+        metadata = filesystem.sniff(path)
+        self.assertEqual(metadata, {'format': None, 'size': 0})
+        self.assertEqual(filesystem.describe(metadata), 'File, 0 bytes')
+
+
+class OutputMonitorTest(unittest.TestCase):
+    def setUp(self):
+        self.workspace = tempfile.mkdtemp()
+        with open(os.path.join(self.workspace, 'existing.txt'), 'w') as f:
+            f.write('foo')
+
+    def tearDown(self):
+        shutil.rmtree(self.workspace)
+
+    def test_changes_coalesced(self):
+        from natcap.ui import filesystem
+        monitor = filesystem.OutputMonitor(interval=0.5)
+        callback = mock.MagicMock()
+        monitor.files_changed.connect(callback)
+        monitor.start(self.workspace)
+        QTest.qWait(100)
+
+        os.mkdir(os.path.join(self.workspace, 'tiles'))
+        for index in range(50):
+            with open(os.path.join(self.workspace, 'tiles',
+                                   'tile_%s.tif' % index), 'w') as tile:
+                tile.write('x' * 10)
+        monitor.stop()  # Scans one last time.
+        self.assertTrue(monitor.join(timeout=5))
+        QT_APP.processEvents()
+
+        self.assertEqual(callback.call_count, 1)
+        changes, throughput = callback.call_args[0]
+        self.assertEqual(len(changes), 50)
+        self.assertIn((os.path.join('tiles', 'tile_0.tif'), 10, 'created'),
+                      changes)
+        self.assertGreater(throughput, 0)
+
+    def test_modified_and_deleted(self):
+        from natcap.ui import filesystem
+        monitor = filesystem.OutputMonitor(interval=0.5)
+        callback = mock.MagicMock()
+        monitor.files_changed.connect(callback)
+        monitor.start(self.workspace)
+        QTest.qWait(100)
+
+        with open(os.path.join(self.workspace, 'existing.txt'), 'a') as f:
+            f.write('bar')
+        monitor.stop()
+        self.assertTrue(monitor.join(timeout=5))
+        QT_APP.processEvents()
+        self.assertEqual(callback.call_args[0][0],
+                         [('existing.txt', 6, 'modified')])
+
+        monitor.start(self.workspace)
+        QTest.qWait(100)
+        os.remove(os.path.join(self.workspace, 'existing.txt'))
+        monitor.stop()
+        self.assertTrue(monitor.join(timeout=5))
+        QT_APP.processEvents()
+        self.assertEqual(callback.call_args[0][0],
+                         [('existing.txt', 0, 'deleted')])
+
+    def test_polling_fallback(self):
+        from natcap.ui import filesystem
+        # No directories can be watched, so every scan is a full scan.
+        monitor = filesystem.OutputMonitor(interval=0.05, max_directories=0)
+        callback = mock.MagicMock()
+        monitor.files_changed.connect(callback)
+        monitor.start(self.workspace)
+        QTest.qWait(100)
+        self.assertTrue(monitor._polling)
+
+        os.mkdir(os.path.join(self.workspace, 'subdir'))
+        with open(os.path.join(self.workspace, 'subdir', 'new.txt'),
+                  'w') as new_file:
+            new_file.write('foo')
+        wait_until(lambda: callback.call_count)
+        monitor.stop()
+        self.assertTrue(monitor.join(timeout=5))
+
+        self.assertEqual(callback.call_args_list[0][0][0],
+                         [(os.path.join('subdir', 'new.txt'), 3, 'created')])
+
+    def test_stop_does_not_wait(self):
+        from natcap.ui import filesystem
+        monitor = filesystem.OutputMonitor(interval=0.5)
+        callback = mock.MagicMock()
+        monitor.files_changed.connect(callback)
+        monitor.start(self.workspace)
+        QTest.qWait(100)
+
+        def _slow_scan(dirpath):
+            time.sleep(0.5)
+            return iter([])
+
+        with mock.patch('natcap.ui.filesystem._scan_directory',
+                        side_effect=_slow_scan):
+            start_time = time.time()
+            monitor.stop()
+            self.assertLess(time.time() - start_time, 0.25)
+            # Restarted during the last scan, which is then not reported.
+            monitor.start(self.workspace)
+            monitor.stop(last_scan=False)
+            self.assertTrue(monitor.join(timeout=5))
+        QT_APP.processEvents()
+        self.assertEqual(callback.call_count, 0)
+
+
+class FileHasherTest(unittest.TestCase):
+    def setUp(self):
+        self.workspace = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.workspace)
+
+    def test_requests_share_workers(self):
+        from natcap.ui import snapshot
+        hasher = snapshot.FileHasher(max_threads=2)
+        callback = mock.MagicMock()
+        hasher.hashed.connect(callback)
+        paths = []
+        for index in range(10):
+            path = os.path.join(self.workspace, 'file_%s.txt' % index)
+            with open(path, 'w') as data_file:
+                data_file.write('data %s' % index)
+            paths.append(path)
+
+        with mock.patch('natcap.ui.snapshot.hash_file',
+                        wraps=snapshot.hash_file) as hash_file:
+            for _ in range(3):  # Requests while pending aren't queued again.
+                for path in paths:
+                    hasher.request(path)
+            self.assertTrue(hasher.join(timeout=5))
+        QT_APP.processEvents()
+
+        self.assertEqual(hash_file.call_count, len(paths))
+        self.assertEqual(len(hasher._threads), 2)
+        self.assertEqual(callback.call_count, len(paths))
+        self.assertEqual(hasher.pending(), set())
+        self.assertEqual(
+            hasher.request(paths[0]),
+            hashlib.sha256(b'data 0').hexdigest())
+
+
 class ValidationWorkerTest(unittest.TestCase):
     def test_run(self):
         from natcap.ui.inputs import ValidationWorker
@@ -918,70 +1896,110 @@ class FolderButtonTest(unittest.TestCase):
 
 
 class FileDialogTest(unittest.TestCase):
+    def setUp(self):
+        self.workspace = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.workspace)
+
+    @contextlib.contextmanager
+    def select(self, dialog, selected_path, accepted=True):
+        # Patch up the shared QFileDialog to select a path.
+        # Would block on user input otherwise.
+        if accepted:
+            result = QtWidgets.QDialog.Accepted
+        else:
+            result = QtWidgets.QDialog.Rejected
+        with mock.patch.object(dialog.file_dialog, 'exec_',
+                               return_value=result), \
+                mock.patch.object(dialog.file_dialog, 'selectedFiles',
+                                  return_value=[selected_path]):
+            yield
+
+    def test_shared_dialog(self):
+        from natcap.ui import inputs
+        from natcap.ui.inputs import FileDialog, FileButton
+        with mock.patch('natcap.ui.inputs._FILE_DIALOG', None):
+            # Buttons don't create dialogs until they're needed.
+            FileButton('Some title')
+            self.assertEqual(inputs._FILE_DIALOG, None)
+            self.assertTrue(FileDialog().file_dialog is
+                            FileDialog().file_dialog)
+
     def test_save_file_title_and_last_selection(self):
         from natcap.ui.inputs import FileDialog, DATA
         dialog = FileDialog()
-        dialog.file_dialog.getSaveFileName = mock.MagicMock(
-            spec=dialog.file_dialog.getSaveFileName,
-            return_value='/new/file')
+        new_file = os.path.join(self.workspace, 'new', 'file')
 
-        DATA['last_dir'] = '/tmp/foo/bar'
+        DATA['last_dir'] = self.workspace
 
-        out_file = dialog.save_file(title='foo', start_dir=None)
-        self.assertEqual(
-            dialog.file_dialog.getSaveFileName.call_args[0],  # pos. args
-            (dialog.file_dialog, 'foo', '/tmp/foo/bar'))
-        self.assertEqual(out_file, '/new/file')
-        self.assertEqual(DATA['last_dir'], u'/new')
+        with self.select(dialog, new_file):
+            out_file = dialog.save_file(title='foo', start_dir=None)
+        self.assertEqual(dialog.file_dialog.windowTitle(), 'foo')
+        self.assertEqual(dialog.file_dialog.acceptMode(),
+                         QtWidgets.QFileDialog.AcceptSave)
+        self.assertEqual(out_file, new_file)
+        self.assertEqual(DATA['last_dir'], os.path.dirname(new_file))
 
     def test_save_file_defined_savefile(self):
         from natcap.ui.inputs import FileDialog
         dialog = FileDialog()
-        dialog.file_dialog.getSaveFileName = mock.MagicMock(
-            spec=dialog.file_dialog.getSaveFileName,
-            return_value='/new/file')
 
-        out_file = dialog.save_file(title='foo', start_dir='/tmp',
-                                    savefile='file.txt')
-        self.assertEqual(
-            dialog.file_dialog.getSaveFileName.call_args[0],  # pos. args
-            (dialog.file_dialog, 'foo', '/tmp/file.txt'))
+        with self.select(dialog, '/new/file'):
+            dialog.save_file(title='foo', start_dir=self.workspace,
+                             savefile='file.txt')
+        self.assertEqual(dialog.file_dialog.directory().absolutePath(),
+                         self.workspace)
 
     def test_open_file(self):
         from natcap.ui.inputs import FileDialog, DATA
         dialog = FileDialog()
 
-        # patch up the Qt method to get the path to the file to open
-        dialog.file_dialog.getOpenFileName = mock.MagicMock(
-            spec=dialog.file_dialog.getOpenFileName,
-            return_value='/new/file')
-
-        DATA['last_dir'] = '/tmp/foo/bar'
+        DATA['last_dir'] = self.workspace
 
-        out_file = dialog.open_file(title='foo')
-        self.assertEqual(
-            dialog.file_dialog.getOpenFileName.call_args[0],  # pos. args
-            (dialog.file_dialog, 'foo', '/tmp/foo/bar'))
+        with self.select(dialog, '/new/file'):
+            out_file = dialog.open_file(title='foo')
+        self.assertEqual(dialog.file_dialog.windowTitle(), 'foo')
+        self.assertEqual(dialog.file_dialog.fileMode(),
+                         QtWidgets.QFileDialog.ExistingFile)
         self.assertEqual(out_file, '/new/file')
         self.assertEqual(DATA['last_dir'], '/new')
 
-    def test_open_folder(self):
+    def test_open_file_cancelled(self):
         from natcap.ui.inputs import FileDialog, DATA
         dialog = FileDialog()
 
-        # patch up the Qt method to get the path to the file to open
-        dialog.file_dialog.getExistingDirectory = mock.MagicMock(
-            spec=dialog.file_dialog.getExistingDirectory,
-            return_value='/existing/folder')
+        DATA['last_dir'] = self.workspace
 
-        DATA['last_dir'] = '/tmp/foo/bar'
-        new_folder = dialog.open_folder('foo', start_dir=None)
+        with self.select(dialog, '/new/file', accepted=False):
+            out_file = dialog.open_file(title='foo')
+        self.assertEqual(out_file, '')
+        self.assertEqual(DATA['last_dir'], self.workspace)
+
+    def test_open_folder(self):
+        from natcap.ui.inputs import FileDialog, DATA
+        dialog = FileDialog()
 
-        self.assertEqual(dialog.file_dialog.getExistingDirectory.call_args[0],
-                         (dialog.file_dialog, 'Select folder: foo', '/tmp/foo/bar'))
+        DATA['last_dir'] = self.workspace
+        with self.select(dialog, '/existing/folder'):
+            new_folder = dialog.open_folder('foo', start_dir=None)
+
+        self.assertEqual(dialog.file_dialog.windowTitle(),
+                         'Select folder: foo')
+        self.assertEqual(dialog.file_dialog.fileMode(),
+                         QtWidgets.QFileDialog.Directory)
         self.assertEqual(new_folder, '/existing/folder')
         self.assertEqual(DATA['last_dir'], '/existing/folder')
 
+    def test_warm(self):
+        from natcap.ui.inputs import FileDialog, DATA
+        dialog = FileDialog()
+
+        DATA['last_dir'] = self.workspace
+        dialog.warm()
+        self.assertEqual(dialog.file_dialog.directory().absolutePath(),
+                         self.workspace)
+
 
 class InfoButtonTest(unittest.TestCase):
     @unittest.skip("'Always segfaults, don't know why")
@@ -1010,6 +2028,392 @@ class FormTest(unittest.TestCase):
 
         return Form()
 
+    def test_assemble_args(self):
+        from natcap.ui import inputs
+        form = FormTest.make_ui()
+        text = inputs.Text(label='a', args_key='a')
+        checkbox = inputs.Checkbox(label='b', args_key='b')
+        container = inputs.Container(label='c', args_key='c',
+                                     expandable=True)
+        multi = inputs.Multi(label='d', args_key='d',
+                             callable_=functools.partial(inputs.Text,
+                                                         label='x'))
+        form.add_input(text)
+        form.add_input(container)
+        container.add_input(checkbox)  # after the container joined the form
+        container.add_input(multi)
+        form.add_input(inputs.Text(label='no args key'))
+
+        text.set_value('foo')
+        checkbox.set_value(True)
+        multi.add_item()
+        multi.items[0].set_value('bar')
+        self.assertEqual(form.assemble_args(),
+                         {'a': u'foo', 'b': True, 'c': True, 'd': [u'bar']})
+
+        # The returned dict is a copy.
+        form.assemble_args()['a'] = 'baz'
+        self.assertEqual(form.assemble_args()['a'], u'foo')
+
+    def test_form_collected(self):
+        from natcap.ui import inputs
+
+        def _make_form():
+            form = FormTest.make_ui()
+            text = inputs.Text(label='a', args_key='a')
+            form.add_input(text)
+            form.add_input(inputs.Checkbox(label='b', args_key='b'))
+            form.add_rule('b', {'a': inputs.SUFFICIENT})
+            text.set_value('foo')
+            return weakref.ref(form), form.run_dialog.loghandler
+
+        form_ref, loghandler = _make_form()
+        gc.collect()
+        self.assertEqual(form_ref(), None)
+        self.assertNotIn(loghandler, logging.getLogger().handlers)
+
+    def test_input_destroyed(self):
+        from natcap.ui import inputs
+        form = FormTest.make_ui()
+        text = inputs.Text(label='a', args_key='a')
+        form.add_input(text)
+        form.add_input(inputs.Text(label='b', args_key='b'))
+        sip.delete(text)
+        self.assertEqual(form.assemble_args(), {'b': u''})
+
+    def test_validate_with_form_args(self):
+        from natcap.ui import inputs
+        form = FormTest.make_ui()
+        validator = mock.MagicMock(return_value=[])
+        text = inputs.Text(label='a', args_key='a', validator=validator)
+        other = inputs.Text(label='b', args_key='b')
+        form.add_input(text)
+        form.add_input(other)
+        other.set_value('bar')
+
+        with wait_on_signal(text._validator.finished):
+            text.set_value('foo')
+        validator.assert_called_with({'a': u'foo', 'b': u'bar'},
+                                     limit_to='a')
+
+    def test_set_args(self):
+        from natcap.ui import inputs
+        form = FormTest.make_ui()
+        for index in range(200):
+            form.add_input(inputs.Text(label='text', args_key=str(index)))
+        form.set_args(dict((str(index), 'value %s' % index)
+                           for index in range(200)))
+        form.set_args({'not_in_form': 'foo'})
+        self.assertEqual(form.assemble_args()['150'], u'value 150')
+
+    def test_set_args_signals_once(self):
+        from natcap.ui import inputs
+        form = FormTest.make_ui()
+        text = inputs.Text(label='a', args_key='a')
+        checkbox = inputs.Checkbox(label='b', args_key='b')
+        form.add_input(text)
+        form.add_input(checkbox)
+
+        # Each input signals once, after every value has been set.
+        seen_args = []
+        text.value_changed.connect(
+            lambda value: seen_args.append(form.assemble_args()))
+        checkbox.value_changed.connect(
+            lambda value: seen_args.append(form.assemble_args()))
+        with mock.patch.object(text, '_validate') as validate:
+            form.set_args({'a': 'foo', 'b': True})
+        self.assertEqual(seen_args, [{'a': u'foo', 'b': True}] * 2)
+        validate.assert_called_once_with()
+
+    def test_snapshot(self):
+        from natcap.ui import inputs
+        tempdir = tempfile.mkdtemp()
+        try:
+            data_path = os.path.join(tempdir, 'data.txt')
+            with open(data_path, 'w') as data_file:
+                data_file.write('some data')
+            snapshot_path = os.path.join(tempdir, 'snapshot.json')
+
+            form = FormTest.make_ui()
+            data = inputs.File(label='data', args_key='data')
+            workspace = inputs.Folder(label='workspace', args_key='workspace')
+            form.add_input(data)
+            form.add_input(workspace)
+            data.set_value(data_path)
+            workspace.set_value(tempdir)
+            form.save_snapshot(snapshot_path)
+
+            # The file hash is added to the snapshot in the background.
+            form._file_hasher.join()
+            QT_APP.processEvents()
+            with open(snapshot_path) as snapshot_file:
+                saved = json.load(snapshot_file)
+            self.assertEqual(list(saved['files']), [data_path])
+            self.assertEqual(
+                saved['files'][data_path]['sha256'],
+                hashlib.sha256(b'some data').hexdigest())
+
+            new_form = FormTest.make_ui()
+            new_data = inputs.File(label='data', args_key='data')
+            new_workspace = inputs.Folder(label='workspace',
+                                          args_key='workspace')
+            new_form.add_input(new_data)
+            new_form.add_input(new_workspace)
+            self.assertEqual(new_form.load_snapshot(snapshot_path), [])
+            self.assertEqual(new_form.assemble_args(), form.assemble_args())
+
+            with open(data_path, 'a') as data_file:
+                data_file.write('more data')
+            callback = mock.MagicMock()
+            new_form.snapshot_files_changed.connect(callback)
+            self.assertEqual(new_form.load_snapshot(snapshot_path),
+                             [data_path])
+            callback.assert_called_once_with([data_path])
+        finally:
+            shutil.rmtree(tempdir)
+
+    def test_undo_redo(self):
+        from natcap.ui import inputs
+        form = FormTest.make_ui()
+        text = inputs.Text(label='a', args_key='a')
+        checkbox = inputs.Checkbox(label='b', args_key='b')
+        form.add_input(text)
+        form.add_input(checkbox)
+        self.assertFalse(form.undo())
+
+        text.set_value('foo')
+        inputs.LAYOUT_SCHEDULER.flush()
+        form.set_args({'a': 'bar', 'b': True})  # one entry
+
+        self.assertTrue(form.undo())
+        self.assertEqual(form.assemble_args(), {'a': u'foo', 'b': False})
+        self.assertTrue(form.undo())
+        self.assertEqual(form.assemble_args(), {'a': u'', 'b': False})
+        self.assertFalse(form.undo())
+
+        self.assertTrue(form.redo())
+        self.assertTrue(form.redo())
+        self.assertEqual(text.value(), u'bar')
+        self.assertTrue(checkbox.value())
+        self.assertFalse(form.redo())
+
+        # Each entry only holds the args that changed.
+        self.assertEqual([list(entry[1]) for entry in form._undo_history],
+                         [['a'], ['a', 'b']])
+
+    def test_undo_signals_once(self):
+        from natcap.ui import inputs
+        form = FormTest.make_ui()
+        text = inputs.Text(label='a', args_key='a')
+        checkbox = inputs.Checkbox(label='b', args_key='b')
+        form.add_input(text)
+        form.add_input(checkbox)
+        form.set_args({'a': 'foo', 'b': True})
+        inputs.LAYOUT_SCHEDULER.flush()
+
+        # Each input signals once, after every value has been restored.
+        seen_args = []
+        text.value_changed.connect(
+            lambda value: seen_args.append(form.assemble_args()))
+        checkbox.value_changed.connect(
+            lambda value: seen_args.append(form.assemble_args()))
+        with mock.patch.object(text, '_validate') as validate:
+            self.assertTrue(form.undo())
+        self.assertEqual(seen_args, [{'a': u'', 'b': False}] * 2)
+        validate.assert_called_once_with()
+
+    def test_undo_merges_typing(self):
+        from natcap.ui import inputs
+        form = FormTest.make_ui()
+        text = inputs.Text(label='a', args_key='a')
+        form.add_input(text)
+        for value in ('f', 'fo', 'foo'):
+            text.set_value(value)
+            inputs.LAYOUT_SCHEDULER.flush()
+
+        self.assertTrue(form.undo())
+        self.assertEqual(text.value(), u'')
+        self.assertFalse(form.undo())
+
+    def test_autosave(self):
+        from natcap.ui import inputs
+        from natcap.ui import snapshot
+        tempdir = tempfile.mkdtemp()
+        try:
+            recovery_path = os.path.join(tempdir, 'recovery.json')
+            form = FormTest.make_ui()
+            text = inputs.Text(label='a', args_key='a')
+            form.add_input(text)
+
+            with mock.patch('natcap.ui.snapshot._write',
+                            wraps=snapshot._write) as write:
+                self.assertFalse(form.enable_autosave(recovery_path,
+                                                      delay=10))
+                # Nothing is written until something changes.
+                QTest.qWait(50)
+                self.assertEqual(write.call_count, 0)
+                for value in ('f', 'fo', 'foo'):
+                    text.set_value(value)
+                QTest.qWait(100)
+                form._autosaver.join()
+                self.assertEqual(write.call_count, 1)
+
+                # Nothing changed, so nothing is written.
+                form._autosaver.save()
+                form._autosaver.join()
+                self.assertEqual(write.call_count, 1)
+
+            with open(recovery_path) as recovery_file:
+                self.assertEqual(json.load(recovery_file)['args'],
+                                 {'a': 'foo'})
+
+            form.close()
+            self.assertFalse(os.path.exists(recovery_path))
+        finally:
+            shutil.rmtree(tempdir)
+
+    def test_autosave_removed(self):
+        from natcap.ui import inputs
+        tempdir = tempfile.mkdtemp()
+        try:
+            recovery_path = os.path.join(tempdir, 'recovery.json')
+            form = FormTest.make_ui()
+            text = inputs.Text(label='a', args_key='a')
+            form.add_input(text)
+            form.enable_autosave(recovery_path, delay=10)
+
+            def _save(value):
+                text.set_value(value)
+                form._autosaver.save()
+                form._autosaver.join()
+                self.assertTrue(os.path.exists(recovery_path))
+
+            # After a successful run.
+            _save('foo')
+            form.run(target=lambda: None)
+            form._thread.join()
+            QT_APP.processEvents()
+            self.assertFalse(os.path.exists(recovery_path))
+            form.run_dialog.close()
+
+            # When removed while being written.
+            text.set_value('bar')
+            with mock.patch('natcap.ui.snapshot._write',
+                            side_effect=lambda *args: time.sleep(0.2)):
+                form._autosaver.save()
+                QTest.qWait(50)
+                form._autosaver.discard()  # Doesn't wait for the write.
+                self.assertTrue(form._autosaver._remove_when_written)
+                form._autosaver.join()
+            self.assertFalse(form._autosaver._remove_when_written)
+            self.assertFalse(os.path.exists(recovery_path))
+
+            # When the application quits.
+            _save('baz')
+            QT_APP.aboutToQuit.emit()
+            self.assertFalse(os.path.exists(recovery_path))
+            self.assertEqual(form._autosaver, None)
+        finally:
+            shutil.rmtree(tempdir)
+
+    def test_autosave_removed_when_destroyed(self):
+        from natcap.ui import inputs
+        tempdir = tempfile.mkdtemp()
+        try:
+            recovery_path = os.path.join(tempdir, 'recovery.json')
+            form = FormTest.make_ui()
+            text = inputs.Text(label='a', args_key='a')
+            form.add_input(text)
+            form.enable_autosave(recovery_path, delay=10)
+            text.set_value('foo')
+            form._autosaver.save()
+            form._autosaver.join()
+            self.assertTrue(os.path.exists(recovery_path))
+
+            sip.delete(form)
+            self.assertFalse(os.path.exists(recovery_path))
+        finally:
+            shutil.rmtree(tempdir)
+
+    def test_autosave_restore(self):
+        from natcap.ui import inputs
+        from natcap.ui import snapshot
+        tempdir = tempfile.mkdtemp()
+        try:
+            recovery_path = os.path.join(tempdir, 'recovery.json')
+            snapshot.save(recovery_path, {'a': 'foo'})
+            form = FormTest.make_ui()
+            text = inputs.Text(label='a', args_key='a')
+            form.add_input(text)
+
+            with mock.patch('qtpy.QtWidgets.QMessageBox.question',
+                            return_value=QtWidgets.QMessageBox.Yes):
+                self.assertTrue(form.enable_autosave(recovery_path))
+            self.assertEqual(text.value(), u'foo')
+            form.close()
+        finally:
+            shutil.rmtree(tempdir)
+
+    def test_add_rule(self):
+        from natcap.ui import inputs
+        form = FormTest.make_ui()
+        target = inputs.Text(label='x', args_key='x')
+        source = inputs.Text(label='y', args_key='y')
+        dropdown = inputs.Dropdown(label='z', args_key='z',
+                                   options=('foo', 'bar'))
+        for input_ in (target, source, dropdown):
+            form.add_input(input_)
+
+        form.add_rule('x', {'y': inputs.SUFFICIENT, 'z': 'foo'})
+        self.assertFalse(target.interactive)
+
+        source.set_value('some value')
+        self.assertFalse(target.interactive)  # applied on the next loop turn
+        inputs.LAYOUT_SCHEDULER.flush()
+        self.assertTrue(target.interactive)
+
+        dropdown.set_value('bar')
+        inputs.LAYOUT_SCHEDULER.flush()
+        self.assertFalse(target.interactive)
+
+    def test_add_rule_visible(self):
+        from natcap.ui import inputs
+        form = FormTest.make_ui()
+        target = inputs.Text(label='x', args_key='x')
+        checkbox = inputs.Checkbox(label='y', args_key='y')
+        form.add_input(target)
+        form.add_input(checkbox)
+
+        form.add_rule('x', {'y': lambda value: value}, action='visible')
+        self.assertFalse(target.visible())
+
+        checkbox.set_value(True)
+        inputs.LAYOUT_SCHEDULER.flush()
+        self.assertTrue(target.visible())
+
+    def test_add_rule_only_dependents(self):
+        from natcap.ui import inputs
+        form = FormTest.make_ui()
+        for args_key in ('a', 'b', 'c', 'd'):
+            form.add_input(inputs.Text(label=args_key, args_key=args_key))
+        form.add_rule('a', {'b': inputs.SUFFICIENT})
+        form.add_rule('c', {'d': inputs.SUFFICIENT})
+
+        with mock.patch('natcap.ui.inputs._rule_condition_holds',
+                        return_value=True) as condition_holds:
+            form._input('d').set_value('foo')
+            inputs.LAYOUT_SCHEDULER.flush()
+        self.assertEqual(condition_holds.call_count, 1)
+
+    def test_add_rule_missing_input(self):
+        from natcap.ui import inputs
+        form = FormTest.make_ui()
+        form.add_input(inputs.Text(label='x', args_key='x'))
+        with self.assertRaises(ValueError):
+            form.add_rule('x', {'missing': inputs.SUFFICIENT})
+        with self.assertRaises(ValueError):
+            form.add_rule('x', {'x': 'foo'}, action='explode')
+
     def test_run_noerror(self):
         form = FormTest.make_ui()
         form.run(target=lambda: None)
@@ -1051,6 +2455,81 @@ class FormTest(unittest.TestCase):
         QTest.mouseClick(form.run_dialog.backButton,
                          QtCore.Qt.LeftButton)
 
+    def test_output_files_shown(self):
+        thread_event = threading.Event()
+        workspace = tempfile.mkdtemp()
+
+        def _execute(args):
+            with open(os.path.join(workspace, 'result.csv'), 'w') as result:
+                result.write('a,b\n')
+            thread_event.wait()
+
+        form = FormTest.make_ui()
+        form.run_dialog.output_monitor.interval = 0.05
+        try:
+            form.run(target=_execute, kwargs={'args': {}},
+                     out_folder=workspace)
+            model = form.run_dialog.output_files
+            wait_until(model.rowCount)
+            self.assertEqual(model.n_files, 1)
+            self.assertEqual(model.data(model.index(0, 0)), 'result.csv')
+            self.assertEqual(model.data(model.index(0, 2)), 'created')
+            self.assertTrue(form.run_dialog.outputsLabel.text().startswith(
+                'Output files: 1 files, 4 bytes'))
+        finally:
+            thread_event.set()
+            form._thread.join()
+            QT_APP.processEvents()
+            form.run_dialog.close()
+            shutil.rmtree(workspace)
+
+    def test_resource_panel(self):
+        from natcap.ui import execution
+        from natcap.ui import inputs
+        dialog = inputs.FileSystemRunDialog()
+        dialog.resourcePanel.add_sample(execution.ResourceSample(
+            time=0, cpu_percent=150.0, rss=2**30, read_rate=0,
+            write_rate=2**20, available_memory=2**20, total_memory=2**33))
+        self.assertEqual(dialog.resourcePanel.labels['cpu'].text(),
+                         'CPU: 150%')
+        self.assertEqual(dialog.resourcePanel.labels['memory'].text(),
+                         'Memory: 1.0 GB (1.0 MB free)')
+        self.assertIn('color', dialog.resourcePanel.labels[
+            'memory'].styleSheet())
+        self.assertEqual(dialog.resourcePanel.labels['write'].text(),
+                         'Writing: 1.0 MB/s')
+        self.assertEqual(list(dialog.resourcePanel.sparklines['cpu'].values),
+                         [150.0])
+
+        dialog.resourcePanel.clear()
+        self.assertEqual(dialog.resourcePanel.labels['cpu'].text(), 'CPU:')
+        self.assertEqual(dialog.resourcePanel.labels['memory'].styleSheet(),
+                         '')
+        dialog.close()
+
+    def test_run_dialog_stops_threads(self):
+        from natcap.ui import inputs
+        workspace = tempfile.mkdtemp()
+        try:
+            dialog = inputs.FileSystemRunDialog()
+            dialog.start(window_title='', out_folder=workspace)
+            self.assertNotEqual(dialog.output_monitor._thread, None)
+            dialog.done(0)
+            self.assertEqual(dialog.output_monitor._thread, None)
+            self.assertFalse(dialog.resource_sampler.is_sampling())
+            self.assertTrue(dialog.output_monitor.join(timeout=5))
+
+            # Collected without the run finishing, such as when it's lost.
+            dialog.start(window_title='', out_folder=workspace)
+            sampling_stopped = dialog.resource_sampler._stopped
+            scanning_stopped = dialog.output_monitor._stopped
+            del dialog
+            gc.collect()
+            self.assertTrue(sampling_stopped.is_set())
+            self.assertTrue(scanning_stopped.is_set())
+        finally:
+            shutil.rmtree(workspace)
+
     def test_run_prevent_dialog_close_esc(self):
         thread_event = threading.Event()
 
@@ -1261,6 +2740,348 @@ class ExecutionTest(unittest.TestCase):
             shutil.rmtree(tempdir)
 
 
+class InputStagingTest(unittest.TestCase):
+    def setUp(self):
+        self.network_dir = tempfile.mkdtemp()
+        self.scratch_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.network_dir)
+        shutil.rmtree(self.scratch_dir)
+
+    def make_file(self, filename, size=10):
+        path = os.path.join(self.network_dir, filename)
+        with open(path, 'wb') as new_file:
+            new_file.write(b'x' * size)
+        return path
+
+    def run_staged(self, args, keys=('lulc_path', 'aoi_paths')):
+        from natcap.ui.execution import Executor
+        target = mock.MagicMock()
+        executor = Executor(target=target, args=(args,), kwargs=None,
+                            logfile=os.path.join(self.scratch_dir, 'log.txt'),
+                            tempdir=self.scratch_dir, stage_inputs=keys)
+        executor.start()
+        executor.join()
+        self.assertFalse(executor.failed)
+        return target.call_args[0][0]
+
+    def test_stage_inputs(self):
+        lulc_path = self.make_file('lulc.tif')
+        aoi_path = self.make_file('aoi.shp')
+        for extension in ('.shx', '.dbf', '.prj'):
+            self.make_file('aoi' + extension)
+        args = {'workspace_dir': self.network_dir,
+                'lulc_path': lulc_path,
+                'aoi_paths': [aoi_path],
+                'missing_path': os.path.join(self.network_dir, 'missing.tif'),
+                'n_years': 3}
+
+        staged_args = self.run_staged(args)
+
+        from natcap.ui.execution import ScratchSpace
+        # In the user's private scratch directory, not the shared tempdir.
+        staging_dir = os.path.join(ScratchSpace(self.scratch_dir).runs_dir,
+                                   'staged_inputs')
+        staged_lulc = staged_args['lulc_path']
+        self.assertTrue(staged_lulc.startswith(staging_dir))
+        self.assertEqual(os.path.basename(staged_lulc), 'lulc.tif')
+        staged_aoi = staged_args['aoi_paths'][0]
+        self.assertTrue(staged_aoi.startswith(staging_dir))
+        self.assertEqual(sorted(os.listdir(os.path.dirname(staged_aoi))),
+                         ['aoi.dbf', 'aoi.prj', 'aoi.shp', 'aoi.shx'])
+        for key in ('workspace_dir', 'missing_path', 'n_years'):
+            self.assertEqual(staged_args[key], args[key])
+
+        # Unchanged files are reused, changed ones are staged again.
+        with mock.patch('shutil.copy2') as copy:
+            self.assertEqual(self.run_staged(args), staged_args)
+        self.assertEqual(copy.call_count, 0)
+        self.make_file('lulc.tif', size=20)
+        self.assertNotEqual(self.run_staged(args)['lulc_path'], staged_lulc)
+
+    def test_changed_copy_staged_again(self):
+        lulc_path = self.make_file('lulc.tif')
+        staged_lulc = self.run_staged({'lulc_path': lulc_path})['lulc_path']
+        # A run wrote to its staged input.
+        with open(staged_lulc, 'ab') as staged_file:
+            staged_file.write(b'y')
+
+        self.assertEqual(self.run_staged({'lulc_path': lulc_path}),
+                         {'lulc_path': staged_lulc})
+        with open(staged_lulc, 'rb') as staged_file:
+            self.assertEqual(staged_file.read(), b'x' * 10)
+
+    def test_other_users_copy_not_used(self):
+        from natcap.ui.execution import InputStager
+        stager = InputStager(os.path.join(self.scratch_dir, 'staged'))
+        lulc_path = self.make_file('lulc.tif')
+        stager.stage((), {'lulc_path': lulc_path}, ['lulc_path'])
+
+        with mock.patch('os.getuid', return_value=os.getuid() + 1):
+            self.assertEqual(
+                stager.stage((), {'lulc_path': lulc_path}, ['lulc_path']),
+                ((), {'lulc_path': lulc_path}))
+
+    def test_only_inputs_staged(self):
+        dem_path = self.make_file('dem.tif')
+        self.make_file('dem.tif.aux.xml')
+        self.make_file('dem.v2.tif')
+        # An existing output, which the run will overwrite.
+        output_path = self.make_file('slope.tif')
+        args = {'dem_path': dem_path, 'slope_path': output_path}
+
+        staged_args = self.run_staged(args, keys=['dem_path'])
+
+        self.assertEqual(staged_args['slope_path'], output_path)
+        self.assertEqual(
+            sorted(os.listdir(os.path.dirname(staged_args['dem_path']))),
+            ['dem.tif', 'dem.tif.aux.xml'])
+
+    def test_quota(self):
+        from natcap.ui.execution import InputStager
+        stager = InputStager(os.path.join(self.scratch_dir, 'staged'),
+                             quota=150)
+        first_path = self.make_file('first.csv', size=100)
+        second_path = self.make_file('second.csv', size=100)
+
+        staged_first = stager.stage((), {'table': first_path},
+                                    ['table'])[1]['table']
+        staged_second = stager.stage((), {'table': second_path},
+                                     ['table'])[1]['table']
+
+        # The least recently used copy is removed, not the one in use.
+        self.assertFalse(os.path.exists(staged_first))
+        self.assertTrue(os.path.exists(staged_second))
+
+        # Files that won't fit aren't copied at all.
+        large_path = self.make_file('large.csv', size=200)
+        with mock.patch('shutil.copy2') as copy:
+            self.assertEqual(
+                stager.stage((), {'table': large_path}, ['table']),
+                ((), {'table': large_path}))
+        self.assertEqual(copy.call_count, 0)
+
+
+class ScratchSpaceTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_executor_scratch(self):
+        from natcap.ui.execution import Executor
+        seen = {}
+
+        def _target():
+            seen['tempdir'] = tempfile.gettempdir()
+            seen['TMPDIR'] = os.environ['TMPDIR']
+            # Models often leave temporary files behind.
+            os.close(tempfile.mkstemp()[0])
+
+        old_tempdir = tempfile.tempdir
+        old_environment = os.environ.get('TMPDIR')
+        executor = Executor(target=_target, args=None, kwargs=None,
+                            logfile=None, tempdir=self.root)
+        # Nothing is made until the run starts.
+        self.assertEqual(executor.scratch.path, None)
+        self.assertFalse(os.path.exists(executor.scratch.runs_dir))
+        executor.start()
+        executor.join()
+
+        scratch_path = seen['tempdir']
+        self.assertEqual(seen['TMPDIR'], scratch_path)
+        self.assertEqual(os.path.dirname(scratch_path),
+                         executor.scratch.runs_dir)
+        self.assertTrue(os.path.basename(executor.scratch.runs_dir)
+                        .startswith('natcap_ui_runs-'))
+        self.assertFalse(os.path.exists(scratch_path))
+        self.assertEqual(tempfile.tempdir, old_tempdir)
+        self.assertEqual(os.environ.get('TMPDIR'), old_environment)
+        # The log outlives the scratch directory, in the user's directory.
+        self.assertFalse(executor.logfile.startswith(scratch_path))
+        self.assertEqual(os.path.dirname(executor.logfile),
+                         executor.scratch.runs_dir)
+
+    def test_other_users_runs_dir(self):
+        from natcap.ui.execution import ScratchSpace
+        ScratchSpace(self.root).create()
+        with mock.patch('os.getuid', return_value=os.getuid() + 1):
+            self.assertRaises(OSError, ScratchSpace(self.root).create)
+
+    def test_orphans_removed(self):
+        from natcap.ui.execution import ScratchSpace
+        runs_dir = ScratchSpace(self.root).runs_dir
+        # No process has an id this large.
+        orphan = os.path.join(runs_dir, 'run-999999999-abc')
+        orphan_log = os.path.join(runs_dir, 'run-999999999-0.log')
+        ours = os.path.join(runs_dir, 'run-%s-abc' % os.getpid())
+        os.makedirs(orphan)
+        os.makedirs(ours)
+        with open(orphan_log, 'w') as log:
+            log.write('foo')
+
+        scratch = ScratchSpace(self.root)
+        scratch.create()
+
+        self.assertFalse(os.path.exists(orphan))
+        self.assertFalse(os.path.exists(orphan_log))
+        self.assertTrue(os.path.exists(ours))
+        self.assertTrue(os.path.isdir(scratch.path))
+        scratch.remove()
+        self.assertEqual(os.listdir(runs_dir), ['run-%s-abc' % os.getpid()])
+
+    def test_quota(self):
+        from natcap.ui.execution import ScratchSpace
+        scratch = ScratchSpace(self.root, quota=100, check_interval=0.01)
+        scratch.create()
+        with mock.patch('natcap.ui.execution.LOGGER') as logger:
+            with scratch.active() as scratch_path:
+                with open(os.path.join(scratch_path, 'big'), 'wb') as big:
+                    big.write(b'x' * 200)
+                wait_until(lambda: scratch.quota_exceeded)
+        self.assertTrue(scratch.quota_exceeded)
+        self.assertEqual(logger.warning.call_count, 1)
+
+    def test_in_memory_missing(self):
+        from natcap.ui.execution import ScratchSpace
+        with mock.patch('natcap.ui.execution.RAM_SCRATCH_ROOT',
+                        os.path.join(self.root, 'missing')):
+            scratch = ScratchSpace(in_memory=True)
+        self.assertEqual(scratch.root, tempfile.gettempdir())
+
+
+class PreflightTest(unittest.TestCase):
+    def setUp(self):
+        self.workspace = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.workspace)
+
+    def test_free_space(self):
+        from natcap.ui import execution
+        out_folder = os.path.join(self.workspace, 'not', 'created')
+        self.assertEqual(execution._existing_ancestor(out_folder),
+                         self.workspace)
+        self.assertTrue(execution.free_space(out_folder) > 0)
+
+        self.assertEqual(execution.preflight(out_folder, required_space=0),
+                         [])
+        problems = execution.preflight(out_folder, required_space=2**70)
+        self.assertEqual(len(problems), 1)
+        self.assertTrue(problems[0].startswith('Only '))
+
+    def test_write_throughput(self):
+        from natcap.ui import execution
+        throughput = execution.measure_write_throughput(
+            self.workspace, max_bytes=4 * 2**20)
+        self.assertTrue(throughput > 0)
+        # The probe file is removed.
+        self.assertEqual(os.listdir(self.workspace), [])
+
+        # Time spent syncing counts towards the limit.
+        with mock.patch('os.fsync', side_effect=lambda fd: time.sleep(0.1)) \
+                as fsync:
+            execution.measure_write_throughput(self.workspace,
+                                               max_seconds=0.25)
+        self.assertTrue(1 <= fsync.call_count <= 3)
+
+        with mock.patch('natcap.ui.execution.measure_write_throughput',
+                        return_value=2**20):
+            problems = execution.preflight(self.workspace,
+                                           min_write_speed=2**30)
+        self.assertEqual(problems, [
+            'Writing to %s is slow: 1.0 MB/s, where at least 1024.0 MB/s '
+            'is expected.' % self.workspace])
+
+    def test_form_run_cancelled(self):
+        form = FormTest.make_ui()
+        with mock.patch('qtpy.QtWidgets.QMessageBox.question',
+                        return_value=QtWidgets.QMessageBox.No) as question, \
+                mock.patch('natcap.ui.execution.Executor') as executor:
+            self.assertFalse(form.run(target=lambda: None,
+                                      out_folder=self.workspace,
+                                      required_space=2**70))
+        self.assertEqual(question.call_count, 1)
+        self.assertFalse(executor.called)
+
+
+class ResourceSamplerTest(unittest.TestCase):
+    def setUp(self):
+        self.proc_root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.proc_root)
+
+    def make_process(self, pid, utime, rss_pages, write_bytes,
+                     children=()):
+        process_dir = os.path.join(self.proc_root, str(pid))
+        os.makedirs(os.path.join(process_dir, 'task', str(pid)))
+        fields = ['S', '1'] + ['0'] * 9 + [str(utime), '0', '0', '0'] + \
+            ['0'] * 6 + [str(rss_pages)] + ['0'] * 20
+        with open(os.path.join(process_dir, 'stat'), 'w') as stat:
+            stat.write('%s (python (model)) %s' % (pid, ' '.join(fields)))
+        with open(os.path.join(process_dir, 'io'), 'w') as io_file:
+            io_file.write('rchar: 5\nread_bytes: 4096\n'
+                          'write_bytes: %s\n' % write_bytes)
+        with open(os.path.join(process_dir, 'task', str(pid), 'children'),
+                  'w') as children_file:
+            children_file.write(' '.join(str(child) for child in children))
+
+    def test_process_counters(self):
+        from natcap.ui import execution
+        self.make_process(100, utime=250, rss_pages=10, write_bytes=8192,
+                          children=[101])
+        self.make_process(101, utime=0, rss_pages=5, write_bytes=0)
+        with open(os.path.join(self.proc_root, 'meminfo'), 'w') as meminfo:
+            meminfo.write('MemTotal:        2048 kB\n'
+                          'MemFree:          512 kB\n'
+                          'MemAvailable:    1024 kB\n')
+
+        with mock.patch('natcap.ui.execution.PROC_ROOT', self.proc_root):
+            counters = execution.process_counters(100)
+            self.assertEqual(execution._child_pids(100), [101])
+            self.assertEqual(execution.process_counters(102), None)
+            self.assertEqual(execution.system_memory(), (2**20, 2 * 2**20))
+
+        clock_ticks = os.sysconf('SC_CLK_TCK')
+        self.assertEqual(counters, {
+            'cpu_seconds': 250.0 / clock_ticks,
+            'rss': 10 * os.sysconf('SC_PAGE_SIZE'),
+            'read_bytes': 4096,
+            'write_bytes': 8192})
+
+    def test_no_proc(self):
+        from natcap.ui import execution
+        sampler = execution.ResourceSampler()
+        with mock.patch('natcap.ui.execution.PROC_ROOT', self.proc_root):
+            sampler.start()
+        self.assertFalse(sampler.is_sampling())
+
+    @unittest.skipUnless(os.path.isdir('/proc/self'), 'requires /proc')
+    def test_sampled(self):
+        from natcap.ui import execution
+        sampler = execution.ResourceSampler(interval=0.05)
+        callback = mock.MagicMock()
+        sampler.sampled.connect(callback)
+        sampler.start()
+        try:
+            wait_until(lambda: callback.call_count >= 2)
+        finally:
+            sampler.stop()
+        self.assertFalse(sampler.is_sampling())
+        # Nothing is emitted once stopped.
+        n_samples = callback.call_count
+        QTest.qWait(150)
+        self.assertEqual(callback.call_count, n_samples)
+
+        sample = callback.call_args[0][0]
+        self.assertTrue(sample.rss > 0)
+        self.assertTrue(sample.cpu_percent >= 0)
+        self.assertTrue(sample.available_memory <= sample.total_memory)
+
+
 class IntegrationTests(unittest.TestCase):
     def test_checkbox_enables_collapsible_container(self):
         from natcap.ui import inputs